@@ -0,0 +1,172 @@
+"""
+    Run explanation jobs for many instances in parallel, e.g.,
+
+        python batch.py spec.json results.jsonl --workers 16 --memory 8192 --cache-dir cache
+
+    The job spec is a JSON object with lists of instances (names of files in the data directory, wildcards allowed),
+        formulations (keys of `factory.FORMULATIONS`), algorithms (endpoints of `server.InstanceState`) and time limits;
+        one job is run for every combination:
+
+        {"instances": ["Instance*"], "formulations": ["decision"], "algorithms": ["mus", "optimal_mcs", "find_sequence"], "time_limits": [600]}
+
+    Each job runs in its own process, which is killed when it exceeds its time limit and cannot allocate more than the memory cap.
+    Results are appended to a JSON lines file, one line per job, and jobs with a result in that file are skipped.
+"""
+import fnmatch
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import time
+from multiprocessing.connection import wait
+
+from factory import FACTORY_VERSION, FORMULATIONS
+from server import InstanceState, ENDPOINTS, ANYTIME, GRACE
+
+
+class ResultStore:
+    """
+        Append-only store of job results, as a JSON lines file.
+        A line which was only partially written (e.g., when the runner was killed) is ignored.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.results = dict() # key -> result
+        if os.path.exists(fname):
+            with open(fname) as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.results[result["key"]] = result
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def add(self, result):
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.results[result["key"]] = result
+
+
+def make_jobs(spec, data_dir="Benchmarks"):
+    """
+        All jobs of a job spec, larger instances first, so the long jobs do not end up last.
+    """
+    files = sorted(f[:-4] for f in os.listdir(data_dir) if f.endswith(".txt"))
+    instances = [name for pattern in spec["instances"] for name in fnmatch.filter(files, pattern)]
+    instances = sorted(dict.fromkeys(instances), key=lambda name : -os.path.getsize(os.path.join(data_dir, f"{name}.txt")))
+
+    for formulation in spec.get("formulations", ["decision"]):
+        if formulation not in FORMULATIONS:
+            raise ValueError(f"Unknown formulation {formulation}")
+    for algorithm in spec["algorithms"]:
+        if algorithm not in ENDPOINTS:
+            raise ValueError(f"Unknown algorithm {algorithm}")
+
+    hashes = dict()
+    for name in instances:
+        with open(os.path.join(data_dir, f"{name}.txt"), "rb") as f:
+            hashes[name] = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    for name, formulation, algorithm, time_limit in itertools.product(instances, spec.get("formulations", ["decision"]),
+                                                                     spec["algorithms"], spec.get("time_limits", [600])):
+        job = dict(instance=name, formulation=formulation, algorithm=algorithm, time_limit=time_limit,
+                   params=spec.get("params", dict()).get(algorithm, dict()))
+        job["key"] = "/".join([name, hashes[name], formulation, algorithm, str(time_limit), FACTORY_VERSION])
+        yield job
+
+
+def _run_job(conn, job, fname, cache_dir, memory):
+    if memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory * 2**20, memory * 2**20))
+    try:
+        start = time.time()
+        state = InstanceState(fname, job["formulation"], cache_dir=cache_dir)
+        load_time = time.time() - start
+
+        params = dict(job["params"])
+        if job["algorithm"] in ANYTIME:
+            params["time_limit"] = max(1, job["time_limit"] - load_time)
+        start = time.time()
+        result = getattr(state, job["algorithm"])(**params)
+        conn.send(dict(status="ok", result=result, load_time=load_time, runtime=time.time() - start))
+    except MemoryError:
+        conn.send(dict(status="memout"))
+    except Exception as e:
+        conn.send(dict(status="error", error=f"{type(e).__name__}: {e}"))
+
+
+def run_batch(jobs, store, data_dir="Benchmarks", n_workers=None, memory=None, cache_dir=None, retry_failed=False):
+    """
+        Run the jobs which have no result in the store yet, at most `n_workers` at the same time.
+        Yields the result of each job as it finishes.
+
+        :param: memory: maximum memory of a job in MiB
+        :param: retry_failed: also run the jobs whose stored result is not "ok"
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    todo = [job for job in jobs if job["key"] not in store or (retry_failed and store.results[job["key"]]["status"] != "ok")]
+
+    running = dict() # connection -> (job, process, deadline)
+    while len(todo) or len(running):
+        while len(todo) and len(running) < n_workers:
+            job = todo.pop(0)
+            parent, child = multiprocessing.Pipe(duplex=False)
+            fname = os.path.join(data_dir, f"{job['instance']}.txt")
+            process = multiprocessing.Process(target=_run_job, args=(child, job, fname, cache_dir, memory), daemon=True)
+            process.start()
+            child.close()
+            running[parent] = (job, process, time.time() + job["time_limit"] + GRACE)
+
+        timeout = max(0, min(deadline for _, _, deadline in running.values()) - time.time())
+        ready = wait(list(running), timeout=timeout)
+        for conn in list(running):
+            job, process, deadline = running[conn]
+            if conn in ready:
+                try:
+                    outcome = conn.recv()
+                except EOFError: # killed by the OS, e.g., when running out of memory in the solver
+                    process.join()
+                    outcome = dict(status="crashed", error=f"exit code {process.exitcode}")
+            elif time.time() >= deadline:
+                process.kill()
+                outcome = dict(status="timeout")
+            else:
+                continue
+
+            process.join()
+            conn.close()
+            del running[conn]
+            result = dict(job, **outcome, finished=time.strftime("%Y-%m-%d %H:%M:%S"))
+            store.add(result)
+            yield result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run explanation jobs in parallel")
+    parser.add_argument("spec", help="JSON file with the job spec")
+    parser.add_argument("results", help="JSON lines file to append the results to")
+    parser.add_argument("--data-dir", default="Benchmarks")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--memory", type=int, default=None, help="memory cap per job in MiB")
+    parser.add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    store = ResultStore(args.results)
+    jobs = list(make_jobs(spec, args.data_dir))
+    print(f"{len(jobs)} jobs, {sum(job['key'] in store for job in jobs)} already done")
+    for result in run_batch(jobs, store, args.data_dir, args.workers, args.memory, args.cache_dir, args.retry_failed):
+        print(f"{result['instance']:<12}{result['formulation']:<14}{result['algorithm']:<16}{result['status']:<8}"
+              f"{result.get('runtime', float('nan')):>10.2f}s")
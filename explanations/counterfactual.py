@@ -1,65 +1,200 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 import numpy as np
 
 import cpmpy as cp
 from cpmpy.transformations.get_variables import get_variables
 from cpmpy.expressions.core import Expression
+from cpmpy.solvers.ortools import OrtSolutionPrinter
+from cpmpy.solvers.solver_interface import ExitStatus
 
-INFTY = 1000
-
-def inverse_optimize(model:cp.Model, user_sol:dict, allowed_to_change:set, minimize=True):
+from .deadline import Deadline
+from .subset import _timed_solve
 
-    sub_problem = model.copy()
+INFTY = 1000
 
+def inverse_optimize(model:cp.Model, user_sol:dict, allowed_to_change:set, minimize=True, solver="ortools", max_cuts=10, deadline=None, **kwargs):
+    """
+        Find the minimal change in the objective weights such that the user's solution becomes optimal.
+
+        Both the master and the sub-problem are kept in a single solver each, the sub-problem is hinted with its previous solution.
+        With OR-tools, all solutions found by the sub-problem that are better than the user's solution are collected
+            and (at most `max_cuts` of them) added as cuts to the master problem in each iteration.
+        Any keyword arguments are passed to the solve calls of the sub-problem.
+
+        :param: deadline: optional `Deadline`, when it is reached the objective with the weights of the last master solution is returned,
+                            the user's solution may not be optimal for it yet.
+                            The `complete` attribute of the objective tells whether it was proven.
+    """
+    deadline = Deadline.of(deadline)
+    obj_weights, obj_vars = _objective(model)
+    sub_problem = cp.SolverLookup.get(solver, cp.Model(model.constraints))
+    user_arr = _user_array(model, user_sol, obj_vars, minimize, solver, **kwargs)
+    allowed = [i for i, v in enumerate(obj_vars) if v in allowed_to_change]
+
+    new_weights, _, complete = _inverse_optimize(sub_problem, obj_weights, obj_vars, user_arr, allowed, minimize, solver, max_cuts,
+                                                 deadline=deadline, **kwargs)
+    assert new_weights is not None, "the user's solution cannot be made optimal by changing the allowed weights"
+    new_obj = cp.sum(new_weights * obj_vars)
+    new_obj.complete = complete
+    return new_obj
+
+
+def inverse_optimize_batch(model:cp.Model, queries:list, minimize=True, solver="ortools", max_cuts=10, n_workers=4, **kwargs):
+    """
+        Answer a batch of inverse optimization queries against the same model in parallel.
+        Each worker keeps a single sub-problem solver for all queries it answers.
+        Any solution of the sub-problem is a valid cut for every query, so solutions found are shared with all queries submitted afterwards.
+
+        :param queries: list of (user_sol, allowed_to_change) tuples, as in `inverse_optimize`
+        Yields the index of the query and its new objective, in order of completion.
+            The objective is None if the user's solution cannot be made optimal by changing the allowed weights.
+    """
+    obj_weights, obj_vars = _objective(model)
+    todo = iter(enumerate(queries))
+    running = dict() # future -> index of query
+    pool = [] # solutions of the sub-problem
+
+    executor = ProcessPoolExecutor(n_workers, initializer=_init_inverse_worker, initargs=(model, minimize, solver, max_cuts, kwargs))
+    def submit():
+        nxt = next(todo, None)
+        if nxt is not None:
+            i, (user_sol, allowed_to_change) = nxt
+            allowed = [j for j, v in enumerate(obj_vars) if v in allowed_to_change]
+            running[executor.submit(_answer_query, user_sol, allowed, list(pool))] = i
+
+    try:
+        for _ in range(n_workers):
+            submit()
+        while len(running):
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                new_weights, found, _ = future.result()
+                pool.extend(found)
+                submit()
+                yield running.pop(future), None if new_weights is None else cp.sum(new_weights * obj_vars)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _objective(model):
     obj = model.objective_
     assert isinstance(obj, Expression) and obj.name == "wsum"
     obj_weights, obj_vars = obj.args
-    obj_vars = cp.cpm_array(obj_vars)
-    wvars = cp.intvar(-INFTY, INFTY, shape=len(obj_weights))
+    return np.array(obj_weights), cp.cpm_array(obj_vars)
 
-    master_problem = cp.Model()
-    for wvar,w,v in zip(wvars, obj_weights, obj_vars):
-        if v not in allowed_to_change:
-            master_problem += wvar == w
 
+def _user_array(model, user_sol, obj_vars, minimize, solver, **kwargs):
+    """
+        Convert the user's solution to an array of values of the objective vars
+    """
     if len(user_sol) != len(obj_vars):
         # neirest counterfactual explanation case, complete to full assignment of the objective vars
         um = cp.Model(model.constraints + [var == val for var, val in user_sol.items()])
         um.objective(model.objective_, minimize=minimize)
-        assert um.solve()
+        assert cp.SolverLookup.get(solver, um).solve(**kwargs)
         user_sol = {var : var.value() for var in obj_vars}
 
     # covert dict to array in correct order
+    idx_of = {str(var) : i for i, var in enumerate(obj_vars)}
     user_arr = [0 for _ in obj_vars]
     for key, val in user_sol.items():
-        idx = next(i for i, var in enumerate(obj_vars) if str(var) == str(key))
-        user_arr[idx] = val
-
+        user_arr[idx_of[str(key)]] = val
+    return np.array(user_arr, dtype=int)
+
+
+def _inverse_optimize(sub_problem, obj_weights, obj_vars, user_arr, allowed, minimize, solver, max_cuts, pool=None, deadline=None, **kwargs):
+    """
+        Cutting plane loop of the inverse optimization.
+        Returns the new weights, all solutions found by the sub-problem and whether the new weights make the user's solution optimal.
+        The new weights are None if the master problem is infeasible,
+            i.e., the user's solution cannot be made optimal by changing the allowed weights.
+        When the deadline is reached, the weights of the last master solution are returned (the original ones if there is none).
+
+        :param allowed: indices of the weights which are allowed to change
+        :param pool: known solutions of the sub-problem, used as cuts before calling the sub-problem
+    """
+    deadline = Deadline.of(deadline)
+    wvars = cp.intvar(-INFTY, INFTY, shape=len(obj_weights))
+    master_problem = cp.SolverLookup.get(solver)
+    allowed = set(allowed)
+    master_problem += [wvars[i] == w for i, w in enumerate(obj_weights) if i not in allowed]
 
     diff = wvars - obj_weights
     master_problem.minimize(np.linalg.norm(diff,ord=1))
 
+    known = [] if pool is None else list(pool)
+    found = []
+    user_vars = list(sub_problem.user_vars)
+    new_weights = obj_weights
     while 1:
-        assert master_problem.solve() # find minimal perturbation in coefficients
+        if deadline.expired():
+            return new_weights, found, False
+        if not _timed_solve(master_problem, time_limit=deadline.time_limit()): # find minimal perturbation in coefficients
+            if master_problem.status().exitstatus == ExitStatus.UNKNOWN:
+                return new_weights, found, False
+            return None, found, True
+        if master_problem.status().exitstatus != ExitStatus.OPTIMAL: # timed out, the change may not be minimal
+            return wvars.value(), found, False
         new_weights = wvars.value()
-        sub_problem.objective(cp.sum(new_weights * obj_vars), minimize=minimize)
-        assert sub_problem.solve()
 
-        user_objval = (new_weights *  user_arr).sum()
-
-        if minimize:
-            # minimization problem, check if obj val of user is lowest possible with these weights
-            if user_objval <= sub_problem.objective_value():
-                return cp.sum(new_weights * obj_vars)
+        user_objval = new_weights @ user_arr
+        def is_better(objval):
+            # check if obj val of user is worse than this one with these weights
+            return objval < user_objval if minimize else objval > user_objval
+
+        improving = [sol for sol in known if is_better(new_weights @ sol)]
+        if len(improving) == 0:
+            def collect():
+                sol = np.array([v.value() for v in obj_vars], dtype=int)
+                found.append(sol)
+                known.append(sol)
+                if is_better(new_weights @ sol):
+                    improving.append(sol)
+
+            sub_problem.objective(cp.sum(new_weights * obj_vars), minimize=minimize)
+            solve_kwargs = dict(kwargs)
+            if deadline.time_limit() is not None:
+                solve_kwargs["time_limit"] = min(deadline.time_limit(), kwargs.get("time_limit", deadline.time_limit()))
+            if solver == "ortools":
+                solved = sub_problem.solve(solution_callback=OrtSolutionPrinter(sub_problem, display=collect), **solve_kwargs)
+            else:
+                solved = sub_problem.solve(**solve_kwargs)
+                if solved:
+                    collect()
+            if sub_problem.status().exitstatus != ExitStatus.OPTIMAL: # timed out, a better solution than the user's may exist
+                assert solved or sub_problem.status().exitstatus == ExitStatus.UNKNOWN, "the model is infeasible"
+                return new_weights, found, False
+            sub_problem.solution_hint(user_vars, [int(v.value()) for v in user_vars])
+
+            if not is_better(sub_problem.objective_value()):
+                return new_weights, found, True
+
+        improving.sort(key=lambda sol: new_weights @ sol, reverse=not minimize)
+        for sol in improving[:max_cuts]:
+            if minimize:
+                master_problem += cp.sum(wvars * user_arr) <= cp.sum(wvars * sol)
             else:
-                master_problem += cp.sum(wvars * user_arr) <= cp.sum(wvars * obj_vars.value())
+                master_problem += cp.sum(wvars * user_arr) >= cp.sum(wvars * sol)
 
 
-        else:
-            # maximization problem, check if obj val of user is highest possible with these weights
-            if user_objval >= sub_problem.objective_value():
-                return cp.sum(new_weights * obj_vars)
-            else:
-                master_problem += cp.sum(wvars * user_arr) >= cp.sum(wvars * obj_vars.value())
+_inverse_worker = threading.local()
+
+def _init_inverse_worker(model, minimize, solver, max_cuts, kwargs):
+    _inverse_worker.model = model
+    _inverse_worker.obj_weights, _inverse_worker.obj_vars = _objective(model)
+    _inverse_worker.sub_problem = cp.SolverLookup.get(solver, cp.Model(model.constraints))
+    _inverse_worker.minimize = minimize
+    _inverse_worker.solver = solver
+    _inverse_worker.max_cuts = max_cuts
+    _inverse_worker.kwargs = kwargs
+
+
+def _answer_query(user_sol, allowed, pool):
+    w = _inverse_worker
+    user_arr = _user_array(w.model, user_sol, w.obj_vars, w.minimize, w.solver, **w.kwargs)
+    return _inverse_optimize(w.sub_problem, w.obj_weights, w.obj_vars, user_arr, allowed, w.minimize, w.solver, w.max_cuts, pool, **w.kwargs)
 
 
 if __name__ == "__main__":
@@ -78,4 +213,8 @@ if __name__ == "__main__":
 
     print(inverse_optimize(m, user_sol, allowed_changes, minimize=False))
 
+    queries = [({bvars[i] : True}, set([bvars[i]])) for i in range(len(bvars))]
+    for i, new_obj in inverse_optimize_batch(m, queries, minimize=False, n_workers=2):
+        print(i, new_obj)
+
 
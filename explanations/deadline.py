@@ -0,0 +1,74 @@
+"""
+    Shared deadline of explanation calls, which return their best result so far when it is reached,
+        rather than raising a `TimeoutError`.
+"""
+import threading
+from time import time
+
+EPSILON = 0.01
+
+
+class Deadline:
+    """
+        Point in time by which one or more explanation calls must return, e.g.,
+            deadline = Deadline(2)
+            conflict = mus(soft, deadline=deadline)
+            seq = find_sequence(conflict, deadline=deadline)
+        The deadline can also be cancelled from another thread, calls then return as soon as possible.
+    """
+    def __init__(self, time_limit=None):
+        self.end = None if time_limit is None else time() + time_limit
+        self.cancelled = threading.Event()
+
+    @staticmethod
+    def of(deadline=None, time_limit=None):
+        """
+            Deadline of a call taking both a deadline and a time limit, whichever comes first.
+        """
+        if deadline is None:
+            return Deadline(time_limit)
+        return deadline if time_limit is None else deadline.within(time_limit)
+
+    def within(self, time_limit):
+        """
+            Deadline at most `time_limit` seconds from now, cancelled together with this one.
+        """
+        deadline = Deadline(time_limit)
+        if self.end is not None:
+            deadline.end = min(deadline.end, self.end)
+        deadline.cancelled = self.cancelled
+        return deadline
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def remaining(self):
+        """
+            Seconds left, or None if there is no time limit.
+        """
+        if self.cancelled.is_set():
+            return 0
+        if self.end is None:
+            return None
+        return max(self.end - time(), 0)
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= EPSILON
+
+    def time_limit(self):
+        """
+            Time limit to pass to a solver call, None if there is none.
+        """
+        remaining = self.remaining()
+        return None if remaining is None else max(remaining, EPSILON)
+
+
+class Result(list):
+    """
+        Result of an explanation call, which is not `complete` when the deadline was reached before the end,
+            e.g., an UNSAT core which is not minimal yet, or a sequence of steps which does not reach the goal.
+    """
+    def __init__(self, items=(), complete=True):
+        super().__init__(items)
+        self.complete = complete
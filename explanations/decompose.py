@@ -0,0 +1,256 @@
+"""
+    Decomposition of the soft and hard constraints into independent components,
+        i.e., the connected components of the hypergraph with the variables as nodes and the constraints as edges.
+
+    Components share no variables, so each one can be explained on its own (and in parallel):
+        - the whole is UNSAT if and only if some component is, a MUS of an UNSAT component is a MUS of the whole
+        - the union of an MCS of each component is an MCS of the whole, and optimal if each of them is
+        - the MSSes of the whole are the unions of an MSS of each component
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import cpmpy as cp
+from cpmpy.transformations.normalize import toplevel_list
+from cpmpy.transformations.get_variables import get_variables
+
+from .subset import mus_or_none, mcs, optimal_mcs
+from .marco_mcs_mus import do_group_marco
+from .transform import get_solver
+
+
+def components(soft, hard=[]):
+    """
+        Split the constraints into independent components.
+        Hard constraints sharing no variables with any soft constraint form components without soft constraints,
+            hard constraints without variables (e.g., a constant False) are part of every component.
+
+        :return: a list of (indices of the soft constraints, hard constraints) for each component
+    """
+    soft = toplevel_list(soft, merge_and=False)
+    hard = toplevel_list(hard, merge_and=False)
+
+    parent = dict() # union-find over the variables
+    def find(var):
+        while parent[var] is not var:
+            parent[var] = parent[parent[var]]
+            var = parent[var]
+        return var
+
+    scopes = [get_variables(cons) for cons in soft + hard]
+    for scope in scopes:
+        for var in scope:
+            parent.setdefault(var, var)
+        for var in scope[1:]:
+            root, other = find(scope[0]), find(var)
+            if root is not other:
+                parent[other] = root
+
+    found = dict() # root variable (or index of a constraint without variables) -> (soft indices, hard constraints)
+    for i, scope in enumerate(scopes[:len(soft)]):
+        found.setdefault(find(scope[0]) if len(scope) else i, ([], []))[0].append(i)
+    constant = [cons for cons, scope in zip(hard, scopes[len(soft):]) if len(scope) == 0]
+    for cons, scope in zip(hard, scopes[len(soft):]):
+        if len(scope):
+            found.setdefault(find(scope[0]), ([], []))[1].append(cons)
+    if len(found) == 0 and len(constant):
+        found[None] = ([], [])
+    for _, comp_hard in found.values():
+        comp_hard[:0] = constant
+    return list(found.values())
+
+
+def _solve_component(task, soft, hard, kwargs):
+    """
+        Run a task on a single component, returns indices in `soft`.
+    """
+    if len(soft) == 0: # hard constraints only, the empty set is a MUS if they are UNSAT and an MCS otherwise
+        if get_solver(kwargs.get("solver", "ortools"), cp.Model(hard)).solve():
+            return None if task == "mus" else []
+        if task == "mus":
+            return []
+        raise AssertionError("Hard constraints are UNSAT")
+    if task == "mus":
+        found = mus_or_none(soft, hard, **kwargs)
+        if found is None:
+            return None
+        found = {id(cons) for cons in found}
+    elif task == "mcs":
+        found = {id(cons) for cons in mcs(soft, hard, **kwargs)}
+    elif task == "optimal_mcs":
+        found = {id(cons) for cons in optimal_mcs(soft, hard, **kwargs)}
+    else:
+        raise ValueError(f"Unknown task: {task}")
+    return [i for i, cons in enumerate(soft) if id(cons) in found]
+
+
+def _shutdown(executor):
+    """
+        Shut down an executor without waiting for the tasks still running, e.g., after the first UNSAT component is found.
+        Threads cannot be stopped and finish their task in the background, worker processes are killed.
+    """
+    processes = list((getattr(executor, "_processes", None) or dict()).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+
+
+def _map_components(task, soft, comps, kwargs=dict(), pool=None, n_workers=4):
+    """
+        Run a task on each component, yields (index of the component, result) as soon as a result is available.
+        Per-component keyword arguments are given as a function of the indices of the soft constraints of the component.
+    """
+    args = [(task, [soft[i] for i in idxes], hard, kwargs(idxes) if callable(kwargs) else kwargs) for idxes, hard in comps]
+    if pool is None:
+        for c, arg in enumerate(args):
+            yield c, _solve_component(*arg)
+        return
+
+    if pool == "thread":
+        executor = ThreadPoolExecutor(n_workers)
+    elif pool == "process":
+        executor = ProcessPoolExecutor(n_workers)
+    else:
+        raise ValueError(f"Unknown pool type: {pool}, should be None, 'thread' or 'process'")
+    try:
+        futures = {executor.submit(_solve_component, *arg): c for c, arg in enumerate(args)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        _shutdown(executor)
+
+
+def component_mus(soft, hard=[], solver="ortools", pool=None, n_workers=4):
+    """
+        MUS of the first UNSAT component found, all components are checked in parallel when a pool is given.
+
+        :param: pool: None, "thread" or "process"
+    """
+    soft = toplevel_list(soft, merge_and=False)
+    comps = components(soft, hard)
+    # smallest components first, their MUS is found the fastest
+    comps.sort(key=lambda comp : len(comp[0]))
+    for c, found in _map_components("mus", soft, comps, dict(solver=solver), pool, n_workers):
+        if found is not None:
+            return [soft[comps[c][0][i]] for i in found]
+    raise AssertionError("MUS: model must be UNSAT")
+
+
+def component_mcs(soft, hard=[], solver="ortools", pool=None, n_workers=4):
+    """
+        MCS as the union of an MCS of each component.
+    """
+    return _combine_mcs("mcs", soft, hard, lambda idxes : dict(solver=solver), pool, n_workers)
+
+
+def component_optimal_mcs(soft, hard=[], weights=None, solver="ortools", time_limit=None, pool=None, n_workers=4):
+    """
+        (Weighted) minimum correction subset as the union of one for each component.
+        Each component gets the full time limit, when it is reached for a component the best MCS found so far is used.
+    """
+    if weights is not None and not isinstance(weights, (int, float)):
+        weights = list(weights)
+        kwargs = lambda idxes : dict(weights=[weights[i] for i in idxes], solver=solver, time_limit=time_limit)
+    else:
+        kwargs = lambda idxes : dict(weights=weights, solver=solver, time_limit=time_limit)
+    return _combine_mcs("optimal_mcs", soft, hard, kwargs, pool, n_workers)
+
+
+def _combine_mcs(task, soft, hard, kwargs, pool, n_workers):
+    soft = toplevel_list(soft, merge_and=False)
+    comps = components(soft, hard)
+    found = set()
+    for c, res in _map_components(task, soft, comps, kwargs, pool, n_workers):
+        found |= {comps[c][0][i] for i in res}
+    return [soft[i] for i in sorted(found)]
+
+
+def component_marco(soft, hard=[], solver="ortools", pool=None, n_workers=4):
+    """
+        MUS/MSS enumeration with MARCO on each component, yields the results as they are found.
+        MSSes are combined from one MSS of each component, each combination is yielded once all its parts are found.
+        Without a pool, components are enumerated one after the other.
+        When the hard constraints of a component are UNSAT, the empty MUS is the only one and there is no MSS,
+            the enumeration then stops after yielding it.
+    """
+    soft = toplevel_list(soft, merge_and=False)
+    comps = components(soft, hard)
+    # components of hard constraints only first, they are checked with a single solve call
+    comps.sort(key=lambda comp : len(comp[0]))
+    mss_parts = [[] for _ in comps]
+
+    if pool is None:
+        results = ((c, kind, names) # names of the groups are the indices in `soft`
+                   for c, (idxes, comp_hard) in enumerate(comps)
+                   for kind, names in _group_marco({i: [soft[i]] for i in idxes}, comp_hard, solver))
+    else:
+        results = _parallel_marco(soft, comps, solver, pool, n_workers)
+
+    for c, kind, idxes in results:
+        if kind == "MUS":
+            yield ("MUS", [soft[i] for i in idxes])
+            if len(idxes) == 0:
+                return
+            continue
+        # combinations with the new MSS of this component and the known ones of the others
+        parts = mss_parts[:c] + [[idxes]] + mss_parts[c + 1:]
+        for combination in itertools.product(*parts):
+            yield ("MSS", [soft[i] for i in sorted(itertools.chain(*combination))])
+        mss_parts[c].append(idxes)
+
+
+def _group_marco(groups, hard, solver):
+    """
+        `do_group_marco` on a single component, a component without soft constraints has the empty set
+            as its only MUS if its hard constraints are UNSAT, and as its only MSS otherwise.
+    """
+    if len(groups) == 0:
+        yield ("MSS", []) if get_solver(solver, cp.Model(hard)).solve() else ("MUS", [])
+        return
+    yield from do_group_marco(groups, hard, solver=solver)
+
+
+def _marco_component(c, soft, hard, solver, out, stop):
+    try:
+        for kind, names in _group_marco({i: [cons] for i, cons in enumerate(soft)}, hard, solver):
+            if stop.is_set():
+                return
+            out.put((c, kind, names))
+    finally:
+        out.put((c, None, None))
+
+
+def _parallel_marco(soft, comps, solver, pool, n_workers):
+    """
+        Enumerate all components in parallel, yields (index of the component, "MUS" or "MSS", indices in `soft`).
+        Workers stream their results through a queue and stop when the enumeration is closed.
+    """
+    manager = None
+    if pool == "thread":
+        executor, out, stop = ThreadPoolExecutor(n_workers), queue.Queue(), threading.Event()
+    elif pool == "process":
+        manager = multiprocessing.Manager()
+        executor, out, stop = ProcessPoolExecutor(n_workers), manager.Queue(), manager.Event()
+    else:
+        raise ValueError(f"Unknown pool type: {pool}, should be None, 'thread' or 'process'")
+
+    try:
+        futures = [executor.submit(_marco_component, c, [soft[i] for i in idxes], hard, solver, out, stop)
+                   for c, (idxes, hard) in enumerate(comps)]
+        remaining = len(comps)
+        while remaining:
+            c, kind, names = out.get()
+            if kind is None:
+                remaining -= 1
+                continue
+            yield c, kind, [comps[c][0][i] for i in names]
+        for future in futures:
+            future.result() # raise errors of the workers
+    finally:
+        stop.set()
+        _shutdown(executor)
+        if manager is not None:
+            manager.shutdown()
@@ -1,42 +1,56 @@
 
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+
 import cpmpy as cp
 from cpmpy.tools.explain.utils import make_assump_model
 from cpmpy.transformations.get_variables import get_variables
+from cpmpy.transformations.normalize import toplevel_list
+
+from .subset import model_rotation, MemoOracle, _timed_solve
+from .utils import describe, embed, is_symmetric
+from .transform import get_solver
+from .deadline import Deadline, Result
 
-def diagnose(soft, hard=[], solver="ortools", callback=lambda x : None):
+def diagnose(soft, hard=[], solver="ortools", callback=lambda x : None, store=None, deadline=None):
+    """
+        Interactive diagnosis, the user removes a constraint of each conflict shown until the rest is satisfiable.
 
+        :param: deadline: optional `Deadline`, once it is reached the conflicts shown are cores which may not be minimal,
+                            and the diagnosis stops when no conflict can be found anymore (the result is then not `complete`)
+    """
+    deadline = Deadline.of(deadline)
     model, soft, assump = make_assump_model(soft, hard)
     dmap = dict(zip(assump, soft))
-    s = cp.SolverLookup.get(solver, model)
+    s = MemoOracle(get_solver(solver, model), dmap, hard=hard)
+    if store is None:
+        store = ConflictStore(hard)
 
     sat_subset = set(assump)
     corr_subset = []
+    complete = True
 
-    while s.solve(assumptions=list(sat_subset)) is False:
-
-        # find new core
-        core = set(s.get_core())
-
-        for c in sorted(core, key= lambda a : len(get_variables(dmap[a]))):
-            if c not in core:
-                continue # already removed
-            core.remove(c)
-            if s.solve(assumptions=core) is True:
-                # need constraint
-                core.add(c)
-            else: # UNSAT, do clause set refinement
-                core = set(s.get_core())
+    while True:
 
-        core = sorted(core, key=lambda a : str(dmap[a]))
-        mus = [dmap[a] for a in core]
+        # find new core, or re-use a MUS from a previous round
+        core = _find_conflict(s, sat_subset, dmap, store, hard, deadline)
+        if core is None:
+            break
+        if len(core) == 0: # deadline reached before finding a conflict
+            complete = False
+            break
+        minimal = core.complete
+        core = sorted(core, key=lambda a : describe(dmap[a]))
+        mus = Result([dmap[a] for a in core], complete=minimal)
         callback(mus)
-        print("Constraints in conflict:")
+        print("Constraints in conflict:" if minimal else "Constraints in conflict (may not be minimal):")
         for i, c in enumerate(mus):
-            print(f"{i}.", c)
+            print(f"{i}.", describe(c))
 
         print("and already removed constraints:")
         for a in corr_subset:
-            print("-", dmap[a])
+            print("-", describe(dmap[a]))
 
         user_input = input("Chose a constraint to remove (-1 for exit):")
         while len(user_input) <= 0:
@@ -47,58 +61,192 @@ def diagnose(soft, hard=[], solver="ortools", callback=lambda x : None):
         sat_subset.remove(core[idx])
         corr_subset.append(core[idx])
 
-    return [dmap[a] for a in corr_subset]
+    return Result([dmap[a] for a in corr_subset], complete=complete)
+
+
+class ConflictStore:
+    """
+        Remembers the MUSes and correction subsets found during diagnosis, as sets of constraints.
+        A MUS stays a conflict as long as none of its constraints is removed,
+            so it can be served again in a later round without any solving.
+        Correction subsets stay valid in every round, and are used to seed hitting set solvers.
+        Cores found while shrinking are not stored, they are supersets of the MUS they are shrunk to.
+
+        Constraints are identified by their `id`, hashing a constraint is slow for large ones,
+            and different constraints can print the same. `muses` and `corr_subsets` are frozensets of ids,
+            the store keeps the constraints alive so their ids are not reused.
+
+        When the hard constraints are given and stay the same under the symmetries of the model (see `utils.is_symmetric`),
+            a MUS is also served renamed, e.g., for another nurse with the same contract.
+    """
+    def __init__(self, hard=None):
+        self.constraints = dict() # id -> constraint
+        self.muses = []
+        self.corr_subsets = []
+        self.symmetric = hard is not None and is_symmetric(toplevel_list(hard, merge_and=False))
+
+    def _ids(self, constraints):
+        ids = []
+        for cons in constraints:
+            self.constraints.setdefault(id(cons), cons)
+            ids.append(id(cons))
+        return frozenset(ids)
+
+    def add_mus(self, mus):
+        mus = self._ids(mus)
+        if mus not in self.muses:
+            self.muses.append(mus)
+
+    def add_corr_subset(self, corr_subset):
+        corr_subset = self._ids(corr_subset)
+        if corr_subset not in self.corr_subsets:
+            self.corr_subsets.append(corr_subset)
+
+    def get_mus(self, subset):
+        """
+            Get the ids of the smallest known MUS within `subset`, or None if there is none.
+        """
+        subset = list(subset)
+        ids = frozenset(id(cons) for cons in subset)
+        found = min((mus for mus in self.muses if mus <= ids), key=len, default=None)
+        if found is not None or not self.symmetric:
+            return found
+        for mus in sorted(self.muses, key=len):
+            renamed = embed([self.constraints[i] for i in mus], subset)
+            if renamed is not None:
+                self.add_mus(renamed)
+                return frozenset(id(cons) for cons in renamed)
+        return None
+
 
+def _find_conflict(s, sat_subset, dmap, store, hard=[], deadline=None):
+    """
+        Find a MUS in `sat_subset`, returns None if it is satisfiable.
+        A known MUS from the store is served without solving.
+        When the deadline is reached, the core is not `complete`, and empty if none was found.
+    """
+    deadline = Deadline.of(deadline)
+    cmap = {id(cons): a for a, cons in dmap.items()}
+    mus = store.get_mus(dmap[a] for a in sat_subset)
+    if mus is not None:
+        return Result(cmap[i] for i in mus)
 
+    if s.solve(assumptions=list(sat_subset), time_limit=deadline.time_limit()) is True:
+        return None
+    if s.last_core is None: # timed out
+        return Result(complete=False)
+    core = _shrink(s, s.get_core(), dmap, store, hard, deadline)
+    if core.complete:
+        store.add_mus(dmap[a] for a in core)
+    return core
 
-def diagnose_optimal(soft, hard=[], weights=None, solver="ortools", hs_solver="ortools", callback=lambda x : None):
 
+def _shrink(s, core, dmap, store=None, hard=[], deadline=None):
+    """
+        Deletion-based shrinking of an UNSAT core to a MUS, removes constraints with few variables first.
+        The complement of each solution found is a correction subset, these are added to the store.
+        Each solution is also used for model rotation, constraints found to be necessary are not tested anymore.
+        When the deadline is reached, the current core is returned (and not `complete`).
+    """
+    deadline = Deadline.of(deadline)
+    core = set(core)
+    necessary = set()
+    scopes = dict()
+    for c in sorted(core, key= lambda a : len(get_variables(dmap[a]))):
+        if c not in core or c in necessary:
+            continue # already removed, or known to be needed
+        if deadline.expired():
+            return Result(core, complete=False)
+        core.remove(c)
+        is_sat = s.solve(assumptions=list(core), time_limit=deadline.time_limit())
+        if is_sat is not True and s.last_core is None: # timed out
+            core.add(c)
+            return Result(core, complete=False)
+        if is_sat is True:
+            # need constraint
+            core.add(c)
+            if store is not None:
+                store.add_corr_subset(cons for a, cons in dmap.items() if not a.value() and not cons.value())
+            necessary = model_rotation(core, c, dmap, hard, necessary, scopes)
+        else: # UNSAT, do clause set refinement
+            core = set(s.get_core())
+    return Result(core)
+
+
+def diagnose_optimal(soft, hard=[], weights=None, solver="ortools", hs_solver="ortools", callback=lambda x : None, store=None, deadline=None):
+    """
+        Interactive diagnosis as `diagnose`, showing the conflict with the lowest total weight in each round (found with OCUS).
+
+        :param: deadline: optional `Deadline`, once it is reached the conflicts shown are the cores found by the solver,
+                            which may not be optimal nor minimal, and the diagnosis stops when no conflict can be found anymore
+                            (the result is then not `complete`)
+    """
+    deadline = Deadline.of(deadline)
     model, soft, assump = make_assump_model(soft, hard)
     dmap = dict(zip(assump, soft))
-    s = cp.SolverLookup.get(solver, model)
+    cmap = {id(cons): a for a, cons in dmap.items()}
+    s = MemoOracle(get_solver(solver, model), dmap, hard=hard)
+    if store is None:
+        store = ConflictStore(hard)
 
 
     if weights is None:
         weights = [1] * len(soft)
     hs_solver = cp.SolverLookup.get(hs_solver)
     hs_solver.minimize(cp.sum(weights * assump))
+    # seed with known correction subsets, only those over the current soft constraints are usable
+    for known in store.corr_subsets:
+        if all(i in cmap for i in known):
+            hs_solver += cp.sum([cmap[i] for i in known]) >= 1
 
     sat_subset = set(assump)
     corr_subset = []
+    complete = True
 
-    while s.solve(assumptions=list(sat_subset)) is False:
+    while s.solve(assumptions=list(sat_subset), time_limit=deadline.time_limit()) is not True:
+        if s.last_core is None: # deadline reached before finding a conflict
+            complete = False
+            break
+        core = s.get_core() # shown instead of the optimal MUS if the deadline is reached while looking for it
+        optimal = False
 
         # find optimal MUS with OCUS
-        while hs_solver.solve():
+        while not deadline.expired() and _timed_solve(hs_solver, time_limit=deadline.time_limit()):
 
             hitting_set = [a for a in assump if a.value()]
-            if s.solve(assumptions=hitting_set) is False:
-                break # found UNSAT
+            if s.solve(assumptions=hitting_set, time_limit=deadline.time_limit()) is not True:
+                if s.last_core is not None:
+                    core, optimal = hitting_set, True
+                break # found UNSAT, or deadline reached
 
             # else, the hitting set is SAT, now try to extend it without extra solve calls.
             # Check which other assumptions/constraints are satisfied (using c.value())
             # complement of grown subset is a correction subset
-            new_corr_subset = [a for a, c in zip(assump, soft) if a.value() is False and c.value() is False]
+            new_corr_subset = [a for a, c in zip(assump, soft) if not a.value() and not c.value()]
             hs_solver += cp.sum(new_corr_subset) >= 1
+            store.add_corr_subset(dmap[a] for a in new_corr_subset)
 
             # greedily search for other corr subsets disjoint to this one
-            sat_subset = list(new_corr_subset)
-            while s.solve(assumptions=sat_subset) is True:
-                new_corr_subset = [a for a, c in zip(assump, soft) if a.value() is False and c.value() is False]
-                sat_subset += new_corr_subset  # extend sat subset with new corr subset, guaranteed to be disjoint
+            grown = list(new_corr_subset)
+            while s.solve(assumptions=grown, time_limit=deadline.time_limit()) is True:
+                new_corr_subset = [a for a, c in zip(assump, soft) if not a.value() and not c.value()]
+                grown += new_corr_subset  # extend grown subset with new corr subset, guaranteed to be disjoint
                 hs_solver += cp.sum(new_corr_subset) >= 1  # add new corr subset to hitting set solver
+                store.add_corr_subset(dmap[a] for a in new_corr_subset)
 
-        # hitting set is UNSAT, so found optimal MUS
-        core = sorted(hitting_set, key=lambda a : str(dmap[a]))
-        mus = [dmap[a] for a in core]
+        # the optimal MUS, or the core found by the solver when the deadline was reached first
+        if optimal:
+            store.add_mus(dmap[a] for a in core)
+        core = sorted(core, key=lambda a : describe(dmap[a]))
+        mus = Result([dmap[a] for a in core], complete=optimal)
         callback(mus)
-        print("Constraints in conflict:")
+        print("Constraints in conflict:" if optimal else "Constraints in conflict (may not be minimal):")
         for i, c in enumerate(mus):
-            print(f"{i}.", c)
+            print(f"{i}.", describe(c))
 
         print("and already removed constraints:")
         for a in corr_subset:
-            print("-", dmap[a])
+            print("-", describe(dmap[a]))
 
         user_input = input("Chose a constraint to remove (-1 for exit):")
         while len(user_input) <= 0:
@@ -110,6 +258,193 @@ def diagnose_optimal(soft, hard=[], weights=None, solver="ortools", hs_solver="o
         hs_solver += ~core[idx] # disable for future MUSes
         corr_subset.append(core[idx])
 
-    return [dmap[a] for a in corr_subset]
+    return Result([dmap[a] for a in corr_subset], complete=complete)
+
+
+class DiagnosisSession:
+    """
+        Non-blocking version of `diagnose` and `diagnose_optimal`, to be used from async code.
+
+        While the user is inspecting the current conflict, the next MUS is computed in the background
+            for the most likely removal choices, ranked by their weight (lowest weight first).
+        When the user removes one of those constraints, the precomputed MUS is served immediately.
+        All solving happens in a process pool, each worker owns a solver for the whole model.
+        A running computation cannot be cancelled, so speculation leaves one worker free for the MUS the user asks for next,
+            and workers still busy with speculation for other choices are not used for speculation in the next round.
+    """
+    def __init__(self, soft, hard=[], weights=None, optimal=False, solver="ortools", hs_solver="ortools",
+                 n_workers=4, n_speculative=None, store=None):
+        soft = toplevel_list(soft, merge_and=False)
+        self.soft = soft
+        self.index_of = {id(cons): i for i, cons in enumerate(soft)}
+        self.store = ConflictStore(hard) if store is None else store
+        if weights is None:
+            weights = [1] * len(soft)
+        self.weights = list(weights)
+        self.optimal = optimal
+        self.hs_solver = hs_solver
+        self.n_workers = n_workers
+        self.n_speculative = n_workers - 1 if n_speculative is None else min(n_speculative, n_workers - 1)
+
+        self.executor = ProcessPoolExecutor(n_workers, initializer=_init_diagnosis_worker, initargs=(soft, list(hard), solver))
+
+        self.sat_subset = set(range(len(soft)))
+        self.corr_subset = [] # indices of removed constraints
+        self.core = None # indices of the current MUS, in the order presented to the user
+        self.speculative = dict() # index of removed constraint -> future computing the next MUS
+        self.stale = [] # futures of speculation for choices the user did not make, still running
+        self.future = self._submit(self.sat_subset)
+
+    def _submit(self, sat_subset):
+        if not self.optimal:
+            # a known MUS is a conflict in any subset containing it
+            mus = self.store.get_mus(self.soft[i] for i in sat_subset)
+            if mus is not None:
+                future = Future()
+                future.set_result(([self.index_of[i] for i in mus], []))
+                return future
+
+        corr_subsets = [[self.index_of[i] for i in known] for known in self.store.corr_subsets
+                        if all(i in self.index_of for i in known)]
+        return self.executor.submit(_next_mus, sorted(sat_subset), self.optimal,
+                                    self.weights, corr_subsets, self.hs_solver)
+
+    def _collect(self, result):
+        mus, corr_subsets = result
+        for corr_subset in corr_subsets:
+            self.store.add_corr_subset(self.soft[i] for i in corr_subset)
+        if mus is not None:
+            self.store.add_mus(self.soft[i] for i in mus)
+        return mus
+
+    async def conflict(self):
+        """
+            Get the current conflict, returns None if the remaining constraints are satisfiable.
+        """
+        if self.core is None:
+            mus = self._collect(await asyncio.wrap_future(self.future))
+            if mus is None:
+                return None
+            self.core = sorted(mus, key=lambda i: str(self.soft[i]))
+            self._speculate()
+        return [self.soft[i] for i in self.core]
+
+    def _speculate(self):
+        running = []
+        for future in self.stale:
+            if future.done():
+                self._collect(future.result())
+            else:
+                running.append(future)
+        self.stale = running
+        n_free = min(self.n_speculative, self.n_workers - 1 - len(self.stale))
+        ranked = sorted(self.core, key=lambda i: self.weights[i])
+        for i in ranked[:max(n_free, 0)]:
+            self.speculative[i] = self._submit(self.sat_subset - {i})
+
+    async def remove(self, idx):
+        """
+            Remove the constraint at position `idx` of the current conflict, returns the next conflict.
+        """
+        if self.core is None:
+            await self.conflict()
+        i = self.core[idx]
+        self.sat_subset.remove(i)
+        self.corr_subset.append(i)
+
+        future = self.speculative.pop(i, None)
+        for other in self.speculative.values():
+            if other.done():
+                self._collect(other.result())
+            elif not other.cancel():
+                self.stale.append(other)
+        self.speculative = dict()
+
+        self.future = future if future is not None else self._submit(self.sat_subset)
+        self.core = None
+        return await self.conflict()
+
+    @property
+    def corrections(self):
+        return [self.soft[i] for i in self.corr_subset]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class DiagnosisOracle:
+    """
+        Finds the conflicts of `diagnose` and `diagnose_optimal` one round at a time, for any subset of the soft constraints,
+            keeping a single solver for the whole model between rounds (e.g., in the workers of `DiagnosisSession`).
+        Constraints are referred to by their index in `soft`.
+    """
+    def __init__(self, soft, hard=[], solver="ortools"):
+        model, soft, assump = make_assump_model(soft, list(hard))
+        self.soft = soft
+        self.hard = list(hard)
+        self.assump = assump
+        self.solver = MemoOracle(get_solver(solver, model), dict(zip(assump, soft)), hard=self.hard)
+
+    def next_mus(self, sat_subset, optimal=False, weights=None, corr_subsets=(), hs_solver="ortools"):
+        """
+            Find the next MUS in the subset of constraints, as indices.
+            Returns None if the subset is satisfiable, together with the correction subsets found along the way.
+
+            :param: sat_subset: indices of the constraints not removed so far
+            :param: optimal: find the MUS with the lowest total weight, as `diagnose_optimal`
+            :param: corr_subsets: known correction subsets (as indices) to seed the hitting set solver with
+        """
+        s, assump, soft = self.solver, self.assump, self.soft
+        dmap = dict(zip(assump, soft))
+        idx_of = {a: i for i, a in enumerate(assump)}
+
+        if s.solve(assumptions=[assump[i] for i in sat_subset]) is True:
+            return None, []
+
+        if not optimal:
+            store = ConflictStore()
+            core = _shrink(s, s.get_core(), dmap, store, self.hard)
+            cmap = {id(cons): a for a, cons in dmap.items()}
+            return sorted(idx_of[a] for a in core), [[idx_of[cmap[i]] for i in cs] for cs in store.corr_subsets]
+
+        # find optimal MUS with OCUS, only hitting constraints in the sat subset
+        if weights is None:
+            weights = [1] * len(soft)
+        hs_solver = cp.SolverLookup.get(hs_solver)
+        hs_solver.minimize(cp.sum([w * a for w, a in zip(weights, assump)]))
+        excluded = set(range(len(assump))) - set(sat_subset)
+        hs_solver += [~assump[i] for i in excluded]
+        for corr_subset in corr_subsets:
+            hs_solver += cp.sum([assump[i] for i in corr_subset]) >= 1
+
+        new_corr_subsets = []
+        while hs_solver.solve():
+            hitting_set = [a for a in assump if a.value()]
+            if s.solve(assumptions=hitting_set) is False:
+                return sorted(idx_of[a] for a in hitting_set), new_corr_subsets
+
+            # greedily search for disjoint correction subsets, as in `diagnose_optimal`
+            grown = list(hitting_set)
+            while True:
+                corr_subset = [i for i, (a, c) in enumerate(zip(assump, soft)) if not a.value() and not c.value()]
+                hs_solver += cp.sum([assump[i] for i in corr_subset]) >= 1
+                new_corr_subsets.append(corr_subset)
+                grown += [assump[i] for i in corr_subset]
+                if s.solve(assumptions=grown) is False:
+                    break
+
+
+_diagnosis_worker = threading.local()
+
+def _init_diagnosis_worker(soft, hard, solver):
+    _diagnosis_worker.oracle = DiagnosisOracle(soft, hard, solver)
 
 
+def _next_mus(sat_subset, optimal, weights, corr_subsets, hs_solver):
+    return _diagnosis_worker.oracle.next_mus(sat_subset, optimal, weights, corr_subsets, hs_solver)
@@ -6,55 +6,108 @@
     blocking is directly on the maxsat model, so single model...
 """
 
+import cpmpy as cp
 from cpmpy import *
 from cpmpy.transformations.normalize import toplevel_list
 
+from .subset import model_rotation, MemoOracle
+from .transform import get_solver
+from .deadline import Deadline, Result
 
-def do_marco(mdl, solver="ortools"):
+
+def do_marco(mdl, solver="ortools", deadline=None):
     """
         Basic MUS/MCS enumeration, as a simple example.
         
         Warning: all constraints in 'mdl' must support reification!
         Otherwise, you will get an "Or-tools says: invalid" error.
+
+        :param: deadline: optional `Deadline`, when it is reached the enumeration stops,
+                            the MUS or MSS being shrunk or grown at that time is yielded as it is (and not `complete`)
     """
     # ensure toplevel list
     cons = toplevel_list(mdl.constraints, merge_and=False)
 
-    sub_solver = SubsetSolver(cons, solver=solver)
+    deadline = Deadline.of(deadline)
+    sub_solver = SubsetSolver(cons, solver=solver, deadline=deadline)
+    map_solver = MapSolver(len(cons), solver=solver)
+
+    while not deadline.expired():
+        seed = map_solver.next_seed()
+        if seed is None:
+            # all MUS/MSS enumerated
+            return
+
+        is_sat = sub_solver.check_subset(seed)
+        if is_sat is None: # timed out
+            return
+        if is_sat:
+            MSS = sub_solver.grow(seed)
+            yield ("MSS", Result([cons[i] for i in MSS], complete=MSS.complete))
+            map_solver.block_down(MSS)
+        else:
+            seed = sub_solver.seed_from_core()
+            MUS = sub_solver.shrink(seed)
+            yield ("MUS", Result([cons[i] for i in MUS], complete=MUS.complete))
+            map_solver.block_up(MUS)
+
+
+def do_group_marco(groups, hard=[], solver="ortools", deadline=None):
+    """
+        MUS/MCS enumeration over groups of constraints, e.g., as labeled by `factory.group_constraints`.
+        Yields the names of the groups in each MUS or MSS,
+            a MUS over groups can be refined to a MUS over constraints with `explanations.subset.mus`.
+        The deadline is handled as in `do_marco`.
+    """
+    names = list(groups)
+    cons = [cp.all(groups[name]) for name in names]
+
+    deadline = Deadline.of(deadline)
+    sub_solver = SubsetSolver(cons, solver=solver, hard=hard, deadline=deadline)
     map_solver = MapSolver(len(cons), solver=solver)
 
-    while True:
+    while not deadline.expired():
         seed = map_solver.next_seed()
         if seed is None:
             # all MUS/MSS enumerated
             return
 
-        if sub_solver.check_subset(seed):
+        is_sat = sub_solver.check_subset(seed)
+        if is_sat is None: # timed out
+            return
+        if is_sat:
             MSS = sub_solver.grow(seed)
-            yield ("MSS", [cons[i] for i in MSS])
+            yield ("MSS", Result([names[i] for i in MSS], complete=MSS.complete))
             map_solver.block_down(MSS)
         else:
             seed = sub_solver.seed_from_core()
             MUS = sub_solver.shrink(seed)
-            yield ("MUS", [cons[i] for i in MUS])
+            yield ("MUS", Result([names[i] for i in MUS], complete=MUS.complete))
             map_solver.block_up(MUS)
 
 
 class SubsetSolver:
-    def __init__(self, constraints, solver=None, warmstart=False):
+    def __init__(self, constraints, solver=None, warmstart=False, hard=[], deadline=None):
         n = len(constraints)
         self.all_n = set(range(n))  # used for complement
 
         # intialise indicators
-        self.indicators = BoolVar(shape=n)
+        self.indicators = cp.boolvar(shape=n)
+        if n == 1:
+            self.indicators = cpm_array([self.indicators])
         self.idcache = dict((v,i) for (i,v) in enumerate(self.indicators))
         # XXX prefer to remove constraints with more variables first
         self.idpref = [1]*n #[len(get_variables(constraints[i])) for i in self.all_n]
 
+        self.constraints = constraints
+        self.hard = hard
+        self.scopes = dict() # cache for model rotation
+
         # make reified model
-        mdl_reif = Model([ self.indicators[i].implies(con) for i,con in enumerate(constraints) ])
-        self.solver = SolverLookup.get(solver, mdl_reif)
+        mdl_reif = Model(hard, [ self.indicators[i].implies(con) for i,con in enumerate(constraints) ])
+        self.solver = MemoOracle(get_solver(solver, mdl_reif), dict(zip(self.indicators, constraints)), hard=hard)
 
+        self.deadline = Deadline.of(deadline)
         self.warmstart = warmstart
         if warmstart:
             # for warmstarting from a previous solution
@@ -62,13 +115,18 @@ class SubsetSolver:
             self.user_vars_sol = None
 
     def check_subset(self, seed):
+        """
+            Whether the subset is satisfiable, None if the deadline was reached.
+        """
         assump = [self.indicators[i] for i in seed]
         if self.warmstart and self.user_vars_sol is not None:
             # or-tools is not incremental,
             # but we can warmstart with previous solution
             self.solver.solution_hint(self.user_vars, self.user_vars_sol)
 
-        ret = self.solver.solve(assumptions=assump)
+        ret = self.solver.solve(assumptions=assump, time_limit=self.deadline.time_limit())
+        if ret is not True and self.solver.last_core is None:
+            return None
         if self.warmstart and ret is not False:
             # store solution for warm start
             self.user_vars_sol = [v.value() for v in self.user_vars]
@@ -81,28 +139,41 @@ class SubsetSolver:
 
     def shrink(self, seed):
         current = set(seed) # will change during loop
+        necessary = set() # transition constraints, in every MUS of current
         # TODO: there is room for ordering the constraints here
         # E.G. by nr of variables involved...
         for i in sorted(seed, key=lambda i: self.idpref[i]):
-            if i not in current:
+            if i not in current or i in necessary:
                 continue
+            if self.deadline.expired():
+                return Result(current, complete=False)
             current.remove(i)
-            if not self.check_subset(current):
+            is_sat = self.check_subset(current)
+            if is_sat is None: # timed out, the core is still UNSAT with 'i'
+                current.add(i)
+                return Result(current, complete=False)
+            if not is_sat:
                 # if UNSAT, shrink to its core
                 current = self.seed_from_core()
             else:
                 # without 'i' its SAT, so add back
                 current.add(i)
-        return current
+                # find other necessary constraints using the solution
+                necessary = model_rotation(current, i, self.constraints, self.hard, necessary, self.scopes)
+        return Result(current)
 
     def grow(self, seed):
         current = seed
         for i in (self.all_n).difference(seed): # complement
             current.append(i)
-            if not self.check_subset(current):
+            is_sat = self.check_subset(current)
+            if is_sat is None: # timed out
+                current.pop()
+                return Result(current, complete=False)
+            if not is_sat:
                 # if UNSAT, do not add in grow
                 current.pop()
-        return current
+        return Result(current)
 
 
 class MapSolver:
@@ -113,7 +184,9 @@ class MapSolver:
         """
         self.all_n = set(range(n))  # used for complement
 
-        self.indicators = BoolVar(shape=n)
+        self.indicators = cp.boolvar(shape=n)
+        if n == 1:
+            self.indicators = cpm_array([self.indicators])
         # default to true for first next_seed(), "high bias"
         for v in self.indicators:
             v._value = True
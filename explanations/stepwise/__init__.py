@@ -1,32 +1,50 @@
-from .forward import construct_greedy
+from .forward import construct_greedy, construct_from_proof
 from .backward import relax_sequence, filter_sequence
 from .datastructures import DomainSet
+from ..deadline import Result
 
 from cpmpy.transformations.normalize import toplevel_list
 from cpmpy.transformations.get_variables import get_variables
 
 
-def find_sequence(constraints):
+def find_sequence(constraints, deadline=None, next_step="smallest", hs_solver="gurobi", construction="greedy"):
+    """
+        Step-wise explanation of why the constraints are unsatisfiable.
+        When the deadline is reached, the best sequence so far is returned and is not `complete`:
+            a sequence which does not derive the conflict yet, or one which is not filtered or relaxed all the way.
+        The steps are found by enumerating subsets of constraints, or with OCUS if `next_step` is "ocus" (see `construct_greedy`).
+            OCUS steps are cheaper but much slower to find: each one takes hitting set and SAT calls over every literal of the domains,
+            e.g., about 26s on Instance5 against 0.13s when enumerating subsets.
+        With `construction` "proof", the sequence to filter and relax is read from one UNSAT proof instead (see `construct_from_proof`).
+    """
 
     constraints = toplevel_list(constraints, merge_and=False)
     unsat = DomainSet({var : frozenset() for var in get_variables(constraints)})
-    seq = construct_greedy(constraints, unsat, time_limit=100, seed=0)
+    if construction == "greedy":
+        seq = construct_greedy(constraints, unsat, time_limit=100, seed=0, deadline=deadline, next_step=next_step, hs_solver=hs_solver)
+    elif construction == "proof":
+        seq = construct_from_proof(constraints, unsat, time_limit=100, deadline=deadline)
+    else:
+        raise ValueError(f"Unknown construction: {construction}, should be 'greedy' or 'proof'")
     print(f"Found sequence of length {len(seq)}")
-    filtered = filter_sequence(seq, goal_reduction=unsat, time_limit=100)
+    if not seq.complete:
+        return seq # does not reach the conflict, nothing to filter
+    filtered = filter_sequence(seq, goal_reduction=unsat, time_limit=100, deadline=deadline)
     print(f"Filtered sequence to length {len(filtered)}")
-    return relax_sequence(filtered, time_limit=100)
+    relaxed = relax_sequence(filtered, time_limit=100, deadline=deadline)
+    return Result(relaxed, complete=filtered.complete and relaxed.complete)
 
 
-def forward_construction(constraints):
+def forward_construction(constraints, deadline=None):
 
     constraints = toplevel_list(constraints, merge_and=False)
     unsat = DomainSet({var : frozenset() for var in get_variables(constraints)})
-    seq = construct_greedy(constraints, unsat, time_limit=100, seed=1)
+    seq = construct_greedy(constraints, unsat, time_limit=100, seed=1, deadline=deadline)
 
     return seq
 
-def backward_filtering(constraints, seq):
+def backward_filtering(constraints, seq, deadline=None):
 
     unsat = DomainSet({var : frozenset() for var in get_variables(constraints)})
-    filtered = filter_sequence(seq, goal_reduction=unsat, time_limit=100)
+    filtered = filter_sequence(seq, goal_reduction=unsat, time_limit=100, deadline=deadline)
     return filtered
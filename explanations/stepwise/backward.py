@@ -1,26 +1,32 @@
 import copy
+from functools import partial
 from time import time
 import logging
 
 import cpmpy as cp
-from cpmpy.tools.mus import mus
 from cpmpy.transformations.get_variables import get_variables
 from cpmpy.transformations.normalize import toplevel_list
+from cpmpy.solvers.solver_interface import ExitStatus
 
 from .datastructures import DomainSet, EPSILON
 from .propagate import MaximalPropagate, CPPropagate, ExactPropagate, MaximalPropagateSolveAll
-from ..subset import smus
+from ..subset import mus, smus
+from ..deadline import Deadline, Result
+from ..transform import get_solver
 
 
-def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPropagate):
+def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPropagate, deadline=None):
     """
     Filter sequence from redundant steps.
         loops over sequence from back to front and attempts to leave out a step
         if the remaining sequence is still valid, it is removed, otherwise the step is kept in the sequence
+    When the time limit or deadline is reached, the steps not tried yet are kept (and the result is not `complete`),
+        or the input sequence is returned if there is no time left to fix up the domains of the filtered one.
     """
+    orig_seq = seq
     seq = copy.deepcopy(seq)
 
-    start_time = time()
+    deadline = Deadline.of(deadline, time_limit)
 
     constraints = set().union(*[set(step.S) for step in seq])
     propagator = propagator_class(list(constraints), caching=True)
@@ -39,10 +45,12 @@ def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPro
         else:
             conflict_cache[cons] = dict()
 
-        m = cp.Model(list(cons))
+        s = get_solver("ortools", cp.Model(list(cons)))
         for var, dom in Rin.items():
-            m += cp.Table([var], [[val] for val in dom])
-        is_unsat = m.solve() is False
+            s += cp.Table([var], [[val] for val in dom])
+        is_unsat = s.solve(time_limit=deadline.time_limit()) is False
+        if is_unsat and s.status().exitstatus == ExitStatus.UNKNOWN:
+            raise TimeoutError("Filtering timed out")
 
         conflict_cache[cons][Rin] = is_unsat
         return is_unsat
@@ -58,7 +66,7 @@ def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPro
         D = Rin
         unsat = None
         for j, step in enumerate(seq):
-            if time_limit - (time() - start_time) <= EPSILON:
+            if deadline.expired():
                 raise TimeoutError("Filtering timed out")
 
             str_constraints = str([S for _, S, _ in seq[j:]])
@@ -97,14 +105,14 @@ def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPro
                 # can we get there using CP-propagation?
                 Dcp= copy.deepcopy(D)
                 for _,Scp,_ in seq[j:]:
-                    Dcp = cp_propagator.propagate(Dcp, Scp, time_limit=time_limit - (time() - start_time))
+                    Dcp = cp_propagator.propagate(Dcp, Scp, time_limit=deadline.time_limit())
                 # we can get the goal reduction using only CP-steps, so definitely using maxprop steps
                 if Dcp <= goal_reduction:
                     unsat = True
                     break
 
                 # now we have to check what we can deduce from Rin and S
-                D = propagator.propagate(D, step.S, time_limit=time_limit - (time() - start_time))
+                D = propagator.propagate(D, step.S, time_limit=deadline.time_limit())
             else:
                 # no conflict left in constraints, definitely not in stepwise manner either
                 unsat = False
@@ -124,56 +132,68 @@ def filter_sequence(seq, goal_reduction, time_limit, propagator_class=MaximalPro
         return unsat
 
     # iterate over sequence from back to front
+    complete = True
     i = len(seq)-1
     while i >= 0:
         # try deleting step i and check if still valid sequence
-        if _try_deletion(seq[i].Rin, seq[i+1:]):
-            seq.pop(i)
+        try:
+            if _try_deletion(seq[i].Rin, seq[i+1:]):
+                seq.pop(i)
+        except TimeoutError:
+            complete = False
+            break
         i -= 1
 
     # now fixup all domains in the sequence
     # set input domain to given set
     seq[0].Rin = DomainSet.from_literals(seq[0].Rin.keys(), {})
-    for i, step in enumerate(seq):
-        step.Rout = propagator.propagate(step.Rin, step.S, time_limit=time_limit-(time() - start_time))
-        if i < len(seq)-1:
-            seq[i+1].Rin = step.Rout
-        if step.Rout <= goal_reduction:
-            return seq[:i+1]
-
-    return seq
-
-def relax_sequence(seq, mus_type="mus", time_limit=3600):
+    try:
+        for i, step in enumerate(seq):
+            step.Rout = propagator.propagate(step.Rin, step.S, time_limit=deadline.time_limit())
+            if i < len(seq)-1:
+                seq[i+1].Rin = step.Rout
+            if step.Rout <= goal_reduction:
+                return Result(seq[:i+1], complete=complete)
+    except TimeoutError:
+        return Result(copy.deepcopy(orig_seq), complete=False)
+
+    return Result(seq, complete=complete)
+
+def relax_sequence(seq, mus_type="mus", time_limit=3600, deadline=None):
     """
     Minimizes input literals for each step.
     Keeps a set of literals that need to be derived, only derive those in previous steps.
+    When the time limit or deadline is reached, the steps not relaxed yet keep their input literals,
+        and the inputs of a step being relaxed may not be minimal (the result is then not `complete`).
     """
     seq = copy.deepcopy(seq)
 
-    start_time = time()
+    deadline = Deadline.of(deadline, time_limit)
 
     all_constraints = set().union(*[set(step.S) for step in seq])
     propagator = MaximalPropagate(constraints = list(all_constraints))
 
     if mus_type == "mus":
-        get_mus = mus
+        get_mus = partial(mus, deadline=deadline)
     elif mus_type == "smus":
-        get_mus = smus
+        get_mus = partial(smus, deadline=deadline)
     else:
         raise ValueError(f"Unknown MUS-type: {mus_type}")
 
     soft = list(seq[-1].Rin.literals())
     if len(soft):
-        lits_in = mus(soft=list(seq[-1].Rin.literals()), hard=seq[-1].S)
+        lits_in = mus(soft=list(seq[-1].Rin.literals()), hard=seq[-1].S, deadline=deadline)
+        complete = lits_in.complete
         seq[-1].Rin = DomainSet.from_literals(seq[-1].Rin.keys(), lits_in)
         R = seq[-1].Rin.literals()
         i = len(seq)-2
     else:
-        return seq # length of sequence = 1
+        return Result(seq) # length of sequence = 1
 
     while i >= 0:
-        if time_limit - (time() - start_time) <= EPSILON:
-            raise TimeoutError("Relaxing sequence timed out")
+        if deadline.expired():
+            complete = False
+            break
         step = seq[i]
         # find the set of literals derived in this step we actually need later in the sequence
         newlits = step.Rout.literals() - step.Rin.literals()
@@ -208,15 +228,19 @@ def relax_sequence(seq, mus_type="mus", time_limit=3600):
                 lits_in2 = get_mus(list(soft2), hard2)
 
             lits_in = set(lits_in1) | set(lits_in2)
+            complete = complete and all(getattr(lits, "complete", True) for lits in (lits_in1, lits_in2))
             step.Rin = DomainSet.from_literals(step.Rin.keys(), lits_in)
 
-            step.Rout = propagator.propagate(domains=step.Rin, constraints=list(step.S), time_limit=time_limit-(time()-start_time))
+            try:
+                step.Rout = propagator.propagate(domains=step.Rin, constraints=list(step.S), time_limit=deadline.time_limit())
+            except TimeoutError:
+                complete = False # the required literals in Rout still follow from Rin
 
             # update required literals
             R = (R - step.Rout.literals()) | step.Rin.literals()
 
         i -= 1
-    return make_pertinent(seq)
+    return Result(make_pertinent(seq), complete=complete)
 
 
 def filter_simple(seq, time_limit=3600):
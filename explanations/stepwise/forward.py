@@ -1,13 +1,22 @@
 from time import time
+import gc
 import logging
+import os
+import re
+import tempfile
 from itertools import combinations
+from functools import partial
 
 import random
 import numpy as np
 
+import cpmpy as cp
 from cpmpy.transformations.get_variables import get_variables
+from cpmpy.solvers.solver_interface import ExitStatus
 
 from .datastructures import Step, DomainSet, EPSILON
+from ..deadline import Deadline, Result
+from ..subset import OCUSSession
 from .propagate import CPPropagate, MaximalPropagate, ExactPropagate, MaximalPropagateSolveAll
 
 
@@ -35,17 +44,19 @@ def connected_network(constraints):
 
 
 
-def smallest_next_step(domains, constraints, propagator, time_limit=3600):
+def smallest_next_step(domains, constraints, propagator, time_limit=3600, deadline=None):
     """
     Computes the smallest next step given input domains and a list of constraints.
     Iterate over all subsets of constraints and check if anything can be propagated
     :param domains: a DomainSet representing the domains of variables
     :param constraints: a list of CPMpy constraints
     :param propagator: a propagator, can be maximal but not required
+    :param deadline: optional `Deadline`, shared with other calls, a TimeoutError is raised when it is reached
     :return: The smallest step in terms of constraints deriving a new literal
     """
 
     start_time = time()
+    deadline = Deadline.of(deadline, time_limit)
 
     sorted(constraints, key=lambda x: str(x))
     candidates = []
@@ -54,7 +65,7 @@ def smallest_next_step(domains, constraints, propagator, time_limit=3600):
         #print(f"Propagating constraint sets of size {size}")
 
         for i, cons in enumerate(combinations(constraints,size)):
-            if time_limit - (time() - start_time) <= EPSILON:
+            if deadline.expired():
                 raise TimeoutError(f"'all_max_steps' timed out after {time() - start_time} seconds")
             if size == 2:
                 if set(get_variables(cons[0])).isdisjoint(set(get_variables(cons[1]))):
@@ -63,7 +74,7 @@ def smallest_next_step(domains, constraints, propagator, time_limit=3600):
             elif not connected_network(cons):
                 continue # will never propagate anything new compared to its strict subsets (which are already checked in previous iteration)
 
-            new_domains = propagator.propagate(domains, list(cons), time_limit=time_limit -(time() - start_time))
+            new_domains = propagator.propagate(domains, list(cons), time_limit=deadline.time_limit())
             if new_domains == domains:
                 # nothing propagated, skip
                 continue
@@ -77,6 +88,53 @@ def smallest_next_step(domains, constraints, propagator, time_limit=3600):
     raise ValueError("Exhausted all subsets of constraints without sucessfull propagation, is the propagator maximal?")
 
 
+class OCUSNextStep:
+    """
+    Alternative to `smallest_next_step`, finds the cheapest explanation of a single new literal with OCUS (see `subset.OCUSSession`)
+        instead of propagating all subsets of constraints in increasing size.
+    An explanation is a set of constraints and literals of the current domains which imply the new literal,
+        its cost is the sum of `constraint_cost` over the constraints and `literal_cost` over the literals (numbers or functions of them).
+    The oracle and the sets to hit are kept across literals and steps, the step then propagates the constraints of the explanation.
+    """
+
+    def __init__(self, constraints, propagator, constraint_cost=100, literal_cost=1, solver="ortools", hs_solver="gurobi"):
+        self.constraints = list(constraints)
+        self.propagator = propagator
+        self.lits = [(var, val) for var in get_variables(self.constraints) for val in range(var.lb, var.ub+1)]
+        # soft constraints are the constraints, the literals which can be in the domains and their negations to explain
+        soft = self.constraints + [var != val for var, val in self.lits] + [var == val for var, val in self.lits]
+        self.session = OCUSSession(soft, solver=solver, hs_solver=hs_solver)
+
+        cost = lambda c, x : c(x) if callable(c) else c
+        self.weights = [cost(constraint_cost, cons) for cons in self.constraints] + \
+                       [cost(literal_cost, var != val) for var, val in self.lits] + [0] * len(self.lits)
+
+    def __call__(self, domains, deadline=None):
+        """
+        :param domains: a DomainSet representing the domains of variables
+        :param deadline: optional `Deadline`, a TimeoutError is raised when it is reached
+        :return: The cheapest step deriving a new literal, propagated with the propagator
+        """
+        deadline = Deadline.of(deadline)
+        n_cons, n_lits = len(self.constraints), len(self.lits)
+        subset, oneof = list(range(n_cons)), []
+        for i, (var, val) in enumerate(self.lits):
+            if val in domains[var]:
+                oneof.append(n_cons + n_lits + i)
+            else:
+                subset.append(n_cons + i)
+
+        found = self.session.ocus(subset + oneof, oneof, [self.weights[i] for i in subset + oneof], time_limit=deadline.time_limit())
+        if found is None:
+            raise ValueError("No new literal can be derived from the constraints, are they UNSAT?")
+
+        cons = [self.constraints[i] for i in found if i < n_cons]
+        new_domains = self.propagator.propagate(domains, cons, time_limit=deadline.time_limit())
+        if not new_domains < domains:
+            raise ValueError("The explained literal was not propagated, is the propagator maximal?")
+        return Step(domains, cons, new_domains, type="max")
+
+
 def make_maximal(sequence, propagator):
     """
     :param sequence: a sequence of explanations steps
@@ -113,9 +171,14 @@ def make_maximal(sequence, propagator):
     return sequence
 
 
-def construct_greedy(constraints, goal_reduction, time_limit, seed):
+def construct_greedy(constraints, goal_reduction, time_limit, seed, deadline=None, next_step="smallest", hs_solver="gurobi"):
+    """
+    Greedily construct a sequence of smallest steps until the goal reduction is reached.
+    When the time limit or deadline is reached, the sequence found so far is returned (and not `complete`).
+    :param next_step: "smallest" to find each step with `smallest_next_step`, or "ocus" for the cheapest steps with `OCUSNextStep`
+    """
 
-    start_time = time()
+    deadline = Deadline.of(deadline, time_limit)
     random.seed(seed)
     np.random.seed(seed)
 
@@ -123,13 +186,19 @@ def construct_greedy(constraints, goal_reduction, time_limit, seed):
     # max_propagator = CPPropagate(constraints=constraints, caching=False)
     #max_propagator = MaximalPropagateSolveAll(constraints=constraints, caching=True)
     max_propagator = MaximalPropagate(constraints=constraints, caching=True)
+    if next_step == "smallest":
+        find_step = lambda domains : smallest_next_step(domains, constraints, max_propagator, deadline=deadline)
+    elif next_step == "ocus":
+        find_step = partial(OCUSNextStep(constraints, max_propagator, hs_solver=hs_solver), deadline=deadline)
+    else:
+        raise ValueError(f"Unknown next step: {next_step}, should be 'smallest' or 'ocus'")
 
     domains = DomainSet({var : frozenset(range(var.lb, var.ub+1)) for var in get_variables(constraints)})
     seq = [Step(domains, [], domains, type="max", guided=False)]
 
     while 1:
-        if time_limit - (time() - start_time) <= EPSILON:
-            raise TimeoutError(f"'construct_beam' timed out after {time() - start_time} seconds")
+        if deadline.expired():
+            return Result(seq[1:], complete=False)
 
         prev_step = seq[-1]
         _,_,domains = prev_step
@@ -137,9 +206,114 @@ def construct_greedy(constraints, goal_reduction, time_limit, seed):
         #print(f"{sum(len(dom) for dom in domains.values())} literals left")
 
         # find next smallest step
-        next_step = smallest_next_step(domains, constraints, max_propagator, time_limit=time_limit - (time() - start_time))
-        seq.append(next_step)
-        if next_step.Rout <= goal_reduction:
+        try:
+            step = find_step(domains)
+        except TimeoutError:
+            return Result(seq[1:], complete=False)
+        seq.append(step)
+        if step.Rout <= goal_reduction:
             break
 
-    return seq[1:] # prune first dummy state
+    return Result(seq[1:]) # prune first dummy state
+
+
+def proof_skeleton(constraints, deadline=None):
+    """
+    Runs one UNSAT proof of the constraints with Exact and reads the sets of constraints used in its derivations from the proof log.
+    Every constraint is posted as `ind -> cons` with the indicators as the first variables of the solver (`x1`, ..., `xn` in the log),
+        so a constraint of the formula or a lemma (`rup`) depends on the constraints whose indicators occur in it,
+        and a cutting planes derivation (`pol`) depends on the constraints its antecedents depend on.
+    :param deadline: optional `Deadline`, a TimeoutError is raised when it is reached before the proof is found
+    :return: the sets of constraints in the order they were used, and the core of constraints found UNSAT
+    """
+    deadline = Deadline.of(deadline)
+    constraints = list(constraints)
+    indicators = list(cp.boolvar(shape=len(constraints), name="prf")) if len(constraints) > 1 else [cp.boolvar(name="prf")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "proof")
+        solver = cp.SolverLookup.get("exact", **{"proof-log": fname, "verbosity": 0})
+        solver.solver_vars(indicators) # the first variables of the proof log
+        for ind, cons in zip(indicators, constraints):
+            solver += ind.implies(cons)
+        if solver.solve(assumptions=indicators, time_limit=deadline.time_limit()):
+            raise ValueError("The constraints are satisfiable, there is no proof to read steps from")
+        if solver.status().exitstatus == ExitStatus.UNKNOWN:
+            raise TimeoutError("Proof logging timed out")
+        core = [constraints[indicators.index(ind)] for ind in solver.get_core()]
+        # Exact only writes the rest of the log and closes its files when it is deleted
+        del solver
+        gc.collect()
+
+        def depends_on(line):
+            return frozenset(int(i)-1 for i in re.findall(r"x(\d+)\b", line) if int(i) <= len(constraints))
+
+        with open(f"{fname}.formula") as f:
+            formula = [depends_on(line) for line in f if not line.startswith(("*", "min:")) and line.strip()]
+
+        deps = [None] # dependencies of every constraint in the proof, by id
+        skeleton = []
+        with open(f"{fname}.proof") as f:
+            for line in f:
+                rule, _, rest = line.strip().partition(" ")
+                if rule == "f":
+                    deps += formula
+                elif rule == "l":
+                    idx = int(rest.split()[0]) - 1
+                    if not 0 <= idx < len(formula):
+                        raise ValueError(f"Proof log refers to constraint {idx+1} of a formula with {len(formula)} constraints")
+                    deps.append(formula[idx])
+                elif rule in ("u", "rup", "ia", "j", "a", "red"):
+                    deps.append(depends_on(rest))
+                elif rule in ("p", "pol"): # reverse polish notation over ids of earlier constraints
+                    stack = []
+                    dep = lambda x : deps[x] if isinstance(x, int) else x
+                    for token in rest.split():
+                        if token.isdigit():
+                            stack.append(int(token)) # an id, or a constant if followed by "*" or "d"
+                        elif token in ("*", "d", "w"):
+                            stack.pop() # drop the constant or weakened literal
+                        elif token == "+":
+                            stack.append(dep(stack.pop()) | dep(stack.pop()))
+                        elif token != "s":
+                            stack.append(frozenset()) # literal axiom
+                    deps.append(frozenset().union(*map(dep, stack)))
+                else:
+                    continue # comments, deletions and conclusions do not derive anything
+                if rule not in ("f", "l") and len(deps[-1]) > 0:
+                    skeleton.append(deps[-1])
+
+    skeleton = list(dict.fromkeys(skeleton))
+    return [[constraints[i] for i in sorted(cons)] for cons in skeleton], core
+
+
+def construct_from_proof(constraints, goal_reduction, time_limit, deadline=None):
+    """
+    Construct a sequence from the derivations in one UNSAT proof of the constraints (see `proof_skeleton`),
+        instead of searching for every next step as in `construct_greedy`.
+    Each set of constraints in the proof is propagated from the domains so far and kept as a step if it derives something new,
+        a last step propagates the core found UNSAT if the goal reduction is not reached yet.
+    The sequence is not minimal, it is meant as a starting point for `filter_sequence` and `relax_sequence`.
+    When the time limit or deadline is reached, the sequence found so far is returned (and not `complete`).
+    """
+    deadline = Deadline.of(deadline, time_limit)
+    max_propagator = MaximalPropagate(constraints=constraints, caching=True)
+
+    domains = DomainSet({var : frozenset(range(var.lb, var.ub+1)) for var in get_variables(constraints)})
+    seq = []
+    try:
+        skeleton, core = proof_skeleton(constraints, deadline=deadline)
+        logging.info(f"Read {len(skeleton)} sets of constraints from the proof")
+        for cons in skeleton + [core]:
+            if deadline.expired():
+                return Result(seq, complete=False)
+            new_domains = max_propagator.propagate(domains, cons, time_limit=deadline.time_limit())
+            if new_domains < domains:
+                seq.append(Step(domains, cons, new_domains, type="max"))
+                domains = new_domains
+            if domains <= goal_reduction:
+                break
+    except TimeoutError:
+        return Result(seq, complete=False)
+
+    return Result(seq)
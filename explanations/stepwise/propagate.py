@@ -8,6 +8,8 @@ from cpmpy.expressions.utils import is_any_list
 
 
 from .datastructures import DomainSet, EPSILON
+from ..utils import canonical_form
+from ..transform import get_solver
 
 def propagate(constraints, type="max"):
     if type == "max":
@@ -28,6 +30,8 @@ class Propagator:
     def __init__(self, constraints:list, caching=True):
         # bi-level cache with level 1 = constraint(s), level 2 = domains,
         self.cache = dict() if caching else None
+        # constraints and domains with a canonical form under the symmetries of the model share one entry (see `canonical_form`)
+        self.canonical_cache = dict()
         self.vars = set(get_variables(constraints))
         self.scope_cache = dict()
         assert is_any_list(constraints), f"expected list but got {type(constraints)}"
@@ -35,18 +39,29 @@ class Propagator:
             self.scope_cache[cons] = frozenset(get_variables(cons))
 
 
+    def _canonical(self, domains, constraints):
+        cons_vars = set().union(*[self.scope_cache[cons] for cons in constraints])
+        return canonical_form(constraints, {var : domains[var] for var in cons_vars}), cons_vars
+
+
     def _probe_cache(self, domains, constraints) -> DomainSet:
         if self.cache is None: return None
 
         if not isinstance(constraints, list):
             constraints = [constraints]
-        constraints = frozenset(constraints)
-        if constraints not in self.cache:
-            return None
 
-        cons_vars = set().union(*[self.scope_cache[cons] for cons in constraints])
-        cons_domains = DomainSet({var : domains[var] for var in cons_vars})
-        new_domains = self.cache[constraints].get(cons_domains)
+        form, cons_vars = self._canonical(domains, constraints)
+        if form is not None:
+            new_domains = self.canonical_cache.get(form.key)
+            if new_domains is not None:
+                new_domains = {form.restore(name) : vals for name, vals in new_domains.items()}
+        else:
+            constraints = frozenset(constraints)
+            if constraints not in self.cache:
+                return None
+            cons_domains = DomainSet({var : domains[var] for var in cons_vars})
+            new_domains = self.cache[constraints].get(cons_domains)
+
         if new_domains is not None:
             # are we in the UNSAT case?
             if any(len(dom) == 0 for dom in new_domains.values()):
@@ -65,11 +80,15 @@ class Propagator:
         if not isinstance(constraints, list):
             constraints = [constraints]
 
+        form, cons_vars = self._canonical(domains, constraints)
+        if form is not None:
+            self.canonical_cache[form.key] = {form.rename(var) : new_domains[var] for var in cons_vars}
+            return
+
         constraints = frozenset(constraints)
         if constraints not in self.cache:
             self.cache[constraints] = dict()
 
-        cons_vars = set().union(*[self.scope_cache[cons] for cons in constraints])
         domains = DomainSet({var : domains[var] for var in cons_vars})
         new_domains = DomainSet({var : new_domains[var] for var in cons_vars})
         self.cache[constraints][domains] = new_domains
@@ -106,7 +125,7 @@ class CPPropagate(Propagator):
         # only care about domains of variables in constraints
         cons_vars = set(get_variables(constraints))
 
-        solver = cp.SolverLookup.get("ortools")
+        solver = get_solver("ortools")
         solver += constraints
         for var in cons_vars: # set leftover domains of vars
             solver += cp.Table([var],[[val] for val in domains[var]])
@@ -178,7 +197,7 @@ class MaximalPropagate(Propagator):
         # only care about variables in constraints
         cons_vars = set(get_variables(constraints))
 
-        solver = cp.SolverLookup.get("ortools")
+        solver = get_solver("ortools")
         solver += constraints
         for var in cons_vars:  # set leftover domains of vars
             solver += cp.Table([var], [[val] for val in domains[var]])
@@ -232,7 +251,7 @@ class MaximalPropagateSolveAll(MaximalPropagate):
         # only care about variables in constraints
         cons_vars = set(get_variables(constraints))
 
-        solver = cp.SolverLookup.get("ortools")
+        solver = get_solver("ortools")
         solver += constraints
         for var in cons_vars:  # set leftover domains of vars
             solver += cp.Table([var], [[val] for val in cp_propped_domains[var]])
@@ -1,81 +1,527 @@
 
 import cpmpy as cp
+import cpmpy.tools.mus
 from cpmpy.exceptions import CPMpyException
 from cpmpy.transformations.normalize import toplevel_list
+from cpmpy.expressions.utils import is_any_list
+from cpmpy.expressions.variables import _BoolVarImpl
+from cpmpy.transformations.get_variables import get_variables
+from cpmpy.solvers.solver_interface import ExitStatus
 
 import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-def mus(soft, hard):
+from .utils import canonical_form, is_symmetric
+from .transform import get_solver
+from .deadline import Deadline, Result
 
-    # try reification of all soft constraints
-    try:
-        return cpmpy.tools.mus.mus(soft, hard)
-    except CPMpyException:
-        return cpmpy.tools.mus.mus_naive(soft, hard)
+NO_TIME_LIMIT = 1e9 # seconds
+POST_CHUNK = 256 # number of soft constraints posted at once by `mus`, the deadline is checked in between
+
+def mus(soft, hard=[], solver="ortools", deadline=None):
+    """
+        Deletion-based MUS extraction with clause set refinement and model rotation,
+            all satisfiability checks go through a `MemoOracle`.
+
+        :param: deadline: optional `Deadline`, when it is reached the current core is returned,
+                            which is UNSAT but may not be minimal (the result is then not `complete`)
+    """
+    found = mus_or_none(soft, hard, solver, deadline)
+    assert found is not None, "MUS: model must be UNSAT"
+    return found
 
-def maxsat(soft, hard=[]):
 
+def mus_or_none(soft, hard=[], solver="ortools", deadline=None):
+    """
+        Same as `mus`, but returns None if the constraints are satisfiable,
+            so checking satisfiability and finding the MUS take a single solve call.
+    """
     soft = toplevel_list(soft, merge_and=False)
     assump = cp.boolvar(shape=len(soft))
+    if len(soft) == 1:
+        assump = cp.cpm_array([assump])
     dmap = dict(zip(assump, soft))
 
-    m = cp.Model(hard)
-    m += assump.implies(soft)
-    m.maximize(cp.sum(assump))
+    deadline = Deadline.of(deadline)
+    # try reification of all soft constraints
+    try:
+        s = get_solver(solver)
+        s += hard
+        # posting a large model takes a while, check the deadline in between
+        for i in range(0, len(soft), POST_CHUNK):
+            if deadline.expired():
+                return Result(soft, complete=False)
+            s += assump[i:i + POST_CHUNK].implies(soft[i:i + POST_CHUNK])
+    except CPMpyException:
+        if cp.Model(hard, soft).solve():
+            return None
+        return Result(cpmpy.tools.mus.mus_naive(soft, hard))
+
+    oracle = MemoOracle(s, dmap, hard=hard)
+    # the core is kept by the oracle, so `_deletion_mus` does not solve this again
+    if oracle.solve(assumptions=list(assump), time_limit=deadline.time_limit()) is True:
+        return None
+    if oracle.last_core is None: # timed out
+        return Result(soft, complete=False)
+    core = _deletion_mus(oracle, list(assump), dmap, hard, deadline)
+    found = set(core)
+    return Result([dmap[a] for a in assump if a in found], complete=core.complete)
+
+
+def _deletion_mus(oracle, assumptions, dmap, hard=[], deadline=None, fixed=[]):
+    """
+        Shrink the assumption variables to a MUS, see `mus`, returns a `Result` with the assumption variables in the MUS.
+        The assumption variables in `fixed` are always assumed to be true, they act as hard constraints.
+    """
+    deadline = Deadline.of(deadline)
+    fixed = list(fixed)
+    assert not oracle.solve(assumptions=list(assumptions) + fixed, time_limit=deadline.time_limit()), "MUS: model must be UNSAT"
+    if oracle.last_core is None: # timed out
+        return Result(assumptions, complete=False)
+    core = set(oracle.get_core()) - set(fixed)
+    necessary, scopes = set(), dict()
+    for a in sorted(core, key=lambda a: -len(get_variables(dmap[a]))):
+        if a not in core or a in necessary:
+            continue
+        if deadline.expired():
+            return Result(core, complete=False)
+        core.remove(a)
+        if oracle.solve(assumptions=list(core) + fixed, time_limit=deadline.time_limit()) is True:
+            core.add(a)
+            necessary = model_rotation(core, a, dmap, hard, necessary, scopes)
+        elif oracle.last_core is None: # timed out
+            core.add(a)
+            return Result(core, complete=False)
+        else: # UNSAT, do clause set refinement
+            core = set(oracle.get_core()) - set(fixed)
+    return Result(core)
+
+def model_rotation(core, start, constraint_of, hard=[], necessary=set(), scopes=None, max_domain=64):
+    """
+        Recursive model rotation, finds constraints necessary for every MUS within `core` without solver calls.
+        The current values of the variables must satisfy the hard constraints and all constraints in `core` except `start`.
 
-    assert m.solve()
+        Changing the value of a single variable of the falsified constraint satisfies it,
+            if this falsifies exactly one other constraint of `core` (and no hard constraint),
+            that constraint is necessary as well and we continue rotating from the changed assignment.
+        Constraints are evaluated in Python, variables with a domain larger than `max_domain` are not changed.
 
-    return [dmap[a] for a in assump if a.value()]
+        :param: constraint_of: maps each key in `core` to its constraint
+        :param: scopes: optional cache mapping keys and hard constraints to their variables, filled along the way
+        :return: the set of keys of necessary constraints, including `start` and `necessary`
+    """
+    if scopes is None:
+        scopes = dict()
+    for key in core:
+        if key not in scopes:
+            scopes[key] = get_variables(constraint_of[key])
+    occurs = dict()
+    for key in core:
+        for var in scopes[key]:
+            occurs.setdefault(var, []).append(key)
+    hard_occurs = dict()
+    for cons in toplevel_list(hard, merge_and=False):
+        if cons not in scopes:
+            scopes[cons] = get_variables(cons)
+        for var in scopes[cons]:
+            hard_occurs.setdefault(var, []).append(cons)
+
+    found = set(necessary) | {start}
+    orig_values = {var: var._value for var in occurs}
+    stack = [(start, dict())]
+    while len(stack):
+        key, flips = stack.pop()
+        for var, val in flips.items():
+            var._value = val
+        for var in scopes[key]:
+            if var.ub - var.lb + 1 > max_domain:
+                continue
+            current = var._value
+            for val in range(var.lb, var.ub + 1):
+                val = bool(val) if isinstance(var, _BoolVarImpl) else val
+                if val == current:
+                    continue
+                var._value = val
+                soft_values = [(other, constraint_of[other].value()) for other in occurs[var]]
+                hard_values = [cons.value() for cons in hard_occurs.get(var, [])]
+                if any(v is None for _, v in soft_values) or any(v is None or not v for v in hard_values):
+                    continue # unknown, or not a model of the hard constraints
+                falsified = [other for other, v in soft_values if not v] # values can be numpy booleans
+                if len(falsified) == 1 and falsified[0] not in found:
+                    found.add(falsified[0])
+                    stack.append((falsified[0], flips | {var: val}))
+            var._value = current
+        for var in orig_values:
+            var._value = orig_values[var]
+
+    return found
+
+
+def group_mus(groups, hard=[], solver="ortools", refine=False):
+    """
+        Find a MUS over groups of constraints, e.g., as labeled by `factory.group_constraints`.
+        Each group is enabled by a single assumption variable, so the number of oracle calls depends on the number of groups.
+        Large groups are tried to be removed first.
 
-def mcs(soft, hard=[], solver="ortools"):
+        :param: refine: if True, also compute a MUS over the constraints in the groups found
+        :return: a dict mapping each group in the MUS to its constraints (in the MUS when `refine` is True)
+    """
+    names = list(groups)
+    assump = cp.boolvar(shape=len(names))
+    if len(names) == 1:
+        assump = cp.cpm_array([assump])
+    dmap = dict(zip(assump, names))
 
-    soft = toplevel_list(soft, merge_and=False)
-    assump = cp.boolvar(shape=len(soft))
-    s = cp.SolverLookup.get(solver)
+    s = get_solver(solver)
     s += hard
-    s += assump.implies(soft)
+    s += [a.implies(cp.all(groups[name])) for a, name in dmap.items()]
+    assert not s.solve(assumptions=list(assump)), "MUS: model must be UNSAT"
+
+    core = set(s.get_core())
+    for a in sorted(core, key=lambda a: -len(groups[dmap[a]])):
+        if a not in core:
+            continue # already removed
+        core.remove(a)
+        if s.solve(assumptions=list(core)) is True:
+            core.add(a)
+        else: # UNSAT, do clause set refinement
+            core = set(s.get_core())
+
+    found = {dmap[a]: list(groups[dmap[a]]) for a in assump if a in core}
+    if refine:
+        return _refine_groups(found, mus(sum(found.values(), []), hard))
+    return found
+
+
+def group_smus(groups, hard=[], weights=1, solver="ortools", hs_solver="gurobi", refine=False):
+    """
+        Find a smallest MUS over groups of constraints, see `group_mus`.
 
-    s.solution_hint(assump, [1]*len(assump))
-    assert s.solve()
+        :param: weights: weight of each group, in the same order as `groups`
+        :param: refine: if True, also compute a smallest MUS over the constraints in the groups found
+    """
+    names = list(groups)
+    conjunctions = [cp.all(groups[name]) for name in names]
+    found = smus(conjunctions, hard, weights=weights, solver=solver, hs_solver=hs_solver)
+    found = {names[i]: list(groups[names[i]]) for i, conj in enumerate(conjunctions) if any(conj is f for f in found)}
+    if refine:
+        return _refine_groups(found, smus(sum(found.values(), []), hard, solver=solver, hs_solver=hs_solver))
+    return found
 
-    dmap = dict(zip(assump, soft))
-    mcs = _sat_grow(s, set() , dmap)
-    return [dmap[a] for a in mcs]
 
+def compact_mus(soft, hard=[], compact=([], []), solver="ortools", deadline=None):
+    """
+        Find a MUS of `soft`, solving a regrouped formulation of the constraints where possible, e.g., as made by `factory.compact`.
+        Constraints covered by a compact constraint form a group enabled as that single constraint, all other constraints are on their own.
+        A MUS over these groups is found first, only the constraints in the groups of this MUS are then shrunk to a MUS of `soft`.
 
-def optimal_mcs(soft, hard=[], solver="ortools"):
+        :param: compact: hard constraints of the compact formulation,
+                            and a list of (compact constraint, covered constraints) pairs
+        :param: deadline: optional `Deadline`, when it is reached the current UNSAT subset of `soft` is returned (and not `complete`)
+    """
+    extra, covers = compact
+    soft = toplevel_list(soft, merge_and=False)
+    in_soft = {id(cons) for cons in soft}
+    covered = set()
+    groups = []
+    for compact_cons, cons in covers:
+        if all(id(c) in in_soft for c in cons): # all covered constraints are still there
+            groups.append((compact_cons, list(cons)))
+            covered |= {id(c) for c in cons}
+    groups += [(cons, [cons]) for cons in soft if id(cons) not in covered]
+
+    deadline = Deadline.of(deadline)
+    found = mus([group for group, _ in groups], list(hard) + list(extra), solver=solver, deadline=deadline)
+    found = {id(group) for group in found}
+    subset = [cons for group, constraints in groups if id(group) in found for cons in constraints]
+    if deadline.expired():
+        return Result(subset, complete=False)
+    return mus(subset, hard, solver=solver, deadline=deadline)
+
+
+def _refine_groups(found, refined):
+    refined = {id(cons) for cons in refined}
+    return {name: [cons for cons in constraints if id(cons) in refined] for name, constraints in found.items()}
+
+
+def _timed_solve(solver, time_limit=None, **kwargs):
+    """
+        Solve call with an optional time limit.
+        Some solvers (e.g., OR-Tools) keep the time limit of a previous call,
+            so once a solver got a time limit, calls without one get a very large time limit instead.
+    """
+    if time_limit is not None:
+        solver._time_limited = True
+    elif getattr(solver, "_time_limited", False):
+        time_limit = NO_TIME_LIMIT
+    return solver.solve(time_limit=time_limit, **kwargs)
+
+
+def maxsat(soft, hard=[], weights=None, solver="ortools", time_limit=None, deadline=None):
+    """
+        Find a (weighted) maximum satisfiable subset of `soft` using core-guided MaxSAT.
+        When the time limit or deadline is reached, the best subset found so far is returned (and not `complete`).
+    """
+    return SubsetSession(soft, hard, solver=solver).maxsat(weights=weights, time_limit=time_limit, deadline=deadline)
+
+def mcs(soft, hard=[], solver="ortools", deadline=None):
+    """
+        Find a minimal correction subset of `soft`.
+        When the deadline is reached, a correction subset which may not be minimal is returned (and not `complete`).
+    """
+    return SubsetSession(soft, hard, solver=solver).mcs(deadline=deadline)
+
+
+def optimal_mcs(soft, hard=[], weights=None, solver="ortools", time_limit=None, deadline=None):
+    """
+        Find a (weighted) minimum correction subset of `soft` using core-guided MaxSAT.
+        When the time limit or deadline is reached, the best correction subset found so far is returned (and not `complete`).
+    """
+    return SubsetSession(soft, hard, solver=solver).optimal_mcs(weights=weights, time_limit=time_limit, deadline=deadline)
 
+
+def _core_guided_maxsat(solver, dmap, weights=None, time_limit=None, fixed=[], deadline=None):
+    """
+        OLL-style core-guided MaxSAT with stratification on the weights.
+        Each soft constraint is represented by an assumption variable in `dmap`, already posted to `solver`.
+        The assumption variables in `fixed` are always assumed to be true, they act as hard constraints.
+        For every core, a new assumption variable relaxing the cardinality of the core is added,
+            and the bound of this cardinality constraint is increased when it is in a core itself.
+        These relaxations are guarded by an indicator variable of the query, which is assumed during the query
+            and fixed to false afterwards, so they do not constrain later queries on the same solver.
+
+        Returns the best satisfiable subset of assumption variables found and whether it is proven optimal,
+            the subset is empty when the time limit or deadline is reached before any solution is found.
+    """
+    deadline = Deadline.of(deadline, time_limit)
+    assump = list(dmap.keys())
+    if weights is None:
+        weights = [1] * len(assump)
+    elif not is_any_list(weights):
+        weights = [weights] * len(assump)
+    orig_weights = dict(zip(assump, weights))
+
+    best_subset, best_cost = None, None
+    def store_solution():
+        nonlocal best_subset, best_cost
+        sat_subset = {a for a, cons in dmap.items() if a.value() or cons.value()}
+        cost = sum(w for a, w in orig_weights.items() if a not in sat_subset)
+        if best_cost is None or cost < best_cost:
+            best_subset, best_cost = sat_subset, cost
+
+    query = cp.boolvar()
+    fixed = list(fixed) + [query]
+    if not _timed_solve(solver, deadline.time_limit(), assumptions=fixed):
+        if solver.status().exitstatus == ExitStatus.UNKNOWN:
+            return set(), False
+        raise AssertionError("Hard constraints are UNSAT")
+    store_solution()
+    try:
+        active = {a: w for a, w in orig_weights.items() if w > 0}
+        cardinality = dict()  # relaxation variable -> (literals in core, bound)
+        lower_bound = 0
+        threshold = max(active.values(), default=0)
+
+        while best_cost > lower_bound:
+            if deadline.expired():
+                break
+            if _timed_solve(solver, deadline.time_limit(), assumptions=fixed + [a for a, w in active.items() if w >= threshold]):
+                store_solution()
+                lower = [w for w in active.values() if w < threshold]
+                if len(lower) == 0:
+                    return best_subset, True
+                threshold = max(lower) # next stratum
+                continue
+            if solver.status().exitstatus == ExitStatus.UNKNOWN:
+                break # timeout
+
+            core = [a for a in solver.get_core() if a in active]
+            w_min = min(active[a] for a in core)
+            lower_bound += w_min
+            for a in core:
+                active[a] -= w_min
+                if active[a] == 0:
+                    del active[a]
+                if a in cardinality: # relax bound of cardinality constraint
+                    lits, bound = cardinality[a]
+                    if bound + 1 < len(lits):
+                        relax = cp.boolvar()
+                        solver += (query & relax).implies(cp.sum([~l for l in lits]) <= bound + 1)
+                        cardinality[relax] = (lits, bound + 1)
+                        active[relax] = w_min
+            if len(core) > 1:
+                relax = cp.boolvar()
+                solver += (query & relax).implies(cp.sum([~a for a in core]) <= 1)
+                cardinality[relax] = (core, 1)
+                active[relax] = w_min
+
+        return best_subset, best_cost == lower_bound
+    finally:
+        solver += ~query # retire the relaxations of this query
+
+
+def enumerate_mcs(soft, hard=[], solver="ortools", grow="sat", pool=None, n_workers=4):
+    """
+        Enumerate all minimal correction subsets of `soft` w.r.t. `hard`.
+        After each MCS is found, a blocking clause enforcing at least one of its constraints is added to the solver.
+        The enumeration stops when the hard constraints together with the blocking clauses are UNSAT.
+
+        :param: grow: the grow method to use, can be "greedy", "sat" or "maxsat"
+                       "greedy" will only return correction subsets, which are not guaranteed to be minimal
+        :param: pool: None, "thread" or "process", test the candidate additions of SAT-grow in parallel
+    """
     soft = toplevel_list(soft, merge_and=False)
     assump = cp.boolvar(shape=len(soft))
-    s = cp.SolverLookup.get(solver)
+    if len(soft) == 1:
+        assump = cp.cpm_array([assump])
+    dmap = dict(zip(assump, soft))
+
+    s = get_solver(solver)
     s += hard
     s += assump.implies(soft)
+    s = MemoOracle(s, dmap, hard=hard)
 
-    s.maximize(cp.sum(assump))
-    assert s.solve()
-
-    dmap = dict(zip(assump, soft))
-    return [dmap[a] for a in assump if a.value() is False]
-
+    executor = None
+    if pool == "thread":
+        executor = ThreadPoolExecutor(n_workers, initializer=_init_grow_worker, initargs=(soft, hard, solver))
+    elif pool == "process":
+        executor = ProcessPoolExecutor(n_workers, initializer=_init_grow_worker, initargs=(soft, hard, solver))
+    elif pool is not None:
+        raise ValueError(f"Unknown pool type: {pool}, should be None, 'thread' or 'process'")
 
-def _sat_grow(solver, sat_subset, dmap):
+    try:
+        s.solution_hint(assump, [1]*len(assump))
+        while s.solve(assumptions=[]): # clear assumptions of previous grow
+            # values of assumptions satisfy all blocking clauses, so every superset does too
+            sat_subset = {a for a, cons in dmap.items() if a.value() or cons.value()}
+            corr_subset = _grow(grow, s, sat_subset, dmap, hard=hard, solver_name=solver, executor=executor, n_workers=n_workers)
+            yield [dmap[a] for a in corr_subset]
+            if len(corr_subset) == 0:
+                return # all soft constraints are satisfiable together
+
+            s += cp.any(list(corr_subset))
+            s.solution_hint(assump, [1]*len(assump))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _grow(method, solver, sat_subset, dmap, hard=[], solver_name="ortools", executor=None, n_workers=4):
+    """
+        Grow a satisfiable subset using the given method, returns its complement as correction subset.
+        Assumes the current values of `solver` are a solution to `sat_subset`.
+    """
+    if method == "greedy":
+        return _greedy_grow(dmap)
+    elif method == "sat":
+        if executor is not None:
+            return _parallel_sat_grow(sat_subset, dmap, executor, n_workers)
+        return _sat_grow(solver, sat_subset, dmap)
+    elif method == "maxsat":
+        return _maxsat_grow(sat_subset, dmap, hard, solver=solver_name)
+    raise ValueError(f"Unknown grow method: {method}, should be 'greedy', 'sat' or 'maxsat'")
+
+
+def _sat_grow(solver, sat_subset, dmap, fixed=[], deadline=None):
     """
         Find a superset of "subset" which is still satisfiable, not the largest one per se.
+        The assumption variables in `fixed` are always assumed to be true.
+        Returns the complement as a `Result`, when the deadline is reached the subset found so far is not grown further
+            and its complement may not be minimal (and not `complete`).
     """
+    deadline = Deadline.of(deadline)
     # to_check = _greedy_grow(dmap)
     to_check = set(dmap.keys()) - sat_subset
     sat_subset = copy.copy(sat_subset)
     while len(to_check):
+        if deadline.expired():
+            return Result(set(dmap.keys()) - sat_subset, complete=False)
         test = to_check.pop()
         new_set = copy.copy(sat_subset)
         new_set.add(test)
         # solver.solution_hint(list(new_set), len(new_set)*[1])
-        if solver.solve(assumptions=list(new_set)):
+        if solver.solve(assumptions=list(new_set) + list(fixed), time_limit=deadline.time_limit()) is True:
             # is sat, so add to sat subset
             sat_subset = {assump for assump, cons in dmap.items() if assump.value() or cons.value()}
             to_check -= sat_subset
+        elif deadline.expired(): # timed out, `test` may still be satisfiable with the rest
+            return Result(set(dmap.keys()) - sat_subset, complete=False)
+
+    return Result(set(dmap.keys()) - sat_subset)
 
-    return set(dmap.keys()) - sat_subset
+
+def _maxsat_grow(sat_subset, dmap, hard=[], solver="ortools"):
+    """
+        Find the largest superset of "subset" which is still satisfiable using a MaxSAT call.
+    """
+    assump = list(dmap.keys())
+    s = get_solver(solver)
+    s += hard
+    s += cp.cpm_array(assump).implies(list(dmap.values()))
+    s += list(sat_subset)
+    s.maximize(cp.sum(assump))
+    assert s.solve(), "Subset to grow should be satisfiable"
+
+    return {a for a, cons in dmap.items() if not a.value() and not cons.value()}
+
+
+_grow_worker = threading.local()
+
+def _init_grow_worker(soft, hard, solver):
+    """
+        Initialize a solver for each worker of the pool, solvers cannot be shared between threads or processes.
+    """
+    assump = cp.boolvar(shape=len(soft))
+    if len(soft) == 1:
+        assump = cp.cpm_array([assump])
+    _grow_worker.assump = assump
+    _grow_worker.soft = soft
+    _grow_worker.solver = get_solver(solver)
+    _grow_worker.solver += hard
+    _grow_worker.solver += assump.implies(soft)
+
+
+def _check_candidate(subset_idxes, candidate):
+    """
+        Check if the subset extended with the candidate is satisfiable in the worker's solver.
+        Returns the indices of all soft constraints satisfied by the found solution, or None if UNSAT.
+    """
+    assump = _grow_worker.assump
+    if not _grow_worker.solver.solve(assumptions=[assump[i] for i in subset_idxes + [candidate]]):
+        return None
+    return [i for i, (a, cons) in enumerate(zip(assump, _grow_worker.soft)) if a.value() or cons.value()]
+
+
+def _parallel_sat_grow(sat_subset, dmap, executor, n_workers):
+    """
+        SAT-grow where the candidate additions are tested in parallel by the workers of `executor`.
+        The first satisfiable candidate (in order) extends the sat subset,
+            candidates found UNSAT can be dropped as the sat subset only grows,
+            other satisfiable candidates are tested again against the extended subset.
+    """
+    assump = list(dmap.keys())
+    idx_of = {a: i for i, a in enumerate(assump)}
+    sat_idxes = {idx_of[a] for a in sat_subset}
+    to_check = [i for i in range(len(assump)) if i not in sat_idxes]
+
+    while len(to_check):
+        batch, to_check = to_check[:n_workers], to_check[n_workers:]
+        subset_idxes = sorted(sat_idxes)
+        futures = [executor.submit(_check_candidate, subset_idxes, i) for i in batch]
+        results = [f.result() for f in futures]
+
+        requeue = []
+        for i, res in zip(batch, results):
+            if res is None or i in sat_idxes:
+                continue
+            if sat_idxes.issubset(res):
+                sat_idxes |= set(res)
+            else:
+                requeue.append(i)
+        to_check = requeue + [i for i in to_check if i not in sat_idxes]
+
+    return {a for i, a in enumerate(assump) if i not in sat_idxes}
 
 
 def _greedy_grow(dmap):
@@ -86,59 +532,301 @@ def _greedy_grow(dmap):
     return set(dmap.keys()) - sat_subset
 
 
-def _corr_subsets(subset, dmap, solver, hard):
-    sat_subset = {s for s in subset}
-    corr_subsets = []
-    vars=  list(dmap.keys())
-    solver.solution_hint(vars, [1]*len(vars))
-    while solver.solve(assumptions=list(sat_subset)):
-        """
-            Change the grow method here if wanted!
-            MaxSAT grow will probably be slow but result in very small sets to hit (GOOD!)
-            SAT-grow will probably be a little faster but greedily finds a small set to hit
-            Greedy-grow will not do ANY solving and simply exploit the values in the current solution
-        """
-        # corr_subset = _maxsat_grow(sat_subset)
-        # corr_subset = _sat_grow(solver, sat_subset, dmap)
-        corr_subset = _greedy_grow(dmap)
-        if len(corr_subset) == 0:
-            return corr_subsets
+def ocus_oneof(soft, hard=[], oneof_idxes=[], weights=1, solver="ortools", hs_solver="gurobi", deadline=None):
+    """
+        Cheapest UNSAT subset of `soft` with exactly one constraint in `oneof_idxes` (if not empty), see `OCUSSession.ocus`.
+        Returns None if there is no such subset.
+        When the deadline is reached, all soft constraints are returned as an UNSAT subset which is not the cheapest (and not `complete`).
+    """
+    session = OCUSSession(soft, hard, solver=solver, hs_solver=hs_solver)
+    try:
+        found = session.ocus(oneof=oneof_idxes, weights=weights, deadline=deadline)
+    except TimeoutError:
+        return Result(session.soft, complete=False)
+    if found is not None:
+        return Result([session.soft[i] for i in found])
 
-        sat_subset |= corr_subset
-        corr_subsets.append(corr_subset)
-        solver.solution_hint(vars, [1] * len(vars))
-    return corr_subsets
+def smus(soft, hard=[], weights=1, solver="ortools", hs_solver="gurobi", deadline=None):
+    return ocus_oneof(soft, hard, [], weights, solver, hs_solver, deadline)
 
-def ocus_oneof(soft, hard=[], oneof_idxes=[], weights=1, solver="ortools", hs_solver="gurobi"):
+def omus(soft, hard=[], weights=1, solver="ortools", hs_solver="gurobi", deadline=None):
+    return ocus_oneof(soft, hard, [], weights, solver, hs_solver, deadline)
 
-    soft = toplevel_list(soft, merge_and=False)
-    assump = cp.boolvar(shape=len(soft), name="assump")
-    if len(soft) == 1:
-        assump = cp.cpm_array([assump])
 
-    m = cp.Model(hard + [assump.implies(soft)])  # each assumption variable implies a candidate
-    dmap = dict(zip(assump, soft))
-    s = cp.SolverLookup.get(solver, m)
-    assert not s.solve(assumptions=assump), "MUS: model must be UNSAT"
-
-    # hitting set solver stuff
-    hs_solver = cp.SolverLookup.get(hs_solver)
-    if len(oneof_idxes):
-        hs_solver += cp.sum(assump[oneof_idxes]) == 1
-    hs_solver.minimize(cp.sum(weights * assump))
-
-    while hs_solver.solve():
-
-        subset = assump[assump.value() == 1]
-        if s.solve(assumptions=subset) is True:
-            # grow subset while staying satisfiable under assumptions
-            for grown in _corr_subsets(subset, dmap, s, hard=hard):
-                hs_solver += cp.sum(grown) >= 1
+class SubsetSession:
+    """
+        Answer several MaxSAT and MCS queries over the same set of soft and hard constraints.
+        The model is transformed and posted to the solver only once.
+        Extra hard constraints of a query are posted once as a retractable layer,
+            guarded by an indicator variable which is only assumed during the queries that need it.
+    """
+    def __init__(self, soft, hard=[], solver="ortools"):
+        self.soft = toplevel_list(soft, merge_and=False)
+        self.assump = cp.boolvar(shape=len(self.soft))
+        if len(self.soft) == 1:
+            self.assump = cp.cpm_array([self.assump])
+        self.dmap = dict(zip(self.assump, self.soft))
+
+        self.hard = toplevel_list(hard, merge_and=False)
+        self.solver = get_solver(solver)
+        self.solver += self.hard
+        self.solver += self.assump.implies(self.soft)
+
+        self.layers = dict() # extra hard constraint -> indicator variable
+        self.oracle = MemoOracle(self.solver, self.dmap, hard=hard)
+
+    def _layer(self, hard):
+        """
+            Get the indicator variables of the extra hard constraints, post the ones we have not seen yet.
+        """
+        indicators = []
+        for cons in toplevel_list(hard, merge_and=False):
+            if cons not in self.layers:
+                self.layers[cons] = cp.boolvar()
+                self.solver += self.layers[cons].implies(cons)
+            indicators.append(self.layers[cons])
+        return indicators
+
+    def maxsat(self, hard=[], weights=None, time_limit=None, deadline=None):
+        sat_subset, optimal = _core_guided_maxsat(self.solver, self.dmap, weights, time_limit, self._layer(hard), deadline)
+        return Result([self.dmap[a] for a in self.assump if a in sat_subset], complete=optimal)
+
+    def optimal_mcs(self, hard=[], weights=None, time_limit=None, deadline=None):
+        sat_subset, optimal = _core_guided_maxsat(self.solver, self.dmap, weights, time_limit, self._layer(hard), deadline)
+        return Result([self.dmap[a] for a in self.assump if a not in sat_subset], complete=optimal)
+
+    def mus(self, subset=None, hard=[], deadline=None):
+        """
+            MUS of a subset of the soft constraints (all of them by default), see `mus`.
+        """
+        fixed = self._layer(hard)
+        if subset is None:
+            assumptions = list(self.assump)
         else:
-            return [dmap[a] for a in subset]
+            assump_of = {id(cons): a for a, cons in self.dmap.items()}
+            assumptions = [assump_of[id(cons)] for cons in toplevel_list(subset, merge_and=False)]
+        core = _deletion_mus(self.oracle, assumptions, self.dmap, self.hard + toplevel_list(hard, merge_and=False), deadline, fixed)
+        found = set(core)
+        return Result([self.dmap[a] for a in self.assump if a in found], complete=core.complete)
 
-def smus(soft, hard=[], weights=1, solver="ortools", hs_solver="gurobi"):
-    return ocus_oneof(soft, hard, [], weights, solver, hs_solver)
+    def mcs(self, hard=[], deadline=None):
+        """
+            Minimal correction subset of the soft constraints, see `mcs`.
+        """
+        deadline = Deadline.of(deadline)
+        fixed = self._layer(hard)
+        self.solver.solution_hint(self.assump, [1]*len(self.assump))
+        try:
+            if self.oracle.solve(assumptions=fixed, time_limit=deadline.time_limit()) is not True:
+                assert self.oracle.last_core is None, "Hard constraints are UNSAT"
+                return Result(self.soft, complete=False) # no solution yet, all soft constraints form a correction subset
+            mcs = _sat_grow(self.oracle, set(), self.dmap, fixed=fixed, deadline=deadline)
+        finally:
+            self.solver.solution_hint([], []) # the hint would steer later queries
+        return Result([self.dmap[a] for a in mcs], complete=mcs.complete)
+
+
+class OCUSSession:
+    """
+        Answer several OCUS queries (cheapest UNSAT subset with exactly one constraint out of a given set)
+            over subsets of the same soft and hard constraints, e.g., to explain one new literal after the other.
+        The oracle and the satisfiable subsets found by growing are kept across queries:
+            the part of a query outside of a satisfiable subset is a set to hit for that query, so it starts with all of them.
+    """
+    def __init__(self, soft, hard=[], solver="ortools", hs_solver="gurobi"):
+        self.soft = toplevel_list(soft, merge_and=False)
+        self.assump = cp.boolvar(shape=len(self.soft), name="assump")
+        if len(self.soft) == 1:
+            self.assump = cp.cpm_array([self.assump])
+        self.dmap = dict(zip(self.assump, self.soft))
+
+        m = cp.Model(hard + [self.assump.implies(self.soft)]) # each assumption variable implies a candidate
+        self.oracle = MemoOracle(get_solver(solver, m), self.dmap, hard=hard)
+        self.hs_solver = hs_solver
+        self.sat_subsets = [] # bitsets over the indices of the soft constraints, only maximal ones are kept
+
+    def _solve(self, idxes, deadline):
+        ret = self.oracle.solve(assumptions=[self.assump[i] for i in idxes], time_limit=deadline.time_limit())
+        if ret is not True and self.oracle.last_core is None:
+            raise TimeoutError("OCUS timed out")
+        return ret
+
+    def _grow(self):
+        """
+            Store the soft constraints satisfied by the current solution, returns them as a bitset.
+        """
+        sat = 0
+        for i, (a, cons) in enumerate(self.dmap.items()):
+            if a.value() or cons.value():
+                sat |= 1 << i
+        if not any(other & sat == sat for other in self.sat_subsets):
+            self.sat_subsets = [other for other in self.sat_subsets if other & sat != other] + [sat]
+        return sat
+
+    def ocus(self, subset=None, oneof=[], weights=1, time_limit=None, deadline=None):
+        """
+            Cheapest UNSAT subset of the soft constraints in `subset` (all of them by default),
+                with exactly one constraint in `oneof` if it is not empty.
+            Returns None if there is no such subset, raises a TimeoutError when the time limit or deadline is reached.
 
-def omus(soft, hard=[], weights=1, solver="ortools", hs_solver="gurobi"):
-    return ocus_oneof(soft, hard, [], weights, solver, hs_solver)
+            :param: subset, oneof: indices of soft constraints
+            :param: weights: a single weight, or one for each constraint in `subset`
+            :return: the indices of the constraints in the UNSAT subset
+        """
+        deadline = Deadline.of(deadline, time_limit)
+        subset = list(range(len(self.soft))) if subset is None else list(subset)
+        assert not self._solve(subset, deadline), "MUS: model must be UNSAT"
+
+        hs_solver = cp.SolverLookup.get(self.hs_solver)
+        if len(oneof):
+            hs_solver += cp.sum(self.assump[list(oneof)]) == 1
+        if not is_any_list(weights):
+            weights = [weights] * len(subset)
+        hs_solver.minimize(cp.sum([w * self.assump[i] for w, i in zip(weights, subset)]))
+        for sat in self.sat_subsets:
+            hs_solver += cp.sum([self.assump[i] for i in subset if not sat >> i & 1]) >= 1
+
+        # prefer solutions satisfying many constraints, only one of `oneof` can be in an UNSAT subset anyway
+        hint = [self.assump[i] for i in sorted(set(subset) - set(oneof))]
+        while 1:
+            if deadline.expired():
+                raise TimeoutError("OCUS timed out")
+            self.oracle.solution_hint(hint, [1]*len(hint))
+            _timed_solve(hs_solver, time_limit=deadline.time_limit())
+            status = hs_solver.status().exitstatus
+            if status == ExitStatus.UNSATISFIABLE:
+                return None
+            if status != ExitStatus.OPTIMAL:
+                raise TimeoutError("OCUS timed out")
+
+            hit = [i for i in subset if self.assump[i].value()]
+            if not self._solve(hit, deadline):
+                return hit
+            # grow subset while staying satisfiable under assumptions, each correction subset is a set to hit
+            grown = set(hit)
+            while 1:
+                sat = self._grow()
+                corr_subset = [i for i in subset if not sat >> i & 1]
+                hs_solver += cp.sum(self.assump[corr_subset]) >= 1
+                grown |= set(corr_subset)
+                self.oracle.solution_hint(hint, [1]*len(hint))
+                if not self._solve(sorted(grown), deadline):
+                    break
+
+
+class MemoOracle:
+    """
+        Wrapper around a solver answering "is this subset of assumptions SAT?" from previous answers when possible.
+        Sets of assumption variables are stored as bitsets (Python ints), using monotonicity:
+            - any superset of a known UNSAT set is UNSAT, the stored core is returned by `get_core()`
+            - any subset of a known SAT set is SAT, the stored solution is restored in the variables
+        A SAT set is stored with all soft constraints satisfied by its solution (using `dmap`), not only the assumptions.
+        Only minimal cores and maximal SAT sets are kept.
+        After a call which timed out, `last_core` is None.
+
+        Adding constraints to the oracle clears the SAT sets, cores stay valid.
+        All other attributes are forwarded to the wrapped solver.
+
+        When the hard constraints in the solver are given and stay the same under the symmetries of the model (see `utils.is_symmetric`),
+            answers are also reused for sets of constraints equal up to such a symmetry, e.g., after renaming interchangeable nurses.
+    """
+    def __init__(self, solver, dmap=dict(), hard=None):
+        self.solver = solver
+        self.dmap = dict(dmap)
+        self.bit = dict() # assumption variable -> index in bitset
+        self.vars = dict()
+        for a in self.dmap:
+            self._index(a)
+
+        self.cores = [] # list of bitsets
+        self.sat = [] # list of (bitset, solution)
+        self.last_core = None
+        self.n_calls, self.n_hits = 0, 0
+
+        self.symmetric = hard is not None and is_symmetric(toplevel_list(hard, merge_and=False))
+        self.canonical = dict() # canonical form -> (canonical names of the core, None) or (None, solution over canonical names)
+
+    def _index(self, a):
+        if a not in self.bit:
+            self.bit[a] = len(self.bit)
+            self.vars[self.bit[a]] = a
+        return self.bit[a]
+
+    def _to_bits(self, assumptions):
+        bits = 0
+        for a in assumptions:
+            bits |= 1 << self._index(a)
+        return bits
+
+    def _to_vars(self, bits):
+        return [a for i, a in self.vars.items() if bits >> i & 1]
+
+    def solve(self, assumptions=[], **kwargs):
+        bits = self._to_bits(assumptions)
+        self.n_calls += 1
+
+        for core in self.cores:
+            if core & bits == core:
+                self.n_hits += 1
+                self.last_core = core
+                return False
+        for sat, solution in self.sat:
+            if sat & bits == bits:
+                self.n_hits += 1
+                for var, val in solution.items():
+                    var._value = val
+                for a in assumptions:
+                    a._value = True # the solution satisfies the constraint, so can also satisfy the assumption
+                return True
+
+        form = None
+        if self.symmetric and all(a in self.dmap for a in assumptions):
+            form = canonical_form([self.dmap[a] for a in assumptions])
+        if form is not None and form.key in self.canonical:
+            self.n_hits += 1
+            core, solution = self.canonical[form.key]
+            if core is not None:
+                named = dict(zip(form.names, assumptions))
+                self.last_core = self._to_bits(named[name] for name in core)
+                return False
+            for name, val in solution.items():
+                form.restore(name)._value = val
+            for a in self.bit:
+                a._value = False # assumptions not in the query may be false in any solution
+            for a in assumptions:
+                a._value = True
+            return True
+
+        # always pass a list, the assumptions of a previous call are kept otherwise
+        ret = _timed_solve(self.solver, assumptions=list(assumptions), **kwargs)
+        status = self.solver.status().exitstatus
+        if ret is True:
+            sat = bits | self._to_bits(a for a, cons in self.dmap.items() if a.value() or cons.value())
+            self.sat = [(other, sol) for other, sol in self.sat if other & sat != other]
+            self.sat.append((sat, {var: var.value() for var in self.solver.user_vars}))
+            if form is not None:
+                self.canonical[form.key] = (None, {form.rename(var): var.value() for var in self.solver.user_vars if var not in self.bit})
+        elif status == ExitStatus.UNSATISFIABLE:
+            self.last_core = self._to_bits(self.solver.get_core())
+            self.cores = [other for other in self.cores if other & self.last_core != self.last_core]
+            self.cores.append(self.last_core)
+            if form is not None:
+                names = dict(zip(assumptions, form.names))
+                self.canonical[form.key] = (frozenset(names[a] for a in self._to_vars(self.last_core)), None)
+        else: # timed out
+            self.last_core = None
+        return ret
+
+    def get_core(self):
+        assert self.last_core is not None, "get_core(): requires an UNSAT call with a list of assumption variables"
+        return self._to_vars(self.last_core)
+
+    def __iadd__(self, constraints):
+        self.solver += constraints
+        self.sat = [] # solutions may violate the new constraints
+        self.canonical = {key: (core, solution) for key, (core, solution) in self.canonical.items() if core is not None}
+        self.symmetric = self.symmetric and is_symmetric(toplevel_list(constraints, merge_and=False))
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.solver, name)
@@ -0,0 +1,160 @@
+"""
+    Process-wide memo of constraints transformed for a solver, so posting the same constraint to a new solver
+        skips the transformation stack (flattening, reification, linearisation, ...) and goes straight to the solver API.
+    The explanation algorithms create many small solvers over the same constraints, e.g., for every propagation of a step,
+        where transforming the constraints often takes longer than solving.
+"""
+import threading
+import weakref
+from functools import partial
+
+import cpmpy as cp
+from cpmpy.expressions.core import Expression, Operator
+from cpmpy.expressions.variables import _BoolVarImpl, _NumVarImpl
+from cpmpy.transformations.get_variables import get_variables
+from cpmpy.transformations.normalize import toplevel_list
+
+MAX_TRANSFORMED = 100000 # number of transformed constraints kept, the memo is cleared when it grows larger
+
+_transformed = dict() # (solver name, id of constraint) -> entry, see `_transform`
+_seen = dict() # (solver name, id of constraint) -> weak reference to a constraint posted once, it is only memoised the second time
+_definitions = dict() # auxiliary variable -> its definition, see `_transform`
+_csemaps = dict() # solver name -> common subexpressions shared by all transformed constraints for that solver
+_user_vars = dict() # name -> variable in the constraints transformed since the subexpressions were last cleared
+_lock = threading.Lock()
+
+
+def get_solver(name="ortools", model=None, **kwargs):
+    """
+        Same as `cp.SolverLookup.get`, but constraints posted to the solver are transformed only once per process.
+        A constraint is looked up by identity, on its own or implied by a Boolean variable (e.g., an assumption variable),
+            and memoised from the second time it is posted, constraints created for a single solver are transformed as usual.
+        It is transformed as `p -> cons` for a placeholder `p`, which is replaced by that variable (or left out) when posting,
+            or linked to it by `a -> p` if the placeholder also occurs in other places than `p -> ...`.
+        Subexpressions are shared between the transformed constraints as in a single solver,
+            the definitions of the auxiliary variables a constraint uses are posted along with it.
+    """
+    solver = cp.SolverLookup.get(name, **kwargs)
+    solver.transform = partial(_cached_transform, solver, solver.transform, dict(), dict())
+    if model is not None:
+        solver += model.constraints
+        if model.objective_ is not None:
+            solver.objective(model.objective_, minimize=model.objective_is_min)
+    return solver
+
+
+def _cached_transform(solver, transform, posted, defined, cpm_expr):
+    """
+        :param: posted: transformed constraints posted to this solver so far, by id
+        :param: defined: definitions posted to this solver so far, by id
+    """
+    out, usual = [], [] # transformed constraints, and constraints to transform as usual
+
+    def post(forms):
+        for form in forms:
+            if id(form) not in posted:
+                posted[id(form)] = form
+                out.append(form)
+
+    def define(definition):
+        if id(definition) in defined:
+            return
+        defined[id(definition)] = definition
+        for needed in definition[1]:
+            define(needed)
+        post(definition[0])
+
+    for cons in toplevel_list(cpm_expr, merge_and=False):
+        ind = None
+        if isinstance(cons, Operator) and cons.name == "->" and isinstance(cons.args[0], _BoolVarImpl):
+            ind, cons = cons.args
+        if not isinstance(cons, Expression) or isinstance(cons, _NumVarImpl):
+            usual.append(cons if ind is None else ind.implies(cons)) # nothing to gain
+            continue
+
+        key = (solver.name, id(cons))
+        with _lock:
+            entry = _transformed.get(key)
+            if entry is None:
+                if key not in _seen or _seen[key]() is not cons:
+                    if len(_seen) >= MAX_TRANSFORMED:
+                        _seen.clear()
+                    _seen[key] = weakref.ref(cons)
+                    usual.append(cons if ind is None else ind.implies(cons))
+                    continue
+                del _seen[key]
+                entry = _transform(solver, transform, cons)
+        _, placeholder, rest, implied, needs = entry
+        for definition in needs:
+            define(definition)
+        post(rest)
+        if implied is None: # placeholder occurs elsewhere, link it
+            usual.append(placeholder if ind is None else ind.implies(placeholder))
+        elif ind is None:
+            out.extend(implied)
+        else:
+            out.extend(Operator("->", [ind, form]) for form in implied)
+
+    return out + transform(usual)
+
+
+def _transform(solver, transform, cons):
+    """
+        Transform `p -> cons` for a new placeholder `p` with the subexpressions shared by all constraints for this solver,
+            and store it in the memo. Must be called with the lock held.
+        Returns the entry (constraint, placeholder, other transformed constraints, constraints implied by the placeholder,
+            definitions of auxiliary variables introduced by earlier constraints), where the constraints implied by the placeholder
+            are None if it also occurs in the other ones.
+        The definition of an auxiliary variable is a pair of the transformed constraints it occurs in
+            (with their own free placeholder if needed) and the definitions of the other auxiliary variables in those.
+    """
+    own_vars = get_variables(cons)
+    if len(_transformed) >= MAX_TRANSFORMED:
+        _transformed.clear()
+        _clear_subexpressions()
+    # subexpressions are found by the names of their variables, which are only unique within one model,
+    #   e.g., two instances both have a `roster[0,0]`, do not share them with constraints of another model
+    if any(_user_vars.setdefault(var.name, var) is not var for var in own_vars):
+        _clear_subexpressions()
+        _user_vars.update((var.name, var) for var in own_vars)
+
+    placeholder = cp.boolvar()
+    csemap = getattr(solver, "_csemap", None)
+    if csemap is not None:
+        solver._csemap = _csemaps.setdefault(solver.name, type(csemap)())
+    try:
+        forms = transform(placeholder.implies(cons))
+    finally:
+        if csemap is not None:
+            solver._csemap = csemap
+
+    is_implied = [isinstance(form, Operator) and form.name == "->" and form.args[0] is placeholder for form in forms]
+    rest = [form for form, implied in zip(forms, is_implied) if not implied]
+    implied = [form.args[1] for form, implied in zip(forms, is_implied) if implied]
+    if placeholder in set(get_variables(rest)):
+        rest, implied = forms, None
+
+    # an auxiliary variable is defined by the other transformed constraints it occurs in,
+    #   or by the ones implied by the placeholder (which is then left free) if it only occurs there
+    own_vars = set(own_vars) | {placeholder}
+    scopes = [{var for var in get_variables(form) if var not in own_vars} for form in forms]
+    new_vars = {var for scope in scopes for var in scope if var not in _definitions}
+    for var in new_vars:
+        defs = [form for form, scope, implied_form in zip(forms, scopes, is_implied) if var in scope and not implied_form]
+        if len(defs) == 0:
+            defs = [form for form, scope in zip(forms, scopes) if var in scope]
+        _definitions[var] = (defs, [])
+    for var in new_vars:
+        in_scope = {other for form in _definitions[var][0] for other in get_variables(form)}
+        _definitions[var][1].extend(_definitions[other] for other in in_scope if other in _definitions and other is not var)
+
+    needs = list({id(_definitions[var]): _definitions[var] for scope in scopes for var in scope if var not in new_vars}.values())
+    entry = (cons, placeholder, rest, implied, needs) # keeps the constraint alive, so its id is not reused
+    _transformed[(solver.name, id(cons))] = entry
+    return entry
+
+
+def _clear_subexpressions():
+    _definitions.clear()
+    _csemaps.clear()
+    _user_vars.clear()
@@ -0,0 +1,70 @@
+def describe(cons):
+    """
+        Description of a constraint to display to the user.
+        Constraints can keep their metadata in a side table as `cons.meta = (table, row)`,
+            the description is then generated from the table (and stored) the first time it is needed.
+    """
+    # newer versions of CPMpy keep the description in `_description`, older ones in `desc`
+    if hasattr(cons, "meta") and getattr(cons, "_description", getattr(cons, "desc", None)) is None:
+        table, row = cons.meta
+        cons.set_description(table.describe(row))
+    return str(cons)
+
+
+def get_visualizer(cons):
+    """
+        Function styling the cells of a constraint, or None if the constraint cannot be visualized.
+    """
+    if hasattr(cons, "visualize"):
+        return cons.visualize
+    if hasattr(cons, "meta"):
+        table, row = cons.meta
+        return lambda styler : table.visualize(styler, row)
+    return None
+
+
+def _table_of(constraints):
+    tables = {cons.meta[0] if hasattr(cons, "meta") else None for cons in constraints}
+    if len(tables) != 1 or None in tables:
+        return None
+    return next(iter(tables))
+
+
+def canonical_form(constraints, domains=None):
+    """
+        Canonical form of a set of constraints under the symmetries of the model they come from,
+            e.g., nurses with the same contract in the nurse rostering model.
+        Sets of constraints with the same canonical form are the same up to renaming of their variables,
+            so they are either both satisfiable or both not, and propagate to the same (renamed) domains.
+        Returns None if the constraints do not all have their metadata in the same side table (see `describe`),
+            or if that table knows no symmetries.
+
+        :param: domains: optional dict mapping variables to their domains, the domains are then part of the canonical form
+        :return: an object with a hashable `key`, the canonical `names` of the constraints,
+                    and `rename(var)` and `restore(name)` to go from variables to their canonical names and back
+    """
+    table = _table_of(constraints)
+    if table is None or not hasattr(table, "canonical"):
+        return None
+    return table.canonical(constraints, domains)
+
+
+def is_symmetric(constraints):
+    """
+        Whether the constraints stay the same under all symmetries used by `canonical_form`,
+            e.g., cover constraints which do not depend on any nurse in particular.
+    """
+    if len(constraints) == 0:
+        return True
+    form = canonical_form(constraints)
+    return form is not None and all(name[0] == "free" for name in form.names)
+
+
+def embed(constraints, subset):
+    """
+        The constraints of `subset` equal to `constraints` up to a symmetry of the model, or None if there are none.
+    """
+    table = _table_of(constraints)
+    if table is None or not hasattr(table, "embed"):
+        return None
+    return table.embed(constraints, subset)
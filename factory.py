@@ -1,15 +1,36 @@
+import gc
+import hashlib
+import os
+import pickle
+import re
+from array import array
+from functools import partial
+
 import numpy as np
 
 import read_data
 from read_data import SchedulingProblem
 import cpmpy as cp
 from cpmpy.transformations.normalize import toplevel_list
+from cpmpy.expressions.core import Expression
+from cpmpy.expressions.variables import _IntVarImpl, _BoolVarImpl
 
 FREE = 0
 
+# changes whenever this file changes, invalidates cached models
+with open(__file__, "rb") as f:
+    FACTORY_VERSION = hashlib.sha1(f.read()).hexdigest()[:12]
+
+FORMULATIONS = dict(decision="get_decision_model", optimization="get_optimization_model",
+                    multi_objective="get_multi_objective_model", slack="get_slack_model")
+
 class NurseSchedulingFactory:
 
-    def __init__(self, data:SchedulingProblem):
+    def __init__(self, data:SchedulingProblem, lazy=False):
+        """
+            :param: lazy: if True, descriptions and visualizers of constraints are only generated when displayed,
+                            see `ConstraintTable`
+        """
 
         self.data = data
         self.n_types = len(data.shifts)
@@ -20,12 +41,17 @@ class NurseSchedulingFactory:
         self.shift_name_to_idx.update({"-": 0})
 
         self.nurse_map = list(self.data.staff["# ID"])
+        self.nurse_idx = {nurse_id : n for n, nurse_id in enumerate(self.nurse_map)}
+        self.nurse_names = list(self.data.staff["name"])
 
         weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
         self.days = [f"{weekdays[i % 7]} {1 + (i // 7)}" for i in range(data.horizon)]
 
+        self.table = ConstraintTable(self, lazy=lazy)
+
         # decision vars
         self.nurse_view = cp.intvar(0, self.n_types, shape=(self.n_nurses, data.horizon), name="roster")
+        self.roster_cell = {var : cell for cell, var in np.ndenumerate(self.nurse_view)} # variable -> (nurse, day)
 
         self.slack_over = cp.intvar(0, self.n_nurses, shape=(len(self.days), self.n_types))
         self.slack_under = cp.intvar(0, self.n_nurses, shape=(len(self.days), self.n_types))
@@ -89,7 +115,8 @@ class NurseSchedulingFactory:
 
         model += [cons_on, cons_off, cons_cover]
         obj_func = penalty_on + penalty_off + penalty_cover
-        model.minimize(obj_func)
+        if isinstance(obj_func, Expression): # the hard formulation has no penalties, their sum is the constant 0
+            model.minimize(obj_func)
 
         model.constraints = toplevel_list(model.constraints, merge_and=False)
 
@@ -115,18 +142,21 @@ class NurseSchedulingFactory:
         This constraint always assumes that the last day of the previous planning period was a day off and
             the first day of the next planning horizon is a day off.
         """
+        roster = self.nurse_view.tolist()
         constraints = []
-        for t, (_, shift) in enumerate(self.data.shifts.iterrows()):
-            cannot_follow = [self.shift_name_to_idx[name] for name in shift["cannot follow"] if name != '']
+        for t, cannot_follow_names in enumerate(self.data.shifts["cannot follow"]):
+            cannot_follow = [self.shift_name_to_idx[name] for name in cannot_follow_names if name != '']
+            if len(cannot_follow) == 0:
+                continue
+            is_shift = [[shifts[d] == t + 1 for d in range(self.data.horizon - 1)] for shifts in roster]
             for other_shift in cannot_follow:
-                for n in range(self.n_nurses):
+                for n, shifts in enumerate(roster):
+                    group = ("shift_rotation", self.nurse_names[n])
                     for d in range(self.data.horizon - 1):
-                        cons = (self.nurse_view[n, d] == t + 1).implies(self.nurse_view[n, d + 1] != other_shift)
-                        cons.set_description(
-                            f"None of {shift['cannot follow']} can follow "
-                            f"shift {self.idx_to_name[t+1]} for {self.data.staff.iloc[n]['name']}")
+                        cons = is_shift[n][d].implies(shifts[d + 1] != other_shift)
+                        self.table.add(cons, "shift_rotation", n, d, t + 1, param=other_shift)
+                        cons.group = group
                         constraints.append(cons)
-                        cons.visualize = lambda style : None
         return constraints
 
     def max_shifts(self):
@@ -134,20 +164,14 @@ class NurseSchedulingFactory:
         The maximum number of shifts of each type that can be assigned to each employee.
         """
 
-        def get_visualizer(nurse_idx, shift_id):
-            def visualize(styler):
-                styler[("#Shifts", shift_id)].iloc[nurse_idx] += f'border: 5px dotted red;'
-            return visualize
-
         constraints = []
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            for shift_id, shift in self.data.shifts.iterrows():
+        max_shifts = {shift_id : self.data.staff[f"max_shifts_{shift_id}"].to_numpy() for shift_id in self.data.shifts.index}
+        for n, name in enumerate(self.nurse_names):
+            for shift_id in self.data.shifts.index:
                 n_shifts = cp.Count(self.nurse_view[n], self.shift_name_to_idx[shift_id])
-                max_shifts = nurse[f"max_shifts_{shift_id}"]
-                cons = n_shifts <= max_shifts
-                cons.set_description(f"{nurse['name']} can work at most {max_shifts} {shift_id}-shifts")
-                cons.visualize = get_visualizer(n, shift_id)
+                cons = n_shifts <= max_shifts[shift_id][n]
+                self.table.add(cons, "max_shifts", n, shift=self.shift_name_to_idx[shift_id], param=max_shifts[shift_id][n])
+                cons.group = ("max_shifts", name)
                 constraints.append(cons)
 
         return constraints
@@ -157,20 +181,12 @@ class NurseSchedulingFactory:
         The maximum amount of total time in minutes that can be assigned to each employee.
         """
 
-        def get_visualizer(nurse_idx):
-            def visualize(styler):
-                styler.iloc[nurse_idx, -1] += 'border: 5px dotted red;'
-            return visualize
-
         constraints = []
-        shift_length = cp.cpm_array([0] + [l for l in self.data.shifts.Length])
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            time_worked = cp.sum(shift_length[t] for t in self.nurse_view[n])
-            constraint = time_worked <= nurse["MaxTotalMinutes"]
+        for n, (name, max_minutes) in enumerate(zip(self.nurse_names, self.data.staff["MaxTotalMinutes"].to_numpy())):
+            constraint = self.time_worked(n) <= max_minutes
 
-            constraint.set_description(f"{nurse['name']} cannot work more than {nurse['MaxTotalMinutes']}min")
-            constraint.visualize = get_visualizer(n)
+            self.table.add(constraint, "max_minutes", n, param=max_minutes)
+            constraint.group = ("max_minutes", name)
             constraints.append(constraint)
         return constraints
 
@@ -178,23 +194,33 @@ class NurseSchedulingFactory:
         """
         The maximum amount of total time in minutes that can be assigned to each employee.
         """
-        def get_visualizer(nurse_idx):
-            def visualize(styler):
-                styler.iloc[nurse_idx, -1] += 'border: 5px dotted green;'
-            return visualize
-
         constraints = []
-        shift_length = cp.cpm_array([0] + [l for l in self.data.shifts.Length])
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse["# ID"])
-            time_worked = cp.sum(shift_length[t] for t in self.nurse_view[n])
-            constraint = time_worked >= nurse["MinTotalMinutes"]
+        for n, (name, min_minutes) in enumerate(zip(self.nurse_names, self.data.staff["MinTotalMinutes"].to_numpy())):
+            constraint = self.time_worked(n) >= min_minutes
 
-            constraint.set_description(f"{nurse['name']} should work at least {nurse['MinTotalMinutes']}min")
-            constraint.visualize = get_visualizer(n)
+            self.table.add(constraint, "min_minutes", n, param=min_minutes)
+            constraint.group = ("min_minutes", name)
             constraints.append(constraint)
         return constraints
 
+    def time_worked(self, n):
+        """
+            Total time in minutes worked by nurse `n`
+        """
+        shift_length = cp.cpm_array([0] + [l for l in self.data.shifts.Length])
+        return cp.sum(shift_length[t] for t in self.nurse_view[n])
+
+
+    def symmetry_classes(self):
+        """
+            Groups of nurses with the same contract (all columns of the staff table except their ID and name),
+                whose contract constraints are the same up to renaming of their shifts.
+        """
+        contract = self.data.staff.drop(columns=["# ID", "name"]).astype(str).agg("|".join, axis=1)
+        classes = dict()
+        for n, key in enumerate(contract):
+            classes.setdefault(key, []).append(n)
+        return list(classes.values())
 
     def max_consecutive(self):
         """
@@ -202,24 +228,15 @@ class NurseSchedulingFactory:
         This constraint always assumes that the last day of the previous planning period was a day off
             and the first day of the next planning period is a day off.
         """
-        def get_visualizer(nurse_idx, window):
-            def visualize(styler):
-                styler.iloc[nurse_idx, window[0]] += "border-left: 5px solid red;"
-                styler.iloc[nurse_idx, window[-1]] += "border-right: 5px solid red;"
-                for day in window:
-                    styler.iloc[nurse_idx, day] += "border-top: 5px solid red; border-bottom: 5px solid red;"
-            return visualize
-
 
         constraints = []
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            max_days = nurse['MaxConsecutiveShifts']
+        for n, (name, max_days) in enumerate(zip(self.nurse_names, self.data.staff['MaxConsecutiveShifts'].to_numpy())):
+            group = ("max_consecutive", name)
             for i in range(self.data.horizon - max_days):
                 window = self.nurse_view[n][i:i+max_days+1]
                 constraint = cp.Count(window, 0) >= 1
-                constraint.set_description(f"{nurse['name']} can work at most {max_days} days before having a day off")
-                constraint.visualize = get_visualizer(n, list(range(i,i+max_days+1)))
+                self.table.add(constraint, "max_consecutive", n, i, param=max_days)
+                constraint.group = group
                 constraints.append(constraint)
 
         return constraints
@@ -232,29 +249,18 @@ class NurseSchedulingFactory:
                 assigned at the end of the previous planning period and at the start of the next planning period.
         """
 
-        def get_visualizer(nurse_idx, window):
-            def visualize(styler):
-                styler.iloc[nurse_idx, window[0]] += "border-left: 5px dotted teal;"
-                styler.iloc[nurse_idx, window[-1]] += "border-right: 5px dotted teal;"
-                for day in window:
-                    styler.iloc[nurse_idx, day] += "border-top: 5px dotted teal; border-bottom: 5px dotted teal;"
-
-            return visualize
-
         constraints = []
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            min_days = nurse["MinConsecutiveShifts"]
-            nurse_shifts = self.nurse_view[n]
-            for i, shift in enumerate(nurse_shifts):
-                if i == 0: # first shift can never be start of working period
-                    continue
-
-                is_start_of_working_period = (shift != FREE) & (nurse_shifts[i-1] == FREE)
-
-                constraint = is_start_of_working_period.implies(cp.all(nurse_shifts[i:i+min_days] != FREE))
-                constraint.set_description(f"{nurse['name']} should work at least {min_days} days before having a day off")
-                constraint.visualize = get_visualizer(n, list(range(i,i+min_days)))
+        for n, (name, min_days) in enumerate(zip(self.nurse_names, self.data.staff["MinConsecutiveShifts"].to_numpy())):
+            nurse_shifts = self.nurse_view[n].tolist()
+            works = [shift != FREE for shift in nurse_shifts]
+            free = [shift == FREE for shift in nurse_shifts]
+            group = ("min_consecutive", name)
+            for i in range(1, len(nurse_shifts)): # first shift can never be start of working period
+                is_start_of_working_period = works[i] & free[i-1]
+
+                constraint = is_start_of_working_period.implies(cp.all(works[i:i+min_days]))
+                self.table.add(constraint, "min_consecutive", n, i, param=min_days)
+                constraint.group = group
                 constraints.append(constraint)
 
         return constraints
@@ -265,39 +271,26 @@ class NurseSchedulingFactory:
             Max nb of working weekends for each nurse.
             A weekend is defined as being worked if there is a shift on the Saturday or the Sunday.
         """
-        def get_visualizer(nurse_idx):
-            def visualize(styler):
-                for sat, sun in self.weekends:
-                    styler.iloc[nurse_idx, sat] += "border-left: 5px solid indigo; border-top: 5px solid indigo; border-bottom: 5px solid indigo;"
-                    styler.iloc[nurse_idx, sun] += "border-right: 5px solid indigo; border-top: 5px solid indigo; border-bottom: 5px solid indigo;"
-            return visualize
-
         constraints = []
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            max_weekends = nurse['MaxWeekends']
-            shifts = self.nurse_view[n]
+        for n, (name, max_weekends) in enumerate(zip(self.nurse_names, self.data.staff['MaxWeekends'].to_numpy())):
+            shifts = self.nurse_view[n].tolist()
             n_weekends = cp.sum([(shifts[sat] != FREE) | (shifts[sun] != FREE) for sat,sun in self.weekends])
             constraint = n_weekends <= max_weekends
-            constraint.set_description(f"{nurse['name']} should work at most {max_weekends} weekends")
-            constraint.visualize = get_visualizer(n)
+            self.table.add(constraint, "weekend_shifts", n, param=max_weekends)
+            constraint.group = ("weekend_shifts", name)
             constraints.append(constraint)
         return constraints
 
 
     def days_off(self):
 
-        def get_visualizer(nurse_idx, day):
-            def visualize(styler):
-                styler.iloc[nurse_idx, day] += "background-color:lightgreen;"
-            return visualize
-
         constraints = []
-        for (_, holiday) in self.data.days_off.iterrows():
-            n = self.nurse_map.index(holiday['EmployeeID'])
-            constraint = self.nurse_view[n, holiday['DayIndex']] == FREE
-            constraint.set_description(f"{self.data.staff.iloc[n]['name']} has a day off on {self.days[holiday['DayIndex']]}")
-            constraint.visualize = get_visualizer(n, holiday['DayIndex'])
+        roster = self.nurse_view.tolist()
+        for nurse_id, day in zip(self.data.days_off['EmployeeID'], self.data.days_off['DayIndex'].to_numpy()):
+            n = self.nurse_idx[nurse_id]
+            constraint = roster[n][day] == FREE
+            self.table.add(constraint, "days_off", n, day)
+            constraint.group = ("days_off", self.nurse_names[n])
             constraints.append(constraint)
 
         return constraints
@@ -310,30 +303,18 @@ class NurseSchedulingFactory:
             at the end of the previous planning period and at the start of the next planning period.
         """
 
-        def get_visualizer(nurse_idx, window):
-            def visualize(styler):
-                styler.iloc[nurse_idx, window[0]] += "border-left: 5px dotted lightgreen;"
-                styler.iloc[nurse_idx, window[-1]] += "border-right: 5px dotted lightgreen;"
-                for day in window:
-                    styler.iloc[nurse_idx, day] += "border-top: 5px dotted lightgreen; border-bottom: 5px dotted lightgreen;"
-
-            return visualize
-
         constraints = []
-        for _, nurse in self.data.staff.iterrows():
-            n = self.nurse_map.index(nurse['# ID'])
-            min_days = nurse["MinConsecutiveDaysOff"]
-            nurse_shifts = self.nurse_view[n]
-            nurse_constraint = []
-            for i, shift in enumerate(nurse_shifts):
-                if i == 0: # can never be the first of a free period
-                    continue
-
-                is_start_of_free_period = (shift == FREE) & (nurse_shifts[i - 1] != FREE)
-
-                constraint = is_start_of_free_period.implies(cp.all(nurse_shifts[i:i+min_days] == FREE))
-                constraint.set_description(f"{nurse['name']} should have at least {min_days} consecutive days off")
-                constraint.visualize = get_visualizer(n, list(range(i, i+min_days)))
+        for n, (name, min_days) in enumerate(zip(self.nurse_names, self.data.staff["MinConsecutiveDaysOff"].to_numpy())):
+            nurse_shifts = self.nurse_view[n].tolist()
+            works = [shift != FREE for shift in nurse_shifts]
+            free = [shift == FREE for shift in nurse_shifts]
+            group = ("min_consecutive_off", name)
+            for i in range(1, len(nurse_shifts)): # can never be the first of a free period
+                is_start_of_free_period = free[i] & works[i-1]
+
+                constraint = is_start_of_free_period.implies(cp.all(free[i:i+min_days]))
+                self.table.add(constraint, "min_consecutive_off", n, i, param=min_days)
+                constraint.group = group
                 constraints.append(constraint)
 
         return constraints
@@ -347,27 +328,23 @@ class NurseSchedulingFactory:
                                if True, returns a set of constraints requiring the request to be satisfied
         """
 
-        def get_visualizer(nurse_idx, day):
-            def visualize(styler):
-                styler.iloc[nurse_idx, day] += "background-color:rgb(183, 119, 41);"
-            return visualize
-
 
         constraints = []
         penalty = []
-        for _, request in self.data.shift_on.iterrows():
-            n = self.nurse_map.index(request['# EmployeeID'])
-            shift = self.shift_name_to_idx[request['ShiftID']]
-            day = request['Day']
+        roster = self.nurse_view.tolist()
+        requests = self.data.shift_on
+        for nurse_id, day, shift_id, weight in zip(requests['# EmployeeID'], requests['Day'].to_numpy(), requests['ShiftID'], requests['Weight'].to_numpy()):
+            n = self.nurse_idx[nurse_id]
+            shift = self.shift_name_to_idx[shift_id]
             if formulation == "hard":
-                constraint = self.nurse_view[n, day] == shift
-                constraint.set_description(f"{self.data.staff.iloc[n]['name']} requests to work shift {self.idx_to_name[shift]} on {self.days[day]}")
-                constraint.visualize = get_visualizer(n, day)
+                constraint = roster[n][day] == shift
+                self.table.add(constraint, "shift_on_requests", n, day, shift)
+                constraint.group = ("shift_on_requests", self.nurse_names[n])
                 constraints.append(constraint)
             else: # penalty
-                expr = self.nurse_view[n,day] != shift
-                expr.set_description(f"Deny {self.data.staff.iloc[n]['name']}'s request to work shift {self.idx_to_name[shift]} on {self.days[day]}")
-                penalty.append(request['Weight'] * expr)
+                expr = roster[n][day] != shift
+                self.table.add(expr, "deny_shift_on_request", n, day, shift)
+                penalty.append(weight * expr)
 
         return constraints, cp.sum(penalty)
 
@@ -377,26 +354,22 @@ class NurseSchedulingFactory:
             If the specified shift is assigned to the specified employee on the specified day
                 then the solution's penalty is the weight value.
         """
-        def get_visualizer(nurse_idx, day):
-            def visualize(styler):
-                styler.iloc[nurse_idx, day] += "background-color: rgb(212,175,55);"
-            return visualize
-
         constraints = []
         penalty = []
-        for _, request in self.data.shift_off.iterrows():
-            n = self.nurse_map.index(request['# EmployeeID'])
-            shift = self.shift_name_to_idx[request['ShiftID']]
-            day = request['Day']
+        roster = self.nurse_view.tolist()
+        requests = self.data.shift_off
+        for nurse_id, day, shift_id, weight in zip(requests['# EmployeeID'], requests['Day'].to_numpy(), requests['ShiftID'], requests['Weight'].to_numpy()):
+            n = self.nurse_idx[nurse_id]
+            shift = self.shift_name_to_idx[shift_id]
             if formulation == "hard":
-                constraint = self.nurse_view[n, day] != shift
-                constraint.set_description(f"{self.data.staff.iloc[n]['name']} requests not to work shift {self.idx_to_name[shift]} on {self.days[day]}")
-                constraint.visualize = get_visualizer(n, day)
+                constraint = roster[n][day] != shift
+                self.table.add(constraint, "shift_off_requests", n, day, shift)
+                constraint.group = ("shift_off_requests", self.nurse_names[n])
                 constraints.append(constraint)
             else:  # penalty
-                expr = self.nurse_view[n, day] == shift
-                expr.set_description(f"Deny {self.data.staff.iloc[n]['name']}'s request not to work shift {self.idx_to_name[shift]} on {self.days[day]}")
-                penalty.append(request['Weight'] * expr)
+                expr = roster[n][day] == shift
+                self.table.add(expr, "deny_shift_off_request", n, day, shift)
+                penalty.append(weight * expr)
 
         return constraints, cp.sum(penalty)
 
@@ -409,43 +382,413 @@ class NurseSchedulingFactory:
                                 - slack:
                                 - hard:
         """
-        def get_visualizer(day, shift):
-
-            def visualize(styler):
-                styler.iloc[0, day] += "border-top: 5px solid red;"
-                for n in range(self.n_nurses):
-                    styler.iloc[n, day] += "border-left: 5px solid red; border-right: 5px solid red;"
-                styler.iloc[n, day] += "border-bottom: 5px solid red;"
-                styler.iloc[n + shift, day] += "border: 5px solid red;"
-            return visualize
-
 
         constraints = []
         penalties = []
-        for _, cover in self.data.cover.iterrows():
-            shift = self.shift_name_to_idx[cover["ShiftID"]]
-            requirement = cover['Requirement']
-            day =  cover['# Day']
+        cover = self.data.cover
+        for day, shift_id, requirement, weight_under, weight_over in zip(cover['# Day'].to_numpy(), cover['ShiftID'], cover['Requirement'].to_numpy(),
+                                                                       cover['Weight for under'].to_numpy(), cover['Weight for over'].to_numpy()):
+            shift = self.shift_name_to_idx[shift_id]
             nb_nurses = cp.Count(self.nurse_view[:, day], shift)
             if formulation == "soft":
                 slack_over = self.slack_over[day, shift-1]
                 slack_under = self.slack_under[day, shift-1]
-                penalties += [cover["Weight for over"] * slack_over, cover["Weight for under"] * slack_under]
+                penalties += [weight_over * slack_over, weight_under * slack_under]
             elif formulation == "hard":
                 slack_over, slack_under = 0,0
             else:
                 raise ValueError(f"Unexpected formulation for constraint. Should be 'penalty', 'slack', or 'hard' but got {formulation}")
 
             expr = nb_nurses + (-slack_over) + slack_under == requirement
-            expr.visualize = get_visualizer(day, shift)
-            expr.set_description(
-                f"Shift {cover['ShiftID']} on {self.days[day]} must be covered by {requirement} nurses out of {len(self.nurse_view)}")
+            self.table.add(expr, "cover", day=day, shift=shift, param=requirement)
+            expr.group = ("cover", self.days[day])
             constraints.append(expr)
 
         return constraints, cp.sum(penalties)
 
+    def compact(self, constraints):
+        """
+            Regrouped formulation of the sliding window constraints (max_consecutive, min_consecutive and min_consecutive_off)
+                in `constraints`, for solving rather than for explaining.
+            For each nurse, the complete families of window constraints are replaced by a single conjunction of linear constraints
+                and clauses over Boolean variables telling whether the nurse works each day.
+            This is a regrouping, not a smaller encoding: there is still a constraint per window, and min_consecutive(_off)
+                takes up to `param` clauses per window, O(horizon * param) per nurse as in the fine-grained constraints.
+            The gain is that the windows of a nurse are enabled by a single assumption variable,
+                and that constraints over the Boolean variables are cheaper to transform than those over the roster.
+
+            :return: the channeling constraints, to be added as hard constraints,
+                        and a list of (compact constraint, covered constraints) pairs, one per nurse
+        """
+        horizon = self.data.horizon
+        expected = dict(max_consecutive=lambda max_days : set(range(horizon - max_days)),
+                        min_consecutive=lambda min_days : set(range(1, horizon)),
+                        min_consecutive_off=lambda min_days : set(range(1, horizon)))
+
+        windows = dict() # (nurse, family) -> constraints
+        for cons in constraints:
+            if getattr(cons, "meta", (None,))[0] is not self.table:
+                continue
+            row = cons.meta[1]
+            family = self.table.families[self.table.family[row]]
+            if family in expected:
+                windows.setdefault((self.table.nurse[row], family), []).append(cons)
+
+        works = cp.boolvar(shape=(self.n_nurses, horizon), name="works")
+        channel, covers = [], []
+        for n in range(self.n_nurses):
+            w = works[n].tolist()
+            compact, covered = [], []
+            for family, days in expected.items():
+                cons = windows.get((n, family), [])
+                if len(cons) == 0:
+                    continue
+                param = self.table.param[cons[0].meta[1]]
+                if {self.table.day[c.meta[1]] for c in cons} != days(param): # some windows were removed
+                    continue
+                if family == "max_consecutive":
+                    compact += [cp.sum(w[i:i+param+1]) <= param for i in range(horizon - param)]
+                elif family == "min_consecutive":
+                    compact += [w[i-1] | ~w[i] | w[j] for i in range(1, horizon) for j in range(i+1, min(i+param, horizon))]
+                else:
+                    compact += [~w[i-1] | w[i] | ~w[j] for i in range(1, horizon) for j in range(i+1, min(i+param, horizon))]
+                covered += cons
+            if len(covered) == 0:
+                continue
+
+            channel += [w[d] == (self.nurse_view[n,d] != FREE) for d in range(horizon)]
+            covers.append((cp.all(compact), covered))
+        return channel, covers
+
+DESCRIPTIONS = dict(
+    shift_rotation="None of {cannot_follow} can follow shift {shift} for {name}",
+    max_shifts="{name} can work at most {param} {shift}-shifts",
+    max_minutes="{name} cannot work more than {param}min",
+    min_minutes="{name} should work at least {param}min",
+    max_consecutive="{name} can work at most {param} days before having a day off",
+    min_consecutive="{name} should work at least {param} days before having a day off",
+    weekend_shifts="{name} should work at most {param} weekends",
+    days_off="{name} has a day off on {day}",
+    min_consecutive_off="{name} should have at least {param} consecutive days off",
+    shift_on_requests="{name} requests to work shift {shift} on {day}",
+    deny_shift_on_request="Deny {name}'s request to work shift {shift} on {day}",
+    shift_off_requests="{name} requests not to work shift {shift} on {day}",
+    deny_shift_off_request="Deny {name}'s request not to work shift {shift} on {day}",
+    cover="Shift {shift} on {day} must be covered by {param} nurses out of {n_nurses}",
+)
+
+class ConstraintTable:
+    """
+        Metadata of the constraints made by a factory, one row per constraint: family, nurse, day, shift and a parameter.
+        Constraints refer to their row as `cons.meta = (table, row)`,
+            their description and visualizer are generated from the row when the constraint is displayed.
+        When not lazy, the description and visualizer are also set on the constraints directly.
+    """
+
+    def __init__(self, factory, lazy=True):
+        self.factory = factory
+        self.lazy = lazy
+        self.families = list(DESCRIPTIONS)
+        self.family_idx = {family : i for i, family in enumerate(self.families)}
+
+        self.family = array("B")
+        self.nurse = array("i")
+        self.day = array("i")
+        self.shift = array("i")
+        self.param = array("i")
+
+    def __len__(self):
+        return len(self.family)
+
+    def __deepcopy__(self, memo):
+        # shared by all copies of the constraints
+        return self
+
+    def add(self, cons, family, nurse=-1, day=-1, shift=-1, param=-1):
+        row = len(self.family)
+        self.family.append(self.family_idx[family])
+        self.nurse.append(nurse)
+        self.day.append(day)
+        self.shift.append(shift)
+        self.param.append(param)
+        cons.meta = (self, row)
+        if not self.lazy:
+            cons.set_description(self.describe(row))
+            if hasattr(self, f"_visualize_{family}"):
+                cons.visualize = partial(self.visualize, row=row)
+        return cons
+
+    def canonical(self, constraints, domains=None):
+        """
+            Canonical form of constraints of this table under renaming of the nurses, see `explanations.utils.canonical_form`.
+            The block of a nurse are the rows of its constraints without the nurse (family, day, shift and parameter),
+                nurses are ordered by their block and by the domains of their shifts in `domains`.
+            Constraints over no nurse in particular, e.g., cover, are kept as they are,
+                as are the domains of variables which are not shifts, e.g., the slack of a cover constraint.
+            Returns None if no two nurses have the same contract, canonical forms of different sets would hardly ever coincide.
+        """
+        if not hasattr(self, "_symmetric"):
+            self._symmetric = any(len(group) > 1 for group in self.factory.symmetry_classes())
+        if not self._symmetric:
+            return None
+
+        cells = self.factory.roster_cell
+        blocks, free = dict(), []
+        for cons in constraints:
+            row = cons.meta[1]
+            if self.nurse[row] < 0:
+                free.append(row)
+            else:
+                blocks.setdefault(self.nurse[row], []).append(self._entry(row))
+        shifts, others = dict(), []
+        for var, dom in (domains or dict()).items():
+            if var in cells:
+                n, day = cells[var]
+                shifts.setdefault(n, []).append((day, tuple(sorted(dom))))
+            else:
+                others.append((str(var), tuple(sorted(dom))))
+
+        signature = {n: (tuple(sorted(blocks.get(n, []))), tuple(sorted(shifts.get(n, [])))) for n in set(blocks) | set(shifts)}
+        order = sorted(signature, key=signature.get)
+        order += [n for n in range(self.factory.n_nurses) if n not in signature]
+        form = CanonicalForm(self.factory, order)
+        form.key = (tuple(signature[n] for n in order[:len(signature)]), tuple(sorted(free)), tuple(sorted(others)))
+        form.names = [("free", cons.meta[1]) if self.nurse[cons.meta[1]] < 0 else
+                      (form.position[self.nurse[cons.meta[1]]],) + self._entry(cons.meta[1]) for cons in constraints]
+        return form
+
+    def embed(self, constraints, subset):
+        """
+            Rename the nurses of `constraints` such that all of them are in `subset`, different nurses to different nurses.
+            Returns the corresponding constraints of `subset`, or None if there is no such renaming.
+        """
+        index = dict() # (nurse, entry) -> constraint
+        for cons in subset:
+            if getattr(cons, "meta", (None,))[0] is self:
+                row = cons.meta[1]
+                index[(self.nurse[row], self._entry(row) if self.nurse[row] >= 0 else row)] = cons
+
+        blocks, found = dict(), []
+        for cons in constraints:
+            row = cons.meta[1]
+            if self.nurse[row] < 0:
+                if (-1, row) not in index:
+                    return None
+                found.append(index[(-1, row)])
+            else:
+                blocks.setdefault(self.nurse[row], []).append(self._entry(row))
+
+        nurses = {n for n, _ in index if n >= 0}
+        candidates = {m: [n for n in nurses if all((n, entry) in index for entry in block)] for m, block in blocks.items()}
+        todo = sorted(blocks, key=lambda m : len(candidates[m]))
+        renaming = dict()
+        def assign(i):
+            if i == len(todo):
+                return True
+            for n in candidates[todo[i]]:
+                if n not in renaming.values():
+                    renaming[todo[i]] = n
+                    if assign(i + 1):
+                        return True
+                    del renaming[todo[i]]
+            return False
+
+        if not assign(0):
+            return None
+        return found + [index[(renaming[m], entry)] for m, block in blocks.items() for entry in block]
+
+    def _entry(self, row):
+        return (self.family[row], self.day[row], self.shift[row], self.param[row])
+
+    def describe(self, row):
+        f = self.factory
+        n, day, shift = self.nurse[row], self.day[row], self.shift[row]
+        return DESCRIPTIONS[self.families[self.family[row]]].format(
+            name=f.nurse_names[n] if n >= 0 else None,
+            day=f.days[day] if day >= 0 else None,
+            shift=f.idx_to_name[shift] if shift >= 0 else None,
+            cannot_follow=f.data.shifts["cannot follow"].iloc[shift-1] if shift > 0 else None,
+            param=self.param[row],
+            n_nurses=f.n_nurses)
+
+    def visualize(self, styler, row):
+        visualize = getattr(self, f"_visualize_{self.families[self.family[row]]}", None)
+        if visualize is not None:
+            visualize(styler, self.nurse[row], self.day[row], self.shift[row], self.param[row])
+
+    def _visualize_shift_rotation(self, styler, n, day, shift, param):
+        pass
+
+    def _visualize_max_shifts(self, styler, n, day, shift, param):
+        styler[("#Shifts", self.factory.idx_to_name[shift])].iloc[n] += f'border: 5px dotted red;'
+
+    def _visualize_max_minutes(self, styler, n, day, shift, param):
+        styler.iloc[n, -1] += 'border: 5px dotted red;'
+
+    def _visualize_min_minutes(self, styler, n, day, shift, param):
+        styler.iloc[n, -1] += 'border: 5px dotted green;'
+
+    def _visualize_max_consecutive(self, styler, n, day, shift, param):
+        window = list(range(day, day+param+1))
+        styler.iloc[n, window[0]] += "border-left: 5px solid red;"
+        styler.iloc[n, window[-1]] += "border-right: 5px solid red;"
+        for day in window:
+            styler.iloc[n, day] += "border-top: 5px solid red; border-bottom: 5px solid red;"
+
+    def _visualize_min_consecutive(self, styler, n, day, shift, param):
+        window = list(range(day, day+param))
+        styler.iloc[n, window[0]] += "border-left: 5px dotted teal;"
+        styler.iloc[n, window[-1]] += "border-right: 5px dotted teal;"
+        for day in window:
+            styler.iloc[n, day] += "border-top: 5px dotted teal; border-bottom: 5px dotted teal;"
+
+    def _visualize_weekend_shifts(self, styler, n, day, shift, param):
+        for sat, sun in self.factory.weekends:
+            styler.iloc[n, sat] += "border-left: 5px solid indigo; border-top: 5px solid indigo; border-bottom: 5px solid indigo;"
+            styler.iloc[n, sun] += "border-right: 5px solid indigo; border-top: 5px solid indigo; border-bottom: 5px solid indigo;"
+
+    def _visualize_days_off(self, styler, n, day, shift, param):
+        styler.iloc[n, day] += "background-color:lightgreen;"
+
+    def _visualize_min_consecutive_off(self, styler, n, day, shift, param):
+        window = list(range(day, day+param))
+        styler.iloc[n, window[0]] += "border-left: 5px dotted lightgreen;"
+        styler.iloc[n, window[-1]] += "border-right: 5px dotted lightgreen;"
+        for day in window:
+            styler.iloc[n, day] += "border-top: 5px dotted lightgreen; border-bottom: 5px dotted lightgreen;"
+
+    def _visualize_shift_on_requests(self, styler, n, day, shift, param):
+        styler.iloc[n, day] += "background-color:rgb(183, 119, 41);"
+
+    def _visualize_shift_off_requests(self, styler, n, day, shift, param):
+        styler.iloc[n, day] += "background-color: rgb(212,175,55);"
+
+    def _visualize_cover(self, styler, n, day, shift, param):
+        styler.iloc[0, day] += "border-top: 5px solid red;"
+        for n in range(self.factory.n_nurses):
+            styler.iloc[n, day] += "border-left: 5px solid red; border-right: 5px solid red;"
+        styler.iloc[n, day] += "border-bottom: 5px solid red;"
+        styler.iloc[n + shift, day] += "border: 5px solid red;"
+
+
+class CanonicalForm:
+    """
+        Canonical form of a set of constraints, as made by `ConstraintTable.canonical`.
+        Nurse `order[k]` gets position `k`, the shifts of a nurse are named by their position and day.
+
+        :param: key: hashable key, equal for sets of constraints that are the same up to renaming of the nurses
+        :param: names: canonical name of each constraint
+    """
+    def __init__(self, factory, order):
+        self.factory = factory
+        self.order = order
+        self.position = {n: k for k, n in enumerate(order)}
+        self.key = None
+        self.names = []
+
+    def rename(self, var):
+        if var in self.factory.roster_cell:
+            n, day = self.factory.roster_cell[var]
+            return ("roster", self.position[n], day)
+        return var
+
+    def restore(self, name):
+        if isinstance(name, tuple) and name[0] == "roster":
+            return self.factory.nurse_view[self.order[name[1]], name[2]]
+        return name
+
+
+def group_constraints(constraints, key=None):
+    """
+        Group constraints by their label, e.g., ("max_consecutive", <nurse name>) or ("cover", <day>).
+        Constraints without a group label each form a group on their own.
+
+        :param: key: optional function mapping the group label of a constraint to a coarser one,
+                        e.g., `lambda group : group[0]` to group by constraint family only
+    """
+    groups = dict()
+    for cons in constraints:
+        group = getattr(cons, "group", str(cons))
+        if key is not None and hasattr(cons, "group"):
+            group = key(group)
+        groups.setdefault(group, []).append(cons)
+    return groups
+
+def load_model(fname, formulation="decision", cache_dir=None, lazy=False):
+    """
+        Read an instance and build its model in the given formulation, any of the keys of `FORMULATIONS`.
+        Returns the factory and the output of its corresponding `get_..._model` method.
+
+        :param: cache_dir: if given, the factory and model are pickled in this directory, keyed by the hash of the instance file,
+                            the formulation and the version of the factory, and loaded from there on later calls
+    """
+    if cache_dir is None:
+        factory = NurseSchedulingFactory(read_data.get_data(fname), lazy=lazy)
+        return factory, getattr(factory, FORMULATIONS[formulation])()
+
+    with open(fname, "rb") as f:
+        key = hashlib.sha1(f.read()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(fname))[0]
+    cache_file = os.path.join(cache_dir, f"{name}-{formulation}{'-lazy' if lazy else ''}-{key}-{FACTORY_VERSION}.pkl")
+    if os.path.exists(cache_file):
+        gc.disable() # unpickling creates many objects but no garbage, collecting would only slow it down
+        try:
+            with open(cache_file, "rb") as f:
+                factory, model = pickle.load(f)
+        finally:
+            gc.enable()
+        _reserve_names([factory.nurse_view, factory.slack_over, factory.slack_under])
+        return factory, model
+
+    factory, model = load_model(fname, formulation, lazy=lazy)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}"
+    with open(tmp_file, "wb") as f:
+        pickle.dump((factory, model), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file) # other workers never see a partial file
+    return factory, model
+
+def _reserve_names(var_arrays):
+    """
+        Make sure variables created after loading a model do not get the same name as unnamed variables in the model
+    """
+    for arr in var_arrays:
+        for var in arr.flat:
+            match = re.fullmatch(r"(IV|BV)(\d+)", var.name)
+            if match is not None:
+                impl = _IntVarImpl if match.group(1) == "IV" else _BoolVarImpl
+                impl.counter = max(impl.counter, int(match.group(2)) + 1)
+
 def is_not_none(*args):
     if any(a is None for a in args):
         return False
     else:
         return True
+
+
+if __name__ == "__main__":
+    # construction time of each constraint family, e.g. `python factory.py Benchmarks/Instance20.txt`
+    import sys
+    from time import time
+
+    fname = sys.argv[1] if len(sys.argv) > 1 else "Benchmarks/Instance12.txt"
+    data = read_data.get_data(fname)
+
+    start = time()
+    factory = NurseSchedulingFactory(data)
+    print(f"{'init':<30}{'':>10}{time()-start:>10.3f}s")
+
+    total = 0
+    families = [(name, dict()) for name in ["shift_rotation", "max_shifts", "max_minutes", "min_minutes", "max_consecutive",
+                                             "min_consecutive", "weekend_shifts", "days_off", "min_consecutive_off"]]
+    families += [(name, dict(formulation=formulation)) for name in ["shift_on_requests", "shift_off_requests", "cover"] for formulation in ["hard", "soft"]]
+    for name, kwargs in families:
+        start = time()
+        constraints = getattr(factory, name)(**kwargs)
+        runtime = time() - start
+        total += runtime
+        if isinstance(constraints, tuple): # constraints and penalty
+            constraints = constraints[0]
+        label = f"{name} ({kwargs['formulation']})" if kwargs else name
+        print(f"{label:<30}{len(constraints):>10}{runtime:>10.3f}s")
+    print(f"{'total':<30}{'':>10}{total:>10.3f}s")
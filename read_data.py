@@ -1,20 +1,12 @@
 import dataclasses
+import hashlib
+import os
 import re
-from io import StringIO
+import numpy as np
 import pandas as pd
 
-def tag_to_data(string, tag, skip_lines=0, datatype=pd.DataFrame, *args, **kwargs):
-
-    regex = rf'{tag}[\s\S]*?($|(?=\n\s*\n))'
-    match = re.search(regex, string)
-
-    data = "\n".join(match.group().split("\n")[skip_lines+1:])
-    if datatype == pd.DataFrame:
-        kwargs = {"header":0, "index_col":0} | kwargs
-        df = pd.read_csv(StringIO(data), *args, **kwargs)
-        return  df.rename(columns=lambda x: x.strip())
-    return datatype(data, *args, **kwargs)
-
+SECTIONS = dict(SECTION_SHIFTS="shifts", SECTION_STAFF="staff", SECTION_DAYS_OFF="days_off",
+                SECTION_SHIFT_ON_REQUESTS="shift_on", SECTION_SHIFT_OFF_REQUESTS="shift_off", SECTION_COVER="cover")
 
 
 @dataclasses.dataclass
@@ -28,49 +20,149 @@ class SchedulingProblem:
     cover : pd.DataFrame = None
 
 
-def get_data(fname):
-    from faker import Faker
-    fake = Faker()
-    fake.seed_instance(0)
-
-    with open(fname, "r") as f:
-        string = f.read()
-
+def split_sections(string):
+    """
+        Split the instance file into its sections, separated by empty lines.
+        Returns a dict mapping each section tag to its lines.
+        The first line of each section is its header comment, later comments are dropped.
+    """
+    sections = dict()
+    for block in re.split(r"\n\s*\n", string):
+        lines = [line.strip() for line in block.strip().split("\n")]
+        tag = next((i for i, line in enumerate(lines) if line.startswith("SECTION_")), None)
+        if tag is None:
+            continue
+        header, *rest = lines[tag+1:]
+        sections[lines[tag]] = [header] + [line for line in rest if not line.startswith("#")]
+    return sections
+
+
+def to_column(values):
+    # same type inference as pd.read_csv: integer if all values are
+    try:
+        return values.astype(np.int64)
+    except ValueError:
+        return values
+
+
+def lines_to_frame(lines, names=None):
+    if names is None:
+        names = [name.strip() for name in lines[0].split(",")]
+    values = ",".join(lines[1:]).split(",")
+    if len(values) == len(names) * (len(lines)-1):
+        table = np.array(values, dtype=object).reshape(-1, len(names))
+    else: # missing trailing fields
+        table = np.array([(line.split(",") + [""] * len(names))[:len(names)] for line in lines[1:]], dtype=object).reshape(-1, len(names))
+    return pd.DataFrame({name : to_column(table[:, i]) for i, name in enumerate(names)})
+
+
+def parse(string):
+    sections = split_sections(string)
     problem = SchedulingProblem()
+    problem.horizon = int(sections["SECTION_HORIZON"][-1])
 
-    problem.horizon = tag_to_data(string, "SECTION_HORIZON", skip_lines=2, datatype=int)
-    shifts = tag_to_data(string, "SECTION_SHIFTS", names=["ShiftID", "Length", "cannot follow"],
-                         dtype={'ShiftID':str, 'Length':int, 'cannot follow':str})
-    shifts.fillna("", inplace=True)
+    shifts = lines_to_frame(sections["SECTION_SHIFTS"], names=["ShiftID", "Length", "cannot follow"])
+    shifts["ShiftID"] = shifts["ShiftID"].astype(str)
     shifts["cannot follow"] = shifts["cannot follow"].apply(lambda val : val.split("|"))
-    problem.shifts = shifts
+    problem.shifts = shifts.set_index("ShiftID")
 
-    staff = tag_to_data(string, "SECTION_STAFF", index_col=False)
+    staff = lines_to_frame(sections["SECTION_STAFF"])
     maxes = staff["MaxShifts"].str.split("|", expand=True)
     for col in maxes:
         shift_id = maxes[col].iloc[0].split("=")[0]
-        column = maxes[col].apply(lambda x : x.split("=")[1])
-        staff[f"max_shifts_{shift_id}"] = column.astype(int)
-
-    staff["name"] = [fake.unique.first_name() for _ in staff.index]
+        staff[f"max_shifts_{shift_id}"] = maxes[col].str.split("=").str[1].astype(int)
+    staff["name"] = staff_names(len(staff))
     problem.staff = staff
 
-    days_off = tag_to_data(string, "SECTION_DAYS_OFF", datatype=str)
-    # process string to be EmployeeID, Day off for each line
-    rows = []
-    for line in days_off.split("\n")[1:]:
-        employee_id , *days = line.split(",")
-        rows += [dict(EmployeeID=employee_id, DayIndex= int(d)) for d in days]
-    problem.days_off = pd.DataFrame(rows)
+    # one row per EmployeeID, Day off
+    employees, days = [], []
+    for line in sections["SECTION_DAYS_OFF"][1:]:
+        employee_id, *days_off = line.split(",")
+        employees += [employee_id] * len(days_off)
+        days += days_off
+    problem.days_off = pd.DataFrame(dict(EmployeeID=np.array(employees, dtype=object), DayIndex=np.array(days, dtype=np.int64)))
+
+    for tag in ["SECTION_SHIFT_ON_REQUESTS", "SECTION_SHIFT_OFF_REQUESTS", "SECTION_COVER"]:
+        setattr(problem, SECTIONS[tag], lines_to_frame(sections[tag]))
+    return problem
+
+
+_names = []
+_fake = None
+
+def staff_names(n):
+    """
+        Fake first names for the staff, the same for every instance with the same number of nurses
+    """
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker()
+        _fake.seed_instance(0)
+    while len(_names) < n:
+        _names.append(_fake.unique.first_name())
+    return _names[:n]
+
+
+def save_problem(problem, fname):
+    """
+        Store the problem as column arrays in an (uncompressed) .npz file
+    """
+    arrays = dict(horizon=np.array(problem.horizon))
+    for name in SECTIONS.values():
+        df = getattr(problem, name)
+        if name == "shifts":
+            df = df.reset_index()
+            df["cannot follow"] = df["cannot follow"].apply("|".join)
+        arrays[f"{name}.columns"] = np.array(df.columns, dtype=str)
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            arrays[f"{name}.{i}"] = values if values.dtype != object else values.astype(str)
+    np.savez(fname, **arrays)
+
+
+def load_problem(fname):
+    problem = SchedulingProblem()
+    with np.load(fname) as arrays:
+        problem.horizon = int(arrays["horizon"])
+        for name in SECTIONS.values():
+            columns = arrays[f"{name}.columns"]
+            data = dict()
+            for i, col in enumerate(columns):
+                values = arrays[f"{name}.{i}"]
+                data[str(col)] = values if values.dtype.kind == "i" else values.astype(object)
+            df = pd.DataFrame(data)
+            if name == "shifts":
+                df["cannot follow"] = df["cannot follow"].apply(lambda val : val.split("|"))
+                df = df.set_index("ShiftID")
+            setattr(problem, name, df)
+    return problem
+
+
+def get_data(fname, cache_dir=None):
+    """
+        Parse a benchmark instance.
+
+        :param: cache_dir: if given, the parsed problem is stored in this directory as a .npz file,
+                            keyed by the hash of the instance file, and loaded from there on later calls
+    """
+    with open(fname, "rb") as f:
+        raw = f.read()
 
+    if cache_dir is None:
+        return parse(raw.decode())
 
-    # problem.days_off = tag_to_data(string, "SECTION_DAYS_OFF", names=["EmployeeID", "DayIdx"])
-    # problem.days_off["DayIdx"] = problem.days_off["DayIdx"].apply(lambda val : val if isinstance(val, int)
-    #                                                                      else [int(x) for x in val.split(",")])
-    problem.shift_on = tag_to_data(string, "SECTION_SHIFT_ON_REQUESTS", index_col=False)
-    problem.shift_off = tag_to_data(string, "SECTION_SHIFT_OFF_REQUESTS", index_col=False)
-    problem.cover = tag_to_data(string, "SECTION_COVER", index_col=False)
+    key = hashlib.sha1(raw).hexdigest()
+    cache_file = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(fname))[0]}-{key}.npz")
+    if os.path.exists(cache_file):
+        return load_problem(cache_file)
 
+    problem = parse(raw.decode())
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}"
+    with open(tmp_file, "wb") as f: # a file object, so numpy does not append .npz to the name
+        save_problem(problem, f)
+    os.replace(tmp_file, cache_file) # other workers never see a partial file
     return problem
 
 
@@ -78,4 +170,4 @@ if __name__ == "__main__":
 
     problem = get_data("Benchmarks/Instance12.txt")
 
-    print(problem)
\ No newline at end of file
+    print(problem)
@@ -0,0 +1,402 @@
+"""
+    Local explanation server keeping instances warm between requests.
+
+    Every request is a JSON object POSTed to `/<endpoint>`, e.g.,
+
+        curl -X POST localhost:8765/mus -d '{"instance": "Instance1", "time_limit": 30}'
+
+    with the name of the instance in the data directory, optionally the formulation (any key of `factory.FORMULATIONS`),
+        a time limit in seconds, an id to cancel the request with `/cancel`, and the parameters of the endpoint.
+    Constraints are referred to by their index in the constraints of the model.
+    `GET /status` lists the workers and the instances they keep warm.
+
+    Solving happens in worker processes, each one keeping the parsed data, the model and the solvers
+        of its most recently used instances. Requests are sent to a worker which has the instance warm when possible.
+    A request is cancelled when its time limit is reached, when the client disconnects or when `/cancel` is called with its id;
+        the worker is then killed and restarted, losing its warm instances.
+    Endpoints in `ANYTIME` respect the time limit themselves, `mus` and `find_sequence` then return their best result so far,
+        with `complete` set to false.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import uuid
+
+import cpmpy as cp
+from cpmpy.transformations.get_variables import get_variables
+
+from factory import load_model, FORMULATIONS
+from explanations.subset import SubsetSession, compact_mus
+from explanations.diagnosis import ConflictStore, DiagnosisOracle
+from explanations.stepwise import find_sequence
+from explanations.deadline import Deadline
+from explanations.utils import describe
+
+ENDPOINTS = ["warm", "solve", "mus", "mcs", "optimal_mcs", "diagnose_optimal", "find_sequence"]
+ANYTIME = ["solve", "optimal_mcs", "mus", "find_sequence"] # endpoints which respect the time limit themselves
+GRACE = 1 # seconds given to endpoints which respect the time limit themselves, before the worker is killed
+
+# workers are not forked from the server itself, they would inherit its sockets and keep client connections open
+_MP_CONTEXT = multiprocessing.get_context("forkserver")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 409: "Conflict", 500: "Internal Server Error", 504: "Gateway Timeout"}
+
+
+class InstanceState:
+    """
+        Warm state of an instance in a worker: the factory, the model and the solvers built for it so far.
+        Its methods are the endpoints of the server, they return JSON-serializable results.
+    """
+    def __init__(self, fname, formulation="decision", cache_dir=None):
+        self.factory, built = load_model(fname, formulation, cache_dir=cache_dir)
+        self.model, self.nurse_view = built[0], built[1]
+        self.constraints = self.model.constraints
+        self.index_of = {id(cons): i for i, cons in enumerate(self.constraints)}
+        self.index_of_row = {cons.meta[1]: i for i, cons in enumerate(self.constraints) if hasattr(cons, "meta")}
+        self.store = ConflictStore()
+
+        self._solver = None
+        self._session = None
+        self._diagnosis = None
+        self._compact = None
+
+    def _index(self, cons):
+        if id(cons) in self.index_of:
+            return self.index_of[id(cons)]
+        if hasattr(cons, "meta"): # copies made by the explanation functions keep their row in the constraint table
+            return self.index_of_row.get(cons.meta[1], -1)
+        return -1
+
+    def _describe(self, constraints):
+        return [dict(index=self._index(cons), description=describe(cons)) for cons in constraints]
+
+    def _select(self, indices=None, exclude=()):
+        if indices is None:
+            indices = range(len(self.constraints))
+        exclude = set(exclude)
+        return [self.constraints[i] for i in indices if i not in exclude]
+
+    def warm(self):
+        self.session # post the model once, so `mus` can answer within a short time limit
+        return dict(n_constraints=len(self.constraints))
+
+    def solve(self, time_limit=None):
+        if self._solver is None:
+            self._solver = cp.SolverLookup.get("ortools", self.model)
+        kwargs = dict() if time_limit is None else dict(time_limit=time_limit)
+        found = self._solver.solve(assumptions=[], **kwargs)
+        result = dict(status=self._solver.status().exitstatus.name)
+        if found:
+            result["roster"] = [[self.factory.idx_to_name[v] for v in row] for row in self.nurse_view.value()]
+            if self.model.objective_ is not None:
+                result["objective"] = int(self._solver.objective_value())
+        return result
+
+    def mus(self, exclude=(), time_limit=None, compact=False):
+        """
+            MUS of the constraints left after excluding the given ones.
+            With `compact`, the window constraints of each nurse are solved as one group (see `factory.compact`),
+                and only shrunk to the fine-grained constraints once that group is in the MUS over groups.
+        """
+        if not compact:
+            found = self.session.mus(self._select(exclude=exclude), deadline=Deadline(time_limit))
+        else:
+            if self._compact is None:
+                self._compact = self.factory.compact(self.constraints)
+            found = compact_mus(self._select(exclude=exclude), compact=self._compact, deadline=Deadline(time_limit))
+        return dict(constraints=self._describe(found), complete=found.complete)
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = SubsetSession(self.constraints)
+        return self._session
+
+    def mcs(self):
+        return self._describe(self.session.mcs())
+
+    def optimal_mcs(self, weights=None, time_limit=None):
+        return self._describe(self.session.optimal_mcs(weights=weights, time_limit=time_limit))
+
+    def diagnose_optimal(self, removed=(), weights=None):
+        """
+            One round of `diagnose_optimal`: the optimal conflict left after removing the given constraints,
+                or None if the remaining constraints are satisfiable.
+            Correction subsets found in earlier rounds are reused.
+        """
+        if self._diagnosis is None:
+            self._diagnosis = DiagnosisOracle(self.constraints)
+        soft = self._diagnosis.soft
+        index_of = {id(cons): i for i, cons in enumerate(soft)}
+        corr_subsets = [[index_of[i] for i in known] for known in self.store.corr_subsets]
+
+        sat_subset = sorted(set(range(len(soft))) - set(removed))
+        core, corr_subsets = self._diagnosis.next_mus(sat_subset, optimal=True, weights=weights, corr_subsets=corr_subsets)
+        for corr_subset in corr_subsets:
+            self.store.add_corr_subset(soft[i] for i in corr_subset)
+        if core is None:
+            return None
+        return self._describe(soft[i] for i in core)
+
+    def find_sequence(self, constraints=None, time_limit=None):
+        """
+            Step-wise explanation of why the given constraints (by default a MUS of the model) are unsatisfiable.
+        """
+        deadline = Deadline(time_limit)
+        subset = self.session.mus(deadline=deadline) if constraints is None else self._select(constraints)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seq = find_sequence(subset, deadline=deadline)
+
+        steps = []
+        for E, S, N in seq:
+            derived = [dict(zip(("nurse", "day"), map(int, self.factory.roster_cell[v])), values=sorted(N[v]))
+                       for v in get_variables(S) if v in E and E[v] > N[v] and v in self.factory.roster_cell]
+            steps.append(dict(constraints=self._describe(S), derived=derived))
+        return dict(steps=steps, complete=seq.complete)
+
+
+def _worker_loop(conn, cache_dir, max_instances):
+    instances = dict() # (fname, formulation) -> InstanceState, least recently used first
+    while True:
+        try:
+            key, endpoint, params = conn.recv()
+        except EOFError:
+            return
+        try:
+            state = instances.pop(key, None)
+            if state is None:
+                state = InstanceState(*key, cache_dir=cache_dir)
+            instances[key] = state
+            while len(instances) > max_instances:
+                del instances[next(iter(instances))]
+            result = (True, getattr(state, endpoint)(**params))
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {e}")
+        conn.send(result + (list(instances),))
+
+
+class Worker:
+    """
+        A worker process running one request at a time.
+    """
+    def __init__(self, cache_dir=None, max_instances=4):
+        self.cache_dir = cache_dir
+        self.max_instances = max_instances
+        self.start()
+
+    def start(self):
+        self.conn, child = _MP_CONTEXT.Pipe()
+        self.process = _MP_CONTEXT.Process(target=_worker_loop, args=(child, self.cache_dir, self.max_instances), daemon=True)
+        self.process.start()
+        child.close()
+        self.instances = [] # warm instances, as last reported by the worker
+        self.busy = False
+
+    def restart(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+    async def call(self, key, endpoint, params):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        self.conn.send((key, endpoint, params))
+        loop.add_reader(self.conn.fileno(), lambda : ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self.conn.fileno())
+
+        try:
+            ok, result, self.instances = self.conn.recv()
+        except EOFError:
+            self.restart()
+            raise RuntimeError("worker died")
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+
+class ExplanationServer:
+    """
+        Serves the explanation functions over HTTP, see the module docstring.
+
+        :param: data_dir: directory with the instances, requests refer to instances by their file name without extension
+        :param: cache_dir: directory to cache built models in, so restarted workers can load them quickly (see `factory.load_model`)
+        :param: max_instances: number of instances each worker keeps warm
+        :param: time_limit: default time limit of a request in seconds
+    """
+    def __init__(self, data_dir="Benchmarks", n_workers=4, cache_dir=None, max_instances=4, time_limit=60):
+        self.data_dir = data_dir
+        self.time_limit = time_limit
+        self.workers = [Worker(cache_dir, max_instances) for _ in range(n_workers)]
+        self.idle = asyncio.Condition()
+        self.jobs = dict() # id -> task
+
+    def _instance(self, name):
+        fname = os.path.join(self.data_dir, f"{name}.txt")
+        if os.path.basename(name) != name or not os.path.isfile(fname):
+            raise ValueError(f"Unknown instance {name}")
+        return fname
+
+    async def _acquire(self, key):
+        async with self.idle:
+            await self.idle.wait_for(lambda : any(not w.busy for w in self.workers))
+            free = [w for w in self.workers if not w.busy]
+            worker = next((w for w in free if key in w.instances), free[0])
+            worker.busy = True
+            return worker
+
+    async def _release(self, worker):
+        async with self.idle:
+            worker.busy = False
+            self.idle.notify_all()
+
+    async def run(self, endpoint, instance, formulation="decision", time_limit=None, **params):
+        """
+            Run an endpoint on an instance in one of the workers, preferably one which has the instance warm.
+        """
+        if endpoint not in ENDPOINTS:
+            raise KeyError(endpoint)
+        if formulation not in FORMULATIONS:
+            raise ValueError(f"Unknown formulation {formulation}")
+        key = (self._instance(instance), formulation)
+        if time_limit is None:
+            time_limit = self.time_limit
+        if endpoint in ANYTIME:
+            params["time_limit"] = time_limit
+            time_limit += GRACE
+
+        worker = await self._acquire(key)
+        try:
+            return await asyncio.wait_for(worker.call(key, endpoint, params), time_limit)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            worker.restart() # the only way to stop the solver
+            raise
+        finally:
+            await self._release(worker)
+
+    def status(self):
+        return dict(workers=[dict(pid=w.process.pid, busy=w.busy, instances=[f"{os.path.basename(fname)[:-4]} ({formulation})"
+                                                                            for fname, formulation in w.instances])
+                             for w in self.workers],
+                    jobs=list(self.jobs))
+
+    async def handle(self, method, path, body):
+        """
+            Answer a request, returns the HTTP status code and the JSON response.
+        """
+        endpoint = path.strip("/")
+        if method == "GET" and endpoint == "status":
+            return 200, self.status()
+        if method != "POST":
+            return 404, dict(error=f"Unknown endpoint {method} {path}")
+
+        try:
+            params = json.loads(body or b"{}")
+            assert isinstance(params, dict), "request must be a JSON object"
+        except (ValueError, AssertionError) as e:
+            return 400, dict(error=str(e))
+
+        if endpoint == "cancel":
+            task = self.jobs.get(params.get("id"))
+            if task is None:
+                return 404, dict(error=f"Unknown job {params.get('id')}")
+            task.cancel()
+            return 200, dict(id=params["id"], cancelled=True)
+        if endpoint not in ENDPOINTS:
+            return 404, dict(error=f"Unknown endpoint {method} {path}")
+        if "instance" not in params:
+            return 400, dict(error="missing instance")
+
+        job_id = str(params.pop("id", uuid.uuid4()))
+        task = asyncio.ensure_future(self.run(endpoint, **params))
+        self.jobs[job_id] = task
+        try:
+            return 200, dict(id=job_id, result=await task)
+        except asyncio.TimeoutError:
+            return 504, dict(id=job_id, error="time limit reached")
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise # the server itself is being cancelled
+            return 409, dict(id=job_id, error="cancelled")
+        except (ValueError, TypeError) as e:
+            return 400, dict(id=job_id, error=str(e))
+        except Exception as e:
+            return 500, dict(id=job_id, error=str(e))
+        finally:
+            del self.jobs[job_id]
+
+    async def _connection(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode().split()
+            headers = dict()
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = 400, dict(error="malformed request")
+        else:
+            # cancel the request when the client disconnects
+            request = asyncio.ensure_future(self.handle(method, path, body))
+            closed = asyncio.ensure_future(reader.read())
+            await asyncio.wait([request, closed], return_when=asyncio.FIRST_COMPLETED)
+            closed.cancel()
+            if not request.done():
+                request.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await request
+                writer.close()
+                return
+            status, response = request.result()
+
+        payload = json.dumps(response).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """
+            Serve on a TCP port on localhost, or on a Unix socket if `path` is given.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self._connection, path=path)
+        else:
+            server = await asyncio.start_server(self._connection, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        for worker in self.workers:
+            worker.process.kill()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local explanation server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="path of a Unix socket to serve on instead of TCP")
+    parser.add_argument("--data-dir", default="Benchmarks")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-instances", type=int, default=4)
+    parser.add_argument("--time-limit", type=float, default=60)
+    args = parser.parse_args()
+
+    async def main():
+        server = ExplanationServer(args.data_dir, args.workers, args.cache_dir, args.max_instances, args.time_limit)
+        try:
+            await server.serve(args.host, args.port, args.unix)
+        finally:
+            server.close()
+
+    asyncio.run(main())
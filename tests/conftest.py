@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the repository are imported from its root, as in the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Megan (nurse A) has a day off on Monday and Kevin (nurse B) asks Thursday off,
+#   while all three nurses are needed on both days: two disjoint conflicts of two constraints each
+SMALL = """# Small instance for the tests
+SECTION_HORIZON
+# The horizon length in days:
+7
+
+SECTION_SHIFTS
+# ShiftID, Length in mins, Shifts which cannot follow this shift | separated
+D,480,
+
+SECTION_STAFF
+# ID, MaxShifts, MaxTotalMinutes, MinTotalMinutes, MaxConsecutiveShifts, MinConsecutiveShifts, MinConsecutiveDaysOff, MaxWeekends
+A,D=7,3360,0,7,1,1,2
+B,D=7,3360,0,7,1,1,2
+C,D=7,3360,0,7,1,1,2
+
+SECTION_DAYS_OFF
+# EmployeeID, DayIndexes (start at zero)
+A,0
+
+SECTION_SHIFT_ON_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+
+SECTION_SHIFT_OFF_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+B,3,D,1
+
+SECTION_COVER
+# Day, ShiftID, Requirement, Weight for under, Weight for over
+0,D,3,100,1
+1,D,2,100,1
+2,D,2,100,1
+3,D,3,100,1
+4,D,1,100,1
+5,D,1,100,1
+6,D,1,100,1
+"""
+
+
+@pytest.fixture
+def small_instance(tmp_path):
+    """
+        Path of the small instance, written to the temporary directory of the test.
+    """
+    fname = tmp_path / "Small.txt"
+    fname.write_text(SMALL)
+    return str(fname)
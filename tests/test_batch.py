@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import pytest
+
+from batch import ResultStore, make_jobs, run_batch
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Benchmarks")
+SLOW = "Instance10" # takes several seconds to warm
+
+
+def test_run_batch(tmp_path, small_instance):
+    data_dir = os.path.dirname(small_instance)
+    spec = {"instances": ["Small*"], "algorithms": ["mus", "optimal_mcs"], "time_limits": [60]}
+    jobs = list(make_jobs(spec, data_dir))
+    assert [job["algorithm"] for job in jobs] == ["mus", "optimal_mcs"]
+    with pytest.raises(ValueError):
+        list(make_jobs(dict(spec, algorithms=["unknown"]), data_dir))
+
+    fname = str(tmp_path / "results.jsonl")
+    results = list(run_batch(jobs, ResultStore(fname), data_dir, n_workers=2))
+    assert sorted(result["key"] for result in results) == sorted(job["key"] for job in jobs)
+    assert all(result["status"] == "ok" for result in results)
+
+    # a partially written line is ignored, jobs with a result are not run again
+    with open(fname, "a") as f:
+        f.write('{"key": ')
+    store = ResultStore(fname)
+    assert all(job["key"] in store for job in jobs)
+    assert list(run_batch(jobs, store, data_dir)) == []
+
+
+def test_timeout(tmp_path):
+    shutil.copy(os.path.join(BENCHMARKS, f"{SLOW}.txt"), tmp_path)
+    jobs = list(make_jobs({"instances": [SLOW], "algorithms": ["warm"], "time_limits": [0]}, str(tmp_path)))
+    store = ResultStore(str(tmp_path / "results.jsonl"))
+    assert [result["status"] for result in run_batch(jobs, store, str(tmp_path))] == ["timeout"]
+    # only retried when asked for
+    assert list(run_batch(jobs, store, str(tmp_path))) == []
@@ -0,0 +1,44 @@
+import cpmpy as cp
+import pytest
+
+from explanations.counterfactual import inverse_optimize, inverse_optimize_batch
+
+bvars = cp.boolvar(shape=8, name="b")
+VALUES = [5, 0, 3, 3, 7, 9, 3, 5]
+# knapsack, the user wants one item and not another one
+KNAPSACK = cp.Model(cp.sum(bvars * [2, 4, 7, 6, 8, 8, 1, 6]) <= 35)
+KNAPSACK.maximize(cp.sum(bvars * VALUES))
+QUERIES = [({bvars[i] : True, bvars[i-3] : False}, {bvars[i], bvars[i-3]}) for i in range(len(bvars))]
+
+
+def _check(new_obj, user_sol, allowed_to_change):
+    """
+        Only the allowed weights changed, and the user's solution is optimal for the new objective.
+        Returns the total change of the weights.
+    """
+    new_weights, obj_vars = new_obj.args
+    assert all(w == v or var in allowed_to_change for w, v, var in zip(new_weights, VALUES, obj_vars))
+    best = cp.Model(KNAPSACK.constraints, maximize=new_obj)
+    assert best.solve()
+    with_user = cp.Model(KNAPSACK.constraints, [var == val for var, val in user_sol.items()], maximize=new_obj)
+    assert with_user.solve() and with_user.objective_value() == best.objective_value()
+    return sum(abs(w - v) for w, v in zip(new_weights, VALUES))
+
+
+@pytest.mark.parametrize("user_sol, allowed_to_change", QUERIES)
+def test_inverse_optimize(user_sol, allowed_to_change):
+    new_obj = inverse_optimize(KNAPSACK, user_sol, allowed_to_change, minimize=False)
+    assert new_obj.complete
+    # adding several cuts per iteration finds an equally small change as a single one
+    single = inverse_optimize(KNAPSACK, user_sol, allowed_to_change, minimize=False, max_cuts=1)
+    assert _check(new_obj, user_sol, allowed_to_change) == _check(single, user_sol, allowed_to_change)
+
+
+def test_inverse_optimize_batch():
+    # without any weight allowed to change, the user's solution cannot become optimal
+    queries = QUERIES + [({bvars[1] : True, bvars[5] : False}, set())]
+    found = dict(inverse_optimize_batch(KNAPSACK, queries, minimize=False, n_workers=2))
+    assert sorted(found) == list(range(len(queries))) and found[len(QUERIES)] is None
+    for i, (user_sol, allowed_to_change) in enumerate(QUERIES):
+        single = inverse_optimize(KNAPSACK, user_sol, allowed_to_change, minimize=False)
+        assert _check(found[i], user_sol, allowed_to_change) == _check(single, user_sol, allowed_to_change)
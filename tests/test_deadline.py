@@ -0,0 +1,58 @@
+"""
+    Explanation calls with a deadline which has already passed return an incomplete result instead of raising.
+"""
+import cpmpy as cp
+import pytest
+
+from explanations.deadline import Deadline
+from explanations.subset import mus, maxsat, mcs, optimal_mcs, smus, ocus_oneof
+from explanations.diagnosis import diagnose_optimal
+from explanations.counterfactual import inverse_optimize
+
+x = cp.intvar(0, 5, shape=4, name="x")
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+
+
+def _rest(subset):
+    return [cons for cons in SOFT if not any(cons is other for other in subset)]
+
+
+def test_mus():
+    found = mus(SOFT, deadline=Deadline(0))
+    assert not found.complete and not cp.Model(found).solve()
+
+
+@pytest.mark.parametrize("weights", [None, [1, 2, 3, 4, 5, 6]])
+def test_maxsat(weights):
+    found = maxsat(SOFT, weights=weights, deadline=Deadline(0))
+    assert not found.complete and cp.Model(found).solve()
+    found = optimal_mcs(SOFT, weights=weights, deadline=Deadline(0))
+    assert not found.complete and cp.Model(_rest(found)).solve()
+
+
+def test_mcs():
+    found = mcs(SOFT, deadline=Deadline(0))
+    assert not found.complete and cp.Model(_rest(found)).solve()
+
+
+def test_smus():
+    for found in (smus(SOFT, hs_solver="ortools", deadline=Deadline(0)),
+                  ocus_oneof(SOFT, oneof_idxes=[0, 1], hs_solver="ortools", deadline=Deadline(0))):
+        assert not found.complete and not cp.Model(found).solve()
+
+
+def test_diagnose_optimal(monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt : "-1")
+    shown = []
+    diagnose_optimal(SOFT, callback=shown.append, deadline=Deadline(0))
+    # either no conflict was found in time, or one that may not be optimal
+    assert all(not conflict.complete and not cp.Model(conflict).solve() for conflict in shown)
+
+
+def test_inverse_optimize():
+    bvars = cp.boolvar(shape=4, name="b")
+    model = cp.Model(cp.sum(bvars * [2, 4, 7, 6]) <= 10)
+    model.maximize(cp.sum(bvars * [5, 1, 3, 3]))
+    new_obj = inverse_optimize(model, {bvars[1]: True}, {bvars[1]}, minimize=False, deadline=Deadline(0))
+    assert not new_obj.complete
+    assert inverse_optimize(model, {bvars[1]: True}, {bvars[1]}, minimize=False, deadline=Deadline(60)).complete
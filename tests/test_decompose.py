@@ -0,0 +1,57 @@
+import cpmpy as cp
+import pytest
+
+from explanations.decompose import components, component_mus, component_mcs, component_marco
+from explanations.subset import mus
+
+x = cp.intvar(0, 5, shape=4, name="x")
+y = cp.intvar(0, 5, name="y")
+# two independent conflicts, and a satisfiable component
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+
+
+def test_components():
+    comps = components(SOFT)
+    assert sorted(idxes for idxes, _ in comps) == [[0, 1], [2], [3, 4, 5]]
+
+
+def test_constant_hard_constraints():
+    # a hard constraint without variables is part of every component, the model stays UNSAT per component
+    comps = components(SOFT, [cp.BoolVal(False)])
+    assert all(len(hard) == 1 for _, hard in comps)
+    assert component_mus([x[1] > 3], [cp.BoolVal(False)]) == mus([x[1] > 3], [cp.BoolVal(False)]) == []
+
+
+@pytest.mark.parametrize("pool", [None, "thread", "process"])
+def test_component_mus(pool):
+    assert {str(cons) for cons in component_mus(SOFT, pool=pool, n_workers=2)} in ({"x[0] > 2", "x[0] < 2"},
+                                                                                  {str(SOFT[3]), "x[3] > 4", "x[2] < 3"})
+    with pytest.raises(AssertionError):
+        component_mus([x[1] > 3, x[2] < 3], pool=pool, n_workers=2)
+
+
+@pytest.mark.parametrize("pool", [None, "thread", "process"])
+def test_component_mcs(pool):
+    found = component_mcs(SOFT, pool=pool, n_workers=2)
+    rest = [cons for cons in SOFT if not any(cons is other for other in found)]
+    assert len(found) == 2 and cp.Model(rest).solve()
+
+
+@pytest.mark.parametrize("pool", [None, "thread", "process"])
+def test_component_marco(pool):
+    found = list(component_marco(SOFT, [y < 3], pool=pool, n_workers=2))
+    muses = {frozenset(map(str, subset)) for kind, subset in found if kind == "MUS"}
+    assert muses == {frozenset({"x[0] > 2", "x[0] < 2"}), frozenset({str(SOFT[3]), "x[3] > 4", "x[2] < 3"})}
+    msses = [subset for kind, subset in found if kind == "MSS"]
+    # one of two times one of three constraints left out, combined from the MSSes of the components
+    assert len(msses) == 6 and all(cp.Model(mss).solve() for mss in msses)
+
+
+@pytest.mark.parametrize("pool", [None, "thread", "process"])
+def test_hard_only_component(pool):
+    # the hard constraint shares no variables with the soft ones, and is UNSAT on its own
+    assert components(SOFT, [y > 6])[-1] == ([], [y > 6])
+    assert list(component_marco(SOFT, [y > 6], pool=pool, n_workers=2)) == [("MUS", [])]
+    assert component_mus(SOFT[2:3], [y > 6], pool=pool, n_workers=2) == mus(SOFT[2:3], [y > 6]) == []
+    with pytest.raises(AssertionError):
+        component_mcs(SOFT, [y > 6], pool=pool, n_workers=2)
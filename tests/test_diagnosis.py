@@ -0,0 +1,64 @@
+import asyncio
+
+import cpmpy as cp
+import pytest
+
+from explanations.diagnosis import diagnose, ConflictStore, DiagnosisSession
+
+x = cp.intvar(0, 5, shape=4, name="x")
+# two independent conflicts, and a satisfiable component
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+WEIGHTS = [1, 2, 3, 1, 2, 3]
+
+
+def _is_mus(subset):
+    return not cp.Model(subset).solve() and all(cp.Model([other for other in subset if other is not cons]).solve() for cons in subset)
+
+
+async def _diagnose(**kwargs):
+    """
+        Remove the first constraint of each conflict, returns the conflicts shown and the constraints removed.
+    """
+    shown = []
+    async with DiagnosisSession(SOFT, **kwargs) as session:
+        conflict = await session.conflict()
+        while conflict is not None:
+            shown.append(conflict)
+            conflict = await session.remove(0)
+    return shown, session.corrections
+
+
+@pytest.mark.parametrize("optimal", [False, True])
+def test_diagnosis_session(optimal):
+    shown, corrections = asyncio.run(_diagnose(weights=WEIGHTS, optimal=optimal, n_workers=2))
+    assert len(shown) == 2 and all(_is_mus(conflict) for conflict in shown)
+    assert len(corrections) == 2 and all(cons is conflict[0] for cons, conflict in zip(corrections, shown))
+    assert cp.Model([cons for cons in SOFT if not any(cons is other for other in corrections)]).solve()
+    if optimal: # the conflict with the lowest total weight first
+        assert {str(cons) for cons in shown[0]} == {"x[0] > 2", "x[0] < 2"}
+
+
+def test_conflict_store(monkeypatch):
+    store = ConflictStore()
+    store.add_mus(SOFT[3:])
+    store.add_mus(SOFT[:2])
+    store.add_mus(SOFT[1::-1])
+    assert len(store.muses) == 2
+    # the smallest known MUS in the subset
+    assert store.get_mus(SOFT) == frozenset(map(id, SOFT[:2]))
+    assert store.get_mus(SOFT[1:]) == frozenset(map(id, SOFT[3:]))
+    assert store.get_mus(SOFT[1:5]) is None
+
+    # the MUSes and correction subsets found are kept for the next diagnosis
+    monkeypatch.setattr("builtins.input", lambda prompt : "0")
+    store = ConflictStore()
+    shown = []
+    corrections = diagnose(SOFT, callback=shown.append, store=store)
+    assert {frozenset(map(id, mus)) for mus in shown} == set(store.muses)
+    assert len(store.corr_subsets) > 0
+    for corr_subset in store.corr_subsets:
+        assert cp.Model([cons for cons in SOFT if id(cons) not in corr_subset]).solve()
+
+    again = []
+    assert [id(cons) for cons in diagnose(SOFT, callback=again.append, store=store)] == [id(cons) for cons in corrections]
+    assert [[id(cons) for cons in mus] for mus in again] == [[id(cons) for cons in mus] for mus in shown]
@@ -0,0 +1,112 @@
+import itertools
+import re
+
+import cpmpy as cp
+import pytest
+from cpmpy.expressions.variables import _IntVarImpl
+from cpmpy.transformations.get_variables import get_variables
+from cpmpy.transformations.normalize import toplevel_list
+
+from factory import load_model, ConstraintTable, FORMULATIONS
+from explanations.utils import describe, get_visualizer
+
+# a single nurse with two shift types, a day shift cannot follow a night shift
+ROTATION = """# One nurse, all hard constraints binding
+SECTION_HORIZON
+# The horizon length in days:
+7
+
+SECTION_SHIFTS
+# ShiftID, Length in mins, Shifts which cannot follow this shift | separated
+D,480,
+N,600,D
+
+SECTION_STAFF
+# ID, MaxShifts, MaxTotalMinutes, MinTotalMinutes, MaxConsecutiveShifts, MinConsecutiveShifts, MinConsecutiveDaysOff, MaxWeekends
+A,D=7|N=2,2040,960,2,2,2,0
+
+SECTION_DAYS_OFF
+# EmployeeID, DayIndexes (start at zero)
+A,0
+
+SECTION_SHIFT_ON_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+
+SECTION_SHIFT_OFF_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+
+SECTION_COVER
+# Day, ShiftID, Requirement, Weight for under, Weight for over
+"""
+
+
+def _runs(roster, working):
+    """
+        Lengths of the periods of working (or free) days not starting on the first day, and whether they end on the last day.
+    """
+    for i in range(1, len(roster)):
+        if (roster[i] != 0) == working and (roster[i-1] != 0) != working:
+            length = next((j for j in range(i, len(roster)) if (roster[j] != 0) != working), len(roster)) - i
+            yield length, i + length == len(roster)
+
+
+def _is_valid(roster):
+    return (roster[0] == 0 # day off
+            and roster.count(2) <= 2 # night shifts
+            and 960 <= 480 * roster.count(1) + 600 * roster.count(2) <= 2040 # minutes
+            and all(0 in roster[i:i+3] for i in range(len(roster) - 2)) # max consecutive
+            and all(length >= 2 or last for length, last in _runs(roster, working=True)) # min consecutive
+            and all(length >= 2 or last for length, last in _runs(roster, working=False)) # min consecutive off
+            and roster[5] == roster[6] == 0 # no weekends
+            and all(not (shift == 2 and nxt == 1) for shift, nxt in zip(roster, roster[1:]))) # rotation
+
+
+def test_hard_constraints(tmp_path):
+    (tmp_path / "Rotation.txt").write_text(ROTATION)
+    factory, (model, roster) = load_model(str(tmp_path / "Rotation.txt"))
+    # without requests nor cover, the decision model has the hard constraints only
+    hard = model.constraints
+    assert {cons.group[0] for cons in hard} == {"shift_rotation", "max_shifts", "max_minutes", "min_minutes", "max_consecutive",
+                                                "min_consecutive", "weekend_shifts", "days_off", "min_consecutive_off"}
+    n_valid = 0
+    for values in itertools.product(range(3), repeat=7):
+        for var, val in zip(roster[0], values):
+            var._value = val
+        assert all(cons.value() for cons in hard) == _is_valid(list(values)), values
+        n_valid += _is_valid(list(values))
+    assert n_valid > 0
+
+
+@pytest.mark.parametrize("formulation", list(FORMULATIONS))
+def test_lazy_descriptions(small_instance, formulation, monkeypatch):
+    _, (model, *_) = load_model(small_instance, formulation)
+    _, (lazy, *_) = load_model(small_instance, formulation, lazy=True)
+    constraints = toplevel_list(model.constraints, merge_and=False)
+    lazy_constraints = toplevel_list(lazy.constraints, merge_and=False)
+    assert len(constraints) == len(lazy_constraints)
+    # descriptions are only generated when needed, and the same as those set when building the model
+    assert all(str(cons) == repr(cons) for cons in lazy_constraints)
+    assert [describe(cons) for cons in lazy_constraints] == [describe(cons) for cons in constraints]
+    # and stored on the constraint
+    monkeypatch.setattr(ConstraintTable, "describe", lambda table, row : pytest.fail("description generated twice"))
+    assert [describe(cons) for cons in lazy_constraints] == [describe(cons) for cons in constraints]
+    assert [get_visualizer(cons) is None for cons in lazy_constraints] == [get_visualizer(cons) is None for cons in constraints]
+
+
+@pytest.mark.parametrize("formulation", ["decision", "slack"])
+def test_cached_model(tmp_path, small_instance, formulation, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    _, (model, *_) = load_model(small_instance, formulation)
+    built, (stored, *_) = load_model(small_instance, formulation, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob(f"Small-{formulation}-*.pkl"))) == 1
+
+    # as in a new process, where only the variables before those of the model were created
+    unnamed = [int(var.name[2:]) for var in get_variables(stored.constraints) if re.fullmatch(r"IV\d+", var.name)]
+    monkeypatch.setattr(_IntVarImpl, "counter", min(unnamed, default=0))
+    factory, (cached, *_) = load_model(small_instance, formulation, cache_dir=cache_dir)
+    assert factory is not built and len(list(cache_dir.glob("*.pkl"))) == 1
+    assert [describe(cons) for cons in cached.constraints] == [describe(cons) for cons in model.constraints]
+    assert [repr(cons) for cons in cached.constraints] == [repr(cons) for cons in stored.constraints]
+    assert cached.solve() == model.solve()
+    # variables made after loading do not clash with unnamed variables of the model
+    assert cp.intvar(0, 1).name not in {var.name for var in get_variables(cached.constraints)}
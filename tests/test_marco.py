@@ -0,0 +1,33 @@
+import cpmpy as cp
+
+from explanations.marco_mcs_mus import do_marco, do_group_marco
+
+x = cp.intvar(0, 5, shape=4, name="x")
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+
+
+def _enumerate(found):
+    subsets = {"MUS": set(), "MSS": set()}
+    for kind, subset in found:
+        assert subset.complete
+        subsets[kind].add(frozenset(str(cons) for cons in subset))
+    return subsets
+
+
+def test_do_marco():
+    subsets = _enumerate(do_marco(cp.Model(SOFT)))
+    assert subsets["MUS"] == {frozenset({"x[0] > 2", "x[0] < 2"}), frozenset({str(SOFT[3]), "x[3] > 4", "x[2] < 3"})}
+    # one of two times one of three constraints left out
+    assert len(subsets["MSS"]) == 6
+    for mss in subsets["MSS"]:
+        assert cp.Model([cons for cons in SOFT if str(cons) in mss]).solve()
+
+
+def test_do_group_marco():
+    groups = {"first": SOFT[:2], "second": SOFT[2:3], "third": SOFT[3:]}
+    subsets = _enumerate(do_group_marco(groups))
+    assert subsets == {"MUS": {frozenset({"first"}), frozenset({"third"})}, "MSS": {frozenset({"second"})}}
+
+    # a single group, conflicting with the hard constraints
+    subsets = _enumerate(do_group_marco({"first": [x[0] > 2]}, hard=[x[0] < 2]))
+    assert subsets == {"MUS": {frozenset({"first"})}, "MSS": {frozenset()}}
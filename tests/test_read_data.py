@@ -0,0 +1,33 @@
+import os
+
+import pandas as pd
+import pytest
+
+import read_data
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Benchmarks")
+
+
+def _assert_equal(problem, other):
+    assert problem.horizon == other.horizon
+    for name in read_data.SECTIONS.values():
+        pd.testing.assert_frame_equal(getattr(problem, name), getattr(other, name))
+
+
+@pytest.mark.parametrize("instance", ["Instance1.txt", "Instance10.txt"])
+def test_cached_data(tmp_path, small_instance, instance):
+    for fname in (small_instance, os.path.join(BENCHMARKS, instance)):
+        problem = read_data.get_data(fname)
+        cache_dir = tmp_path / "cache"
+        _assert_equal(read_data.get_data(fname, cache_dir=cache_dir), problem)
+        cached = list(cache_dir.glob(f"{os.path.splitext(os.path.basename(fname))[0]}-*.npz"))
+        assert len(cached) == 1
+        # the second call loads the stored file
+        _assert_equal(read_data.get_data(fname, cache_dir=cache_dir), problem)
+        assert list(cache_dir.glob(f"{os.path.splitext(os.path.basename(fname))[0]}-*")) == cached
+
+    # a changed instance is parsed again
+    with open(small_instance, "a") as f:
+        f.write("\n")
+    read_data.get_data(small_instance, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("Small-*.npz"))) == 2
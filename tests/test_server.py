@@ -0,0 +1,177 @@
+"""
+    Integration tests of the explanation server, served on a Unix socket in a temporary directory so nothing leaves localhost.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+from server import ExplanationServer
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Benchmarks")
+SLOW = "Instance10" # takes several seconds to warm, long enough to be cancelled
+
+
+@pytest.fixture
+def data_dir(tmp_path, small_instance):
+    shutil.copy(os.path.join(BENCHMARKS, f"{SLOW}.txt"), tmp_path)
+    return str(tmp_path)
+
+
+def _serve(data_dir, scenario):
+    """
+        Run `scenario(server, socket)` against a server with a single worker, on a Unix socket in the data directory.
+    """
+    async def main():
+        socket = os.path.join(data_dir, "server.sock")
+        server = ExplanationServer(data_dir, n_workers=1, time_limit=60)
+        serving = asyncio.ensure_future(server.serve(path=socket))
+        try:
+            while not os.path.exists(socket):
+                await asyncio.sleep(0.01)
+            return await scenario(server, socket)
+        finally:
+            serving.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await serving
+            server.close()
+    return asyncio.run(main())
+
+
+async def _send(socket, method, endpoint, params=None):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    body = b"" if params is None else json.dumps(params).encode()
+    writer.write(f"{method} /{endpoint} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    return reader, writer
+
+
+async def _request(socket, endpoint, params=None, method="POST"):
+    """
+        Send a request and wait for the response, returns the status code and the JSON response.
+    """
+    reader, writer = await _send(socket, method, endpoint, params)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+async def _status(socket):
+    code, status = await _request(socket, "status", method="GET")
+    assert code == 200
+    return status
+
+
+async def _wait_for(socket, condition, timeout=30):
+    """
+        Poll `/status` until the condition holds for it, returns the status.
+    """
+    end = time.time() + timeout
+    while time.time() < end:
+        status = await _status(socket)
+        if condition(status):
+            return status
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"condition not reached, status: {status}")
+
+
+def test_endpoints(data_dir):
+    async def scenario(server, socket):
+        code, response = await _request(socket, "warm", dict(instance="Small"))
+        assert code == 200 and response["result"]["n_constraints"] == 57
+        status = await _status(socket)
+        assert status["workers"][0]["instances"] == ["Small (decision)"]
+
+        code, response = await _request(socket, "solve", dict(instance="Small"))
+        assert code == 200 and response["result"]["status"] == "UNSATISFIABLE"
+
+        code, response = await _request(socket, "mus", dict(instance="Small", time_limit=30))
+        assert code == 200 and response["result"]["complete"]
+        mus = {cons["index"] for cons in response["result"]["constraints"]}
+        assert len(mus) == 2 and all(i >= 0 for i in mus)
+        code, response = await _request(socket, "mus", dict(instance="Small", compact=True, time_limit=30))
+        assert code == 200 and response["result"]["complete"] and len(response["result"]["constraints"]) == 2
+
+        code, response = await _request(socket, "mcs", dict(instance="Small"))
+        assert code == 200
+        mcs = {cons["index"] for cons in response["result"]}
+        assert len(mcs & mus) > 0 # every correction subset hits every conflict
+
+        code, response = await _request(socket, "optimal_mcs", dict(instance="Small", time_limit=30))
+        assert code == 200 and len(response["result"]) == 2 # one constraint of each conflict
+
+        # diagnosis rounds, removing the first constraint of each conflict until none is left
+        removed = []
+        for _ in range(2):
+            code, response = await _request(socket, "diagnose_optimal", dict(instance="Small", removed=removed))
+            assert code == 200 and len(response["result"]) == 2
+            assert not {cons["index"] for cons in response["result"]} & set(removed)
+            removed.append(response["result"][0]["index"])
+        code, response = await _request(socket, "diagnose_optimal", dict(instance="Small", removed=removed))
+        assert code == 200 and response["result"] is None
+
+        code, response = await _request(socket, "find_sequence", dict(instance="Small", constraints=sorted(mus), time_limit=30))
+        assert code == 200 and response["result"]["complete"]
+        steps = response["result"]["steps"]
+        assert len(steps) > 0
+        assert {cons["index"] for step in steps for cons in step["constraints"]} <= mus
+
+        assert (await _request(socket, "unknown", dict(instance="Small")))[0] == 404
+        assert (await _request(socket, "mus", dict(instance="Missing")))[0] == 400
+        assert (await _request(socket, "mus", dict(instance="../Small")))[0] == 400
+        assert (await _request(socket, "cancel", dict(id="missing")))[0] == 404
+        # the worker survives errors
+        assert (await _status(socket))["workers"][0]["instances"] == ["Small (decision)"]
+
+    _serve(data_dir, scenario)
+
+
+def test_time_limit_restarts_worker(data_dir):
+    async def scenario(server, socket):
+        pid = (await _status(socket))["workers"][0]["pid"]
+        start = time.time()
+        code, response = await _request(socket, "warm", dict(instance=SLOW, time_limit=1))
+        assert code == 504 and time.time() - start < 10
+
+        status = await _status(socket)
+        assert status["workers"][0]["pid"] != pid and status["jobs"] == []
+        # the restarted worker answers new requests
+        code, response = await _request(socket, "warm", dict(instance="Small"))
+        assert code == 200
+
+    _serve(data_dir, scenario)
+
+
+def test_cancel(data_dir):
+    async def scenario(server, socket):
+        pid = (await _status(socket))["workers"][0]["pid"]
+        request = asyncio.ensure_future(_request(socket, "warm", dict(instance=SLOW, id="slow")))
+        await _wait_for(socket, lambda status : "slow" in status["jobs"])
+
+        code, response = await _request(socket, "cancel", dict(id="slow"))
+        assert code == 200 and response["cancelled"]
+        code, response = await request
+        assert code == 409 and response["id"] == "slow"
+
+        status = await _status(socket)
+        assert status["workers"][0]["pid"] != pid and status["jobs"] == []
+
+    _serve(data_dir, scenario)
+
+
+def test_client_disconnect(data_dir):
+    async def scenario(server, socket):
+        pid = (await _status(socket))["workers"][0]["pid"]
+        _, writer = await _send(socket, "POST", "warm", dict(instance=SLOW, id="gone"))
+        await _wait_for(socket, lambda status : "gone" in status["jobs"])
+
+        writer.close()
+        status = await _wait_for(socket, lambda status : status["jobs"] == [], timeout=10)
+        assert status["workers"][0]["pid"] != pid and not status["workers"][0]["busy"]
+
+    _serve(data_dir, scenario)
@@ -0,0 +1,57 @@
+import cpmpy as cp
+from cpmpy.transformations.get_variables import get_variables
+
+from factory import load_model
+from explanations.stepwise.datastructures import DomainSet
+from explanations.stepwise.forward import proof_skeleton, construct_from_proof, construct_greedy
+from explanations.stepwise.propagate import MaximalPropagate
+
+x = cp.intvar(0, 9, shape=4, name="x")
+# UNSAT cycle, no single constraint propagates the conflict
+CYCLE = [x[0] >= x[1] + 3, x[1] >= x[2] + 3, x[2] >= x[3] + 3, x[3] >= x[0] - 5]
+UNSAT = DomainSet({var : frozenset() for var in get_variables(CYCLE)})
+
+
+def _check_steps(seq):
+    """
+        Every step is the propagation of its constraints from the domains the previous step ends in.
+    """
+    propagator = MaximalPropagate(constraints=CYCLE, caching=False)
+    domains = DomainSet({var : frozenset(range(var.lb, var.ub+1)) for var in get_variables(CYCLE)})
+    for step in seq:
+        assert step.Rin == domains and len(step.S) > 0
+        assert propagator.propagate(step.Rin, step.S, time_limit=10) == step.Rout < step.Rin
+        domains = step.Rout
+    assert domains <= UNSAT
+
+
+def test_proof_skeleton():
+    skeleton, core = proof_skeleton(CYCLE)
+    assert len(skeleton) > 0
+    assert all(any(cons is other for other in CYCLE) for step in skeleton for cons in step)
+    assert len(core) == 4
+
+
+def test_construct_from_proof():
+    seq = construct_from_proof(CYCLE, UNSAT, time_limit=60)
+    assert seq.complete and len(seq) > 1
+    _check_steps(seq)
+
+
+def test_cached_propagation(small_instance):
+    # nurses of the small instance are symmetric, the slack of a cover constraint is not a shift of any of them
+    factory, (model, _, _, under) = load_model(small_instance, formulation="slack")
+    cover = [cons for cons in model.constraints if getattr(cons, "group", ("",))[0] == "cover"][:1]
+    full = DomainSet({var : frozenset(range(var.lb, var.ub+1)) for var in get_variables(cover)})
+    no_under = DomainSet({var : frozenset([0]) if var is under[0, 0] else dom for var, dom in full.items()})
+
+    cached = MaximalPropagate(constraints=model.constraints, caching=True)
+    uncached = MaximalPropagate(constraints=model.constraints, caching=False)
+    for domains in (full, no_under, full):
+        assert cached.propagate(domains, cover, time_limit=10) == uncached.propagate(domains, cover, time_limit=10)
+
+
+def test_ocus_steps():
+    seq = construct_greedy(CYCLE, UNSAT, time_limit=60, seed=0, next_step="ocus", hs_solver="ortools")
+    assert seq.complete and len(seq) > 1
+    _check_steps(seq)
@@ -0,0 +1,157 @@
+import itertools
+
+import cpmpy as cp
+import pytest
+
+from factory import load_model
+from explanations.subset import mus, model_rotation, MemoOracle, maxsat, optimal_mcs, compact_mus, enumerate_mcs, SubsetSession
+
+x = cp.intvar(0, 5, shape=4, name="x")
+# two independent conflicts, and a satisfiable component
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+
+# a single nurse, working three days in a row and a single day, with a single day off in between
+WINDOWS = """# One nurse, conflicts between the cover and the consecutive shifts and days off
+SECTION_HORIZON
+# The horizon length in days:
+7
+
+SECTION_SHIFTS
+# ShiftID, Length in mins, Shifts which cannot follow this shift | separated
+D,480,
+
+SECTION_STAFF
+# ID, MaxShifts, MaxTotalMinutes, MinTotalMinutes, MaxConsecutiveShifts, MinConsecutiveShifts, MinConsecutiveDaysOff, MaxWeekends
+A,D=7,3360,0,2,2,2,2
+
+SECTION_DAYS_OFF
+# EmployeeID, DayIndexes (start at zero)
+
+SECTION_SHIFT_ON_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+
+SECTION_SHIFT_OFF_REQUESTS
+# EmployeeID, Day, ShiftID, Weight
+
+SECTION_COVER
+# Day, ShiftID, Requirement, Weight for under, Weight for over
+0,D,1,100,1
+1,D,1,100,1
+2,D,1,100,1
+3,D,0,100,1
+4,D,1,100,1
+5,D,0,100,1
+6,D,0,100,1
+"""
+
+
+def _is_mcs(subset):
+    rest = [cons for cons in SOFT if not any(cons is other for other in subset)]
+    return cp.Model(rest).solve() and all(not cp.Model(rest + [cons]).solve() for cons in subset)
+
+
+@pytest.mark.parametrize("grow, pool", [("sat", None), ("sat", "thread"), ("sat", "process"), ("maxsat", None)])
+def test_enumerate_mcs(grow, pool):
+    found = list(enumerate_mcs(SOFT, grow=grow, pool=pool, n_workers=2))
+    # one of two times one of three constraints
+    assert len(found) == 6 and len({frozenset(map(id, mcs)) for mcs in found}) == 6
+    assert all(_is_mcs(mcs) for mcs in found)
+    # satisfiable constraints have the empty set as their only MCS
+    assert list(enumerate_mcs(SOFT[2:3])) == [[]]
+
+
+def _cost(soft, weights, sat_subset):
+    sat_subset = {id(cons) for cons in sat_subset}
+    return sum(w for cons, w in zip(soft, weights) if id(cons) not in sat_subset)
+
+
+def _optimal_cost(soft, weights, hard=[]):
+    """
+        Lowest total weight of the constraints left out of a satisfiable subset, by trying all subsets.
+    """
+    return min(sum(w for cons, w in zip(soft, weights) if not any(cons is other for other in subset))
+               for k in range(len(soft) + 1) for subset in itertools.combinations(soft, k) if cp.Model(hard, list(subset)).solve())
+
+
+@pytest.mark.parametrize("weights", [[1] * 6, [5, 1, 1, 1, 3, 4], [1, 5, 2, 4, 1, 1], [3, 3, 1, 2, 2, 2]])
+def test_weighted_maxsat(weights):
+    for hard in ([], [x[3] < 4]):
+        found = maxsat(SOFT, hard, weights=weights)
+        assert found.complete and cp.Model(hard, found).solve()
+        assert _cost(SOFT, weights, found) == _optimal_cost(SOFT, weights, hard)
+        correction = optimal_mcs(SOFT, hard, weights=weights)
+        assert sum(w for cons, w in zip(SOFT, weights) if any(cons is other for other in correction)) == _optimal_cost(SOFT, weights, hard)
+
+
+def test_session_queries():
+    session = SubsetSession(SOFT)
+    queries = [([1] * 6, []), ([5, 1, 1, 1, 3, 4], []), ([1, 5, 1, 4, 1, 1], [x[1] < 3]), ([1] * 6, []),
+               ([5, 1, 1, 1, 3, 4], [x[3] < 4]), ([2, 1, 1, 1, 3, 4], [])]
+    for weights, hard in queries:
+        found = session.maxsat(hard=hard, weights=weights)
+        assert cp.Model(hard, found).solve()
+        assert _cost(SOFT, weights, found) == _cost(SOFT, weights, maxsat(SOFT, hard, weights=weights))
+        # an MCS query in between sets a solution hint
+        mcs = session.mcs(hard=hard)
+        assert cp.Model(hard, [cons for cons in SOFT if not any(cons is other for other in mcs)]).solve()
+
+
+def _is_mus(subset):
+    return not cp.Model(subset).solve() and all(cp.Model([other for other in subset if other is not cons]).solve() for cons in subset)
+
+
+def test_mus():
+    for hard in ([], [x[0] < 2], [x[3] < 4]):
+        found = mus(SOFT, hard)
+        assert found.complete and not cp.Model(hard, found).solve()
+        assert all(cp.Model(hard, [other for other in found if other is not cons]).solve() for cons in found)
+    found = mus(SOFT[2:], [x[2] > x[3]])
+    assert len(found) == 1 and found[0] is SOFT[3]
+
+
+def test_model_rotation():
+    # the values satisfy all constraints of the conflict except the first one
+    assert cp.Model(SOFT[4:]).solve()
+    assert model_rotation([3, 4, 5], 3, dict(enumerate(SOFT))) == {3, 4, 5}
+    # changing x[3] would falsify the hard constraint
+    assert cp.Model(SOFT[4:]).solve()
+    assert model_rotation([3, 5], 3, dict(enumerate(SOFT)), hard=[x[3] > 4]) == {3, 5}
+
+
+def test_memo_oracle():
+    assump = cp.boolvar(shape=len(SOFT), name="a")
+    solver = cp.SolverLookup.get("ortools")
+    solver += assump.implies(SOFT)
+    oracle = MemoOracle(solver, dict(zip(assump, SOFT)))
+
+    assert oracle.solve(list(assump[:2])) is False and oracle.n_hits == 0
+    # a superset of a core is UNSAT, without solving
+    assert oracle.solve(list(assump[:3])) is False and oracle.n_hits == 1
+    assert oracle.get_core() == list(assump[:2])
+
+    assert oracle.solve(list(assump[2:4])) is True and oracle.n_hits == 1
+    # a subset of a SAT set is SAT, the stored solution is restored
+    x.clear()
+    assert oracle.solve(list(assump[2:3])) is True and oracle.n_hits == 2
+    assert SOFT[2].value() and SOFT[3].value()
+
+    # new constraints only keep the cores
+    oracle += x[1] < 3
+    assert oracle.solve(list(assump[2:3])) is False and oracle.n_hits == 2
+    assert oracle.solve(list(assump[:2])) is False and oracle.n_hits == 3
+    assert oracle.n_calls == 6
+
+
+def test_compact_mus(tmp_path):
+    (tmp_path / "Windows.txt").write_text(WINDOWS)
+    factory, (model, _) = load_model(str(tmp_path / "Windows.txt"))
+    extra, covers = factory.compact(model.constraints)
+    assert len(covers) == 1 # all window constraints of the nurse in one group
+
+    found = compact_mus(model.constraints, compact=(extra, covers))
+    assert found.complete and _is_mus(found)
+    assert all(any(cons is other for other in model.constraints) for cons in found)
+    assert any(any(cons is other for other in covers[0][1]) for cons in found) # the group was shrunk
+
+    # without the window constraints, the covers are satisfiable
+    assert cp.Model([cons for cons in model.constraints if not any(cons is other for other in covers[0][1])]).solve()
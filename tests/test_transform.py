@@ -0,0 +1,41 @@
+import itertools
+
+import cpmpy as cp
+import pytest
+
+from factory import load_model
+from explanations import transform
+from explanations.transform import get_solver
+
+x = cp.intvar(0, 5, shape=4, name="x")
+# two independent conflicts, and a satisfiable component
+SOFT = [x[0] > 2, x[0] < 2, x[1] > 3, x[2] == x[3], x[3] > 4, x[2] < 3]
+SOLVERS = [name for name in ("ortools", "exact") if cp.SolverLookup.lookup(name).supported()]
+
+
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_assumptions(solver):
+    assump = cp.boolvar(shape=len(SOFT), name="a")
+    # constraints are memoised from the second solver they are posted to
+    for _ in range(3):
+        memo = get_solver(solver)
+        memo += assump.implies(SOFT)
+        memo += SOFT[2]
+        usual = cp.SolverLookup.get(solver)
+        usual += assump.implies(SOFT)
+        usual += SOFT[2]
+        for k in range(len(SOFT) + 1):
+            for subset in itertools.combinations(assump, k):
+                assert memo.solve(assumptions=list(subset)) == usual.solve(assumptions=list(subset))
+    assert all((solver, id(cons)) in transform._transformed for cons in SOFT)
+
+
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_nurse_model(small_instance, solver):
+    _, (model, *_) = load_model(small_instance, "optimization")
+    usual = cp.SolverLookup.get(solver, model)
+    assert usual.solve()
+    for _ in range(3):
+        memo = get_solver(solver, model)
+        assert memo.solve() and memo.objective_value() == usual.objective_value()
+        assert all(cons.value() for cons in model.constraints)
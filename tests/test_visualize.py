@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("matplotlib")
+
+from factory import load_model
+from visualize import visualize, highlight_changes, roster_table, visualize_step
+
+
+def test_roster_html(small_instance):
+    factory, _ = load_model(small_instance)
+    sol = np.ones((factory.n_nurses, factory.data.horizon), dtype=int) # everyone works every day
+    df, css = roster_table(sol, factory)
+    assert roster_table(sol.tolist(), factory)[0] is df and not css.flags.writeable
+
+    table = visualize(sol, factory, as_html=True)
+    assert table.count("<td") == df.size
+    assert all(name in table for name in factory.nurse_names + ["Cover D"])
+    # three nurses on each day, only two or one are required on all days but Monday and Thursday
+    assert visualize(sol, factory, highlight_cover=True, as_html=True).count("color : red;") == 5
+
+    new_sol = sol.copy()
+    new_sol[0, 0] = new_sol[1, 3] = 0
+    assert highlight_changes(new_sol, sol, factory, as_html=True).count("lawngreen") == 2
+    # the pandas Styler shows the same table
+    assert visualize(sol, factory).data is df
+
+
+def test_visualize_step(small_instance):
+    factory, (model, nurse_view) = load_model(small_instance)
+    day_off = next(cons for cons in model.constraints if cons.group[0] == "days_off")
+    var = nurse_view[0, 0]
+    nurse_view.clear()
+    step = ({var : frozenset(range(var.lb, var.ub + 1))}, [day_off], {var : frozenset([0])})
+    table = visualize_step(step, nurse_view, factory, as_html=True)
+    # the derived value is shown, with the day off of the nurse
+    assert var.value() == 0 and all(other.value() is None for other in nurse_view.flat[1:])
+    assert table.count("lightgreen") == 1
@@ -1,61 +1,120 @@
 
+import html
+
 import pandas as pd
 import numpy as np
 
 import matplotlib.pyplot as plt
 
-def visualize(sol, factory, highlight_cover=False):
-    weeks = [f"Week {i + 1}" for i in range(factory.data.horizon // 7)]
-    weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-    nurses = factory.data.staff['name'].tolist()
-
-    df = pd.DataFrame(sol,
-                      columns=pd.MultiIndex.from_product((weeks, weekdays), names=("Week", "Day")),
-                      index=factory.data.staff.name)
-
-
-    total_minutes = df.map(lambda i : ([0] + list(factory.data.shifts.Length))[i] if i is not None else 0).sum(axis=1).astype(int)
+from cpmpy.transformations.get_variables import get_variables
 
-    mapping = factory.idx_to_name
-    df = df.map(lambda v: mapping[v] if v is not None else '')  # convert to shift names
-
-    real_shifts = sorted(set(factory.shift_name_to_idx) - {"-"})
-    total_shifts = pd.DataFrame(columns=pd.MultiIndex.from_product([["#Shifts"], real_shifts]), index=df.index)
-    for shift_type in real_shifts:
-        total_shifts[("#Shifts", shift_type)] = (df == shift_type).sum(axis=1)
-
-    for shift_type in real_shifts:
-        sums = (df == shift_type).sum()  # cover for each shift type
-        req = factory.data.cover["Requirement"][factory.data.cover["ShiftID"] == shift_type]
-        req.index = sums.index
-        df.loc[f'Cover {shift_type}'] = sums.astype(str) + "/" + req.astype(str)
+from explanations.utils import describe, get_visualizer
 
+TABLE_STYLES = [{'selector': '.data', 'props': [('text-align', 'center')]},
+                {'selector': '.col_heading', 'props': [('text-align', 'center')]},
+                {'selector': '.col7', 'props': [('border-left',"2px solid black")]}]
 
-    df = pd.concat([df, total_shifts], axis=1)
-    df["#Minutes"] = total_minutes
-    df = df.fillna(0)
-    df["#Shifts"] = df["#Shifts"].astype(int)
-    df["#Minutes"] = df["#Minutes"].astype(int)
+_tables = dict() # (id(factory), solution) -> (factory, data, css)
+CACHE_SIZE = 16
 
+def visualize(sol, factory, highlight_cover=False, as_html=False):
+    """
+        Show a solution as a table with the shift names, the number of shifts and minutes worked by each nurse
+            and the cover of each shift type.
 
-    subset = (df.index.tolist()[:-len(factory.data.shifts)], df.columns[:-(len(real_shifts)+1)])
-    style = df.style.set_table_styles([{'selector': '.data', 'props': [('text-align', 'center')]},
-                                       {'selector': '.col_heading', 'props': [('text-align', 'center')]},
-                                       {'selector': '.col7', 'props': [('border-left',"2px solid black")]}])
-    style = style.map(lambda v: 'border: 1px solid black', subset=subset)
-    style = style.map(color_shift, factory=factory, subset=subset)  # color cells
-
+        :param: highlight_cover: if True, the cover of a shift on a day is shown in red when it differs from the requirement
+        :param: as_html: if True, return the table as an HTML string rather than as a pandas Styler, which is much faster for large rosters
+    """
+    df, css = roster_table(sol, factory)
     if highlight_cover is True:
+        css = css.copy()
+        n_nurses, horizon = factory.n_nurses, factory.data.horizon
+        fill, req = np.array([val.split('/') for val in df.iloc[n_nurses:, :horizon].to_numpy().ravel()]).T
+        css[n_nurses:, :horizon] += np.where(fill != req, 'color : red;', '').reshape(-1, horizon)
+    return _render(df, css, as_html)
+
+def roster_table(sol, factory):
+    """
+        The table of a solution as shown by `visualize`, and the CSS of each of its cells as an array of strings.
+        Tables of the last few solutions are cached,
+            so showing the same solution again (e.g., for each step of an explanation) only has to add the CSS of that step.
+    """
+    shifts, missing = _shift_indices(sol)
+    key = (id(factory), shifts.tobytes(), missing.tobytes())
+    if key not in _tables:
+        if len(_tables) >= CACHE_SIZE:
+            del _tables[next(iter(_tables))]
+        _tables[key] = (factory,) + _build_table(shifts, missing, factory) # keep factory alive so its id is not reused
+    _, df, css = _tables[key]
+    return df, css
+
+def _shift_indices(sol):
+    values = np.asarray(sol, dtype=object)
+    missing = np.equal(values, None)
+    return np.where(missing, 0, values).astype(int), missing
+
+def _build_table(shifts, missing, factory):
+    n_nurses, horizon = shifts.shape
+    weeks = [f"Week {i + 1}" for i in range(horizon // 7)]
+    weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 
-        def highlight(val):
-            fill, req = val.split('/')
-            if fill == req:
-                return ''
-            return 'color : red'
-        subset = (df.index.tolist()[-len(factory.data.shifts):], df.columns[:-2])
-        style = style.map(highlight, subset=subset)
-
-    return style
+    real_shifts = sorted(set(factory.shift_name_to_idx) - {"-"})
+    is_shift = (shifts[..., None] == [factory.shift_name_to_idx[name] for name in real_shifts]) & ~missing[..., None]
+    lengths = np.array([0] + list(factory.data.shifts.Length))
+
+    cover = factory.data.cover
+    requirements = [cover["Requirement"][cover["ShiftID"] == name].to_numpy() for name in real_shifts]
+    fill = is_shift.sum(axis=0).T
+    names = np.array(factory.idx_to_name, dtype=object)
+    grid = np.concatenate([np.where(missing, '', names[shifts]),
+                           np.char.add(np.char.add(fill.astype(str), "/"), np.array(requirements).astype(str)).astype(object)])
+
+    index = pd.Index(factory.data.staff.name.tolist() + [f'Cover {name}' for name in real_shifts], name=factory.data.staff.name.name)
+    df = pd.DataFrame(grid, index=index, columns=pd.MultiIndex.from_product((weeks, weekdays)))
+    n_covers = len(real_shifts)
+    for i, name in enumerate(real_shifts):
+        df[("#Shifts", name)] = np.concatenate([is_shift[..., i].sum(axis=1), np.zeros(n_covers, dtype=int)])
+    df[("#Minutes", "")] = np.concatenate([lengths[shifts].sum(axis=1), np.zeros(n_covers, dtype=int)])
+
+    colors = np.array([color_shift(name, factory) for name in factory.idx_to_name], dtype=object)
+    css = np.full(df.shape, '', dtype=object)
+    css[:n_nurses, :horizon] = 'border: 1px solid black; ' + np.where(missing, color_shift(None, factory), colors[shifts]) + ';'
+    css.setflags(write=False)
+    return df, css
+
+def _render(df, css, as_html=False):
+    if as_html:
+        return roster_html(df, css)
+    css = pd.DataFrame(css, index=df.index, columns=df.columns)
+    return df.style.set_table_styles(TABLE_STYLES).apply(apply_styles, styles=css, axis=None)
+
+def roster_html(df, css):
+    """
+        HTML table of a roster table and the CSS of its cells, as made by `roster_table`.
+        Builds the same table as the pandas Styler, without going through its generic rendering.
+    """
+    weeks = df.columns.get_level_values(0)
+    header = ['<tr><th></th>' + ''.join(f'<th colspan="{len(list(group))}" class="col_heading">{html.escape(str(week))}</th>'
+                                        for week, group in _runs(weeks)) + '</tr>',
+              '<tr><th>' + html.escape(str(df.index.name or '')) + '</th>'
+              + ''.join(f'<th class="col_heading">{html.escape(str(day))}</th>' for day in df.columns.get_level_values(1)) + '</tr>']
+
+    n_cols = df.shape[1]
+    classes = np.array([f'data col{j}' for j in range(n_cols)], dtype=object)
+    values = np.vectorize(lambda v : html.escape(str(v)), otypes=[object])(df.to_numpy(dtype=object))
+    cells = '<td class="' + classes + '" style="' + np.asarray(css, dtype=object) + '">' + values + '</td>'
+    rows = ['<tr><th>' + html.escape(str(name)) + '</th>' + ''.join(row) + '</tr>' for name, row in zip(df.index, cells)]
+
+    style = ''.join(f'.roster {style["selector"]} {{' + '; '.join(f'{prop}: {val}' for prop, val in style["props"]) + '}'
+                    for style in TABLE_STYLES)
+    return f'<style>{style}</style><table class="roster"><thead>{"".join(header)}</thead><tbody>{"".join(rows)}</tbody></table>'
+
+def _runs(values):
+    start = 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            yield values[start], range(start, i)
+            start = i
 
 def color_shift(shift, factory):
     # cmap = ["yellow", "blue","red", "orange", "cyan"]
@@ -66,22 +125,14 @@ def color_shift(shift, factory):
     r,g,b = (round(255*val) for val in cmap.colors[factory.shift_name_to_idx[shift]])
     return f"background-color: rgb({r},{g},{b})"
 
-def highlight_changes(new_sol, old_sol, factory):
-
-    style = visualize(new_sol, factory)
-    shape = style.data.shape
+def highlight_changes(new_sol, old_sol, factory, as_html=False):
 
-    neq = new_sol != old_sol
-    diff0 = shape[0] - neq.shape[0]
-    diff1 = shape[1] - neq.shape[1]
-    neq = np.pad(neq, ((0, diff0), (0, diff1)), constant_values=False)
+    df, css = roster_table(new_sol, factory)
+    neq = np.asarray(new_sol) != np.asarray(old_sol)
 
-    df_css = pd.DataFrame(neq)
-    df_css.index = style.index
-    df_css.columns = style.columns
-
-    df_css = df_css.map(lambda x: "border: 5px solid lawngreen" if x else "")
-    return style.apply(apply_styles, styles=df_css, axis=None)
+    css = css.copy()
+    css[:neq.shape[0], :neq.shape[1]] += np.where(neq, "border: 5px solid lawngreen;", "")
+    return _render(df, css, as_html)
 
 # Function to apply CSS styles to each cell
 def apply_styles(x, styles):
@@ -89,34 +140,36 @@ def apply_styles(x, styles):
     return styles
 
 
-def visualize_constraints(constraints, nurse_view, factory, do_clear=True):
+def constraints_css(constraints, df):
+    """
+        CSS added to the cells of a roster table to show the given constraints.
+    """
+    delta = pd.DataFrame('', index=df.index, columns=df.columns)
+    for cons in constraints:
+        visualize_cons = get_visualizer(cons)
+        if visualize_cons is not None:
+            visualize_cons(delta)
+    return delta.to_numpy(dtype=object)
+
+def visualize_constraints(constraints, nurse_view, factory, do_clear=True, as_html=False):
     if do_clear:
         nurse_view.clear()
 
-    style = visualize(nurse_view.value(), factory)
-
-    df_css = pd.DataFrame(index=style.index, columns=style.columns)
-    df_css.fillna("", inplace=True)
-    for cons in constraints:
-        if hasattr(cons, "visualize"):
-            cons.visualize(df_css)
-    return style.apply(apply_styles, styles=df_css, axis=None)
+    df, css = roster_table(nurse_view.value(), factory)
+    return _render(df, css + constraints_css(constraints, df), as_html)
 
-def visualize_step(step, nurse_view, factory):
+def visualize_step(step, nurse_view, factory, as_html=False):
     E, S, N = step
-    print(f"Propagating constraint: {next(iter(S))}")
-    if any(len(vals) == 0 for vals in N.values()):
+    print(f"Propagating constraint: {describe(next(iter(S)))}")
+    # only variables in the scope of the step can be derived
+    changed = [v for v in get_variables(S) if v in E and E[v] > N[v]]
+    if any(len(N[v]) == 0 for v in changed):
         # found UNSAT
-        return visualize_constraints(S, nurse_view, factory=factory, do_clear=False)
+        return visualize_constraints(S, nurse_view, factory=factory, do_clear=False, as_html=as_html)
     else:
-        for v in E:
-            if E[v] > N[v]:
-                # derived something for this variable
-                assert len(N[v]) <= 1, "only allow assigments here... (TODO? how to visualize negative facts?)"
-                # hacky way to find index
-                r = int(v.name.split(",")[0].split('[')[1])
-                c = int(v.name.split(",")[1].split(']')[0])
-                nurse_view[r, c]._value = next(iter(N[v]))
-
-    return visualize_constraints(S, nurse_view, factory=factory, do_clear=False)
+        for v in changed:
+            # derived something for this variable
+            assert len(N[v]) <= 1, "only allow assigments here... (TODO? how to visualize negative facts?)"
+            nurse_view[factory.roster_cell[v]]._value = next(iter(N[v]))
 
+    return visualize_constraints(S, nurse_view, factory=factory, do_clear=False, as_html=as_html)